@@ -2,60 +2,222 @@
 Author: Zeeshan Hameed
 """
 
+from runtime import configure_threads, get_heavy_executor
+configure_threads() ## Before TensorFlow, PyTorch and the tokenizers are imported
+
 import streamlit as st
 from datetime import datetime, timedelta
+import threading
+import time
 import pytz
+import pandas as pd
 from text_data_pipeline import TextDataPipeline
-from btc_data_pipeline import BitcoinDataPipeline
-from config import LLM
+from btc_data_pipeline import BitcoinDataPipeline, MarketDataPipeline
+from config import LLM, METRICS_PORT, METRICS_HOST, INTRADAY_PREDICTIONS, WARM_SNAPSHOT_DIR, CHART_REFRESH_MINUTES, SYMBOLS
+from config import PREDICTION_RETRY_MINUTES
 from app_utils import *
+from metrics import timer, start_metrics_server, log_metrics
+from model_registry import ModelRegistry
+from warm_snapshot import has_snapshot, boot
+from timeseries_store import TimeSeriesStore
 
 
 @st.cache_resource
 def initialize_pipelines_and_models():
     """
-    Initializes the pipelines and models required for text and Bitcoin data processing.
+    Initializes the pipelines and the model registry required for text and Bitcoin data processing,
+    from the warm snapshot when the image was built with one. Both pipelines share the time-series store.
 
     Returns:
         textDataPipeline (TextDataPipeline): The pipeline for text data processing.
         bitcoinDataPipeline (BitcoinDataPipeline): The pipeline for Bitcoin data processing.
-        x_scaler (Scaler): The scaler for input data.
-        y_high_scaler (Scaler): The scaler for high target data.
-        y_low_scaler (Scaler): The scaler for low target data.
-        high_model (Model): The model for predicting high values.
-        low_model (Model): The model for predicting low values.
+        modelRegistry (ModelRegistry): The registry serving the active version of the models and scalers.
     """
-    textDataPipeline = TextDataPipeline(LLM)
-    bitcoinDataPipeline = BitcoinDataPipeline()
+    store = TimeSeriesStore()
+    if has_snapshot(WARM_SNAPSHOT_DIR):
+        textDataPipeline, bitcoinDataPipeline, modelRegistry, _ = boot(WARM_SNAPSHOT_DIR, store=store)
+    else:
+        textDataPipeline = TextDataPipeline(LLM, store=store)
+        bitcoinDataPipeline = BitcoinDataPipeline(store)
+
+        modelRegistry = ModelRegistry()
+        modelRegistry.current() ## Load and warm up the active version before serving
 
-    x_scaler, y_high_scaler, y_low_scaler, high_model, low_model = load_models()
+    if METRICS_PORT is not None:
+        start_metrics_server(METRICS_PORT, METRICS_HOST)
     
-    return textDataPipeline, bitcoinDataPipeline, x_scaler, y_high_scaler, y_low_scaler, high_model, low_model
+    return textDataPipeline, bitcoinDataPipeline, modelRegistry
+
+
+@st.cache_resource
+def get_market_pipeline():
+    """
+    Returns the multi-symbol pipeline of the daily charts, shared by every session. Its panel is downloaded the
+    first time a symbol other than Bitcoin is selected.
+
+    Returns:
+        MarketDataPipeline: The pipeline of SYMBOLS.
+    """
+    return MarketDataPipeline(SYMBOLS)
 
 
-def update_predictions(textDataPipeline, bitcoinDataPipeline, x_scaler, high_model, y_high_scaler, low_model, y_low_scaler):
+@timer('update_predictions', 'Time of a full prediction cycle')
+def update_predictions(textDataPipeline, bitcoinDataPipeline, x_scaler, high_model, y_high_scaler, low_model, y_low_scaler,
+                       modelRegistry=None):
     """
     Updates the predictions for the high and low prices of Bitcoin based on the given data.
 
+    Args:
+        modelRegistry (ModelRegistry, optional): The registry serving the models, whose memory is included in
+            the memory report of the cycle.
+
     Returns:
         high_pred (float): Predicted high price.
         low_pred (float): Predicted low price.
     """
-    with st.spinner("Getting sentiment score..."):
-        data = getData(textDataPipeline, bitcoinDataPipeline, x_scaler)
-    
-    with st.spinner("Predicting high price..."):
-        high_pred = predict_price(high_model, data, y_high_scaler, flag=True)
-    
-    with st.spinner("Predicting low price..."):
-        low_pred = predict_price(low_model, data, y_low_scaler, flag=False)
+    data = getData(textDataPipeline, bitcoinDataPipeline, x_scaler)
+    high_pred = predict_price(high_model, data, y_high_scaler, flag=True)
+    low_pred = predict_price(low_model, data, y_low_scaler, flag=False)
     
     # Save predictions to CSV
     save_predictions(high_pred, low_pred)
+
+    # Log a snapshot of the stage timings and of the memory held by the process for this cycle
+    log_metrics(extra={'memory': memory_report(textDataPipeline, bitcoinDataPipeline, modelRegistry)})
     
     return high_pred, low_pred
 
 
+@st.cache_resource
+def get_prediction_tasks():
+    """
+    Returns the process-wide executor and prediction futures shared by every session.
+
+    Both tasks run on the dedicated executor of the heavy work (HEAVY_WORKERS threads, so the hourly refresh never
+    waits behind the daily scraping and scoring), and their model calls share the inference slots of `runtime`.
+
+    Returns:
+        dict: The executor, the futures keyed by prediction day (and by hour for the intraday predictions) and
+            the lock guarding them.
+    """
+    return {
+        'executor': get_heavy_executor(),
+        'futures': {},
+        'intraday_futures': {},
+        'lock': threading.Lock(),
+    }
+
+
+def get_prediction_future(prediction_day, *args):
+    """
+    Returns the prediction task for the given day, starting it in the background if no session has started it yet.
+
+    Sessions joining while the task is running attach to the same future instead of starting a new one.
+    A task that failed is started again once PREDICTION_RETRY_MINUTES have passed.
+
+    Args:
+        prediction_day (str): The day the prediction is made for.
+        *args: The arguments of `update_predictions`.
+
+    Returns:
+        concurrent.futures.Future: The future resolving to (high_pred, low_pred).
+    """
+    return _shared_future('futures', prediction_day, update_predictions, *args)
+
+
+def get_intraday_future(prediction_hour, *args):
+    """
+    Returns the intraday prediction task of the given hour, starting it in the background if no session has
+    started it yet. A task that failed is started again once PREDICTION_RETRY_MINUTES have passed.
+
+    Args:
+        prediction_hour (str): The hour the predictions are refreshed for.
+        *args: The arguments of `update_intraday_predictions`.
+
+    Returns:
+        concurrent.futures.Future: The future resolving to the new intraday predictions.
+    """
+    return _shared_future('intraday_futures', prediction_hour, update_intraday_predictions, *args)
+
+
+def _shared_future(kind, key, function, *args):
+    tasks = get_prediction_tasks()
+    with tasks['lock']:
+        future = tasks[kind].get(key)
+        if future is None or _retry_due(future):
+            future = tasks['executor'].submit(function, *args)
+            future.add_done_callback(_record_failure)
+            tasks[kind] = {key: future}
+    return future
+
+
+def _record_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        future.failed_at = time.monotonic()
+
+
+def _retry_due(future):
+    ### Every rerun and fragment tick would otherwise rerun the whole cycle against a failing source
+    if future.cancelled():
+        return True
+    failed_at = getattr(future, 'failed_at', None)
+    return failed_at is not None and time.monotonic() - failed_at >= PREDICTION_RETRY_MINUTES * 60
+
+
+def render_prediction(placeholder, high_pred=None, low_pred=None):
+    """
+    Renders the prediction card, or a pending card while the prediction is not available yet.
+
+    Args:
+        placeholder: The Streamlit placeholder holding the card.
+        high_pred (float, optional): Predicted high price.
+        low_pred (float, optional): Predicted low price.
+    """
+    if high_pred is None or low_pred is None:
+        placeholder.markdown(f"""
+            <div style="display: flex; align-items: center; justify-content: center; height: 100%; flex-direction: column; padding-top: 80px;">
+                <div style="background-color: #f0f0f0; color: black; padding: 10px 20px; margin: 10px; border-radius: 5px; text-align: center;">
+                    Predicting...
+                </div>
+            </div>
+        """, unsafe_allow_html=True)
+    else:
+        placeholder.markdown(f"""
+            <div style="display: flex; align-items: center; justify-content: center; height: 100%; flex-direction: column; padding-top: 140px;">
+                <div style="background-color: #13a9bd; color: white; padding: 10px 20px; margin: 10px; border-radius: 5px; text-align: center;">
+                    Predicted High: ${high_pred:.2f}
+                </div>
+                <div style="background-color: #c92516; color: white; padding: 10px 20px; margin: 10px; border-radius: 5px; text-align: center;">
+                    Predicted Low: ${low_pred:.2f}
+                </div>
+            </div>
+        """, unsafe_allow_html=True)
+
+
+@st.fragment(run_every=timedelta(minutes=CHART_REFRESH_MINUTES))
+def hourly_chart(page_prediction_day):
+    """
+    Renders the hourly chart and refreshes it every CHART_REFRESH_MINUTES. Only this fragment re-executes, so
+    the rest of the page is neither rebuilt nor sent again. The whole page reruns once a day, when the
+    prediction day changes.
+
+    Args:
+        page_prediction_day (str): The prediction day of the last full run of the page.
+    """
+    now = datetime.now(timezone)
+    if (now - timedelta(hours=7)).strftime('%Y-%m-%d') != page_prediction_day:
+        st.rerun() ## New daily prediction: refresh the whole page
+
+    fig = plot_hourly_data(bitcoinDataPipeline)
+    st.plotly_chart(fig, use_container_width=True)
+
+    ### Next-24h predictions refreshed every hour from the hourly base series just updated by the chart
+    if INTRADAY_PREDICTIONS:
+        get_intraday_future(
+            now.strftime('%Y-%m-%d %H'), textDataPipeline, bitcoinDataPipeline, x_scaler, high_model, y_high_scaler, low_model, y_low_scaler
+        )
+
+
 
 timezone = pytz.timezone("America/New_York")
 st.set_page_config(layout="wide", page_title="BitAnalytica")
@@ -69,131 +231,98 @@ st.markdown(
 )
 
 
-textDataPipeline, bitcoinDataPipeline, x_scaler, y_high_scaler, y_low_scaler, high_model, low_model = initialize_pipelines_and_models()
-if 'high_pred' not in st.session_state or 'low_pred' not in st.session_state:
-    st.session_state.high_pred = None
-    st.session_state.low_pred = None
+textDataPipeline, bitcoinDataPipeline, modelRegistry = initialize_pipelines_and_models()
+
+### Pick up a new active version of the models in the background, the current one serves until it is warm
+modelRegistry.refresh()
+x_scaler, y_high_scaler, y_low_scaler, high_model, low_model = modelRegistry.current().models
+
+### Predictions are refreshed every 24 hours at 7 AM UTC-4, so the prediction day only changes at 7 AM
+current_time = datetime.now(timezone)
+prediction_day = (current_time - timedelta(hours=7)).strftime('%Y-%m-%d')
+prediction_future = get_prediction_future(
+    prediction_day, textDataPipeline, bitcoinDataPipeline, x_scaler, high_model, y_high_scaler, low_model, y_low_scaler, modelRegistry
+)
 
 
 ### Creating two columns for first row
 col1, col2 = st.columns([8, 2])
 
-with col1:
+with col2:
     st.markdown(
         """
-        <div style="text-align: center; justify-content: center; padding-left: 300px">
-            <h3>Bitcoin Hourly Data with Technical Indicators</h3>
+        <div style="padding-top: 80px;">
+            <h3>Predictions</h3>
         </div>
         """,
         unsafe_allow_html=True
     )
-    fig = plot_hourly_data(bitcoinDataPipeline)
-    st.plotly_chart(fig, use_container_width=True)
+    prediction_placeholder = st.empty()
+    if prediction_future.done() and prediction_future.exception() is None:
+        render_prediction(prediction_placeholder, *prediction_future.result())
+    else:
+        render_prediction(prediction_placeholder)
 
-with col2:
+with col1:
     st.markdown(
         """
-        <div style="padding-top: 80px;">
-            <h3>Predictions</h3>
+        <div style="text-align: center; justify-content: center; padding-left: 300px">
+            <h3>Bitcoin Hourly Data with Technical Indicators</h3>
         </div>
         """,
         unsafe_allow_html=True
     )
-    prediction_placeholder = st.empty()
-
-    if st.session_state.high_pred is None or st.session_state.low_pred is None:
-        prediction_placeholder.markdown(f"""
-            <div style="display: flex; align-items: center; justify-content: center; height: 100%; flex-direction: column; padding-top: 80px;">
-                <div style="background-color: #f0f0f0; color: black; padding: 10px 20px; margin: 10px; border-radius: 5px; text-align: center;">
-                    Predicting...
-                </div>
-            </div>
-        """, unsafe_allow_html=True)
-        
-        high_pred, low_pred = update_predictions(
-            textDataPipeline, bitcoinDataPipeline, x_scaler, high_model, y_high_scaler, low_model, y_low_scaler
-        )
-        
-        st.session_state.high_pred = high_pred
-        st.session_state.low_pred = low_pred
-        
-        prediction_placeholder.markdown(f"""
-            <div style="display: flex; align-items: center; justify-content: center; height: 100%; flex-direction: column; padding-top: 140px;">
-                <div style="background-color: #13a9bd; color: white; padding: 10px 20px; margin: 10px; border-radius: 5px; text-align: center;">
-                    Predicted High: ${st.session_state.high_pred:.2f}
-                </div>
-                <div style="background-color: #c92516; color: white; padding: 10px 20px; margin: 10px; border-radius: 5px; text-align: center;">
-                    Predicted Low: ${st.session_state.low_pred:.2f}
-                </div>
-            </div>
-        """, unsafe_allow_html=True)
-    else:
-        prediction_placeholder.markdown(f"""
-            <div style="display: flex; align-items: center; justify-content: center; height: 100%; flex-direction: column; padding-top: 140px;">
-                <div style="background-color: #13a9bd; color: white; padding: 10px 20px; margin: 10px; border-radius: 5px; text-align: center;">
-                    Predicted High: ${st.session_state.high_pred:.2f}
-                </div>
-                <div style="background-color: #c92516; color: white; padding: 10px 20px; margin: 10px; border-radius: 5px; text-align: center;">
-                    Predicted Low: ${st.session_state.low_pred:.2f}
-                </div>
-            </div>
-        """, unsafe_allow_html=True)
+    hourly_chart(prediction_day)
 
 
 
-current_time = datetime.now(timezone)
 start_date = (datetime.now() - timedelta(days=45)).strftime('%Y-%m-%d')
 end_date = datetime.now().strftime('%Y-%m-%d')
-daily_plots = plot_daily_data(bitcoinDataPipeline, start_date, end_date)
 
 st.markdown(
     """
     <div style="text-align: center;">
-        <h2>Bitcoin Technical Analysis Daily Chart (Last 45 Days)</h2>
+        <h2>Technical Analysis Daily Chart (Last 45 Days)</h2>
     </div>
     """,
     unsafe_allow_html=True
 )
+### Bitcoin is charted from the prediction pipeline, the other symbols from the shared multi-symbol panel
+selected_symbol = st.selectbox('Symbol', SYMBOLS)
+daily_plots = plot_daily_data(bitcoinDataPipeline, start_date, end_date, selected_symbol, get_market_pipeline())
 for i in range(0, len(daily_plots), 2):
     cols = st.columns(2)
     for col, plot in zip(cols, daily_plots[i:i+2]):
         col.plotly_chart(plot, use_container_width=True)
 
 
+### Range analytics between any two dates, answered from the precomputed range index
+st.markdown(
+    """
+    <div style="text-align: center;">
+        <h2>Range Analytics</h2>
+    </div>
+    """,
+    unsafe_allow_html=True
+)
+range_col, timeframe_col = st.columns([3, 1])
+selected_range = range_col.date_input(
+    'Date range', value=(datetime.now().date() - timedelta(days=30), datetime.now().date()), min_value=datetime(2017, 1, 8).date()
+)
+selected_timeframe = timeframe_col.selectbox('Bars', ['1d', '1h'], format_func={'1d': 'Daily', '1h': 'Hourly'}.get)
 
-# Check if it's time to update the predictions and plots (every 24 hours at 7 AM UTC-4)
-if current_time.hour == 7 and current_time.minute == 0:
-    high_pred, low_pred = update_predictions(
-        textDataPipeline, bitcoinDataPipeline, x_scaler, high_model, y_high_scaler, low_model, y_low_scaler
-    )
-    st.session_state.high_pred = high_pred
-    st.session_state.low_pred = low_pred
-
-    prediction_placeholder.markdown(f"""
-        <div style="display: flex; align-items: center; justify-content: center; height: 100%; flex-direction: column; padding-top: 140px;">
-            <div style="background-color: #13a9bd; color: white; padding: 10px 20px; margin: 10px; border-radius: 5px; text-align: center;">
-                Predicted High: ${st.session_state.high_pred:.2f}
-            </div>
-            <div style="background-color: #c92516; color: white; padding: 10px 20px; margin: 10px; border-radius: 5px; text-align: center;">
-                Predicted Low: ${st.session_state.low_pred:.2f}
-            </div>
-        </div>
-    """, unsafe_allow_html=True)
-
-    daily_plots = plot_daily_data(bitcoinDataPipeline, start_date, end_date)
-    
-    for i in range(0, len(daily_plots), 2):
-        cols = st.columns(2)
-        for col, plot in zip(cols, daily_plots[i:i+2]):
-            col.plotly_chart(plot, use_container_width=True)
-
-if 'last_refresh_time' not in st.session_state:
-    st.session_state.last_refresh_time = current_time
-
-if (current_time - st.session_state.last_refresh_time).seconds > 3600:
-    st.session_state.last_refresh_time = current_time
-    st.rerun()
-
+if isinstance(selected_range, tuple) and len(selected_range) == 2:
+    stats = range_analytics(bitcoinDataPipeline, selected_range[0], selected_range[1], selected_timeframe)
+    if stats is None:
+        st.info('No bars in the selected range.')
+    else:
+        metric_cols = st.columns(6)
+        metric_cols[0].metric('Return', f"{stats['return']:.2%}")
+        metric_cols[1].metric('Volatility per bar', 'n/a' if pd.isna(stats['volatility']) else f"{stats['volatility']:.2%}")
+        metric_cols[2].metric('Max drawdown', f"{stats['max_drawdown']:.2%}")
+        metric_cols[3].metric('Highest close', f"${stats['high']:,.2f}")
+        metric_cols[4].metric('Lowest close', f"${stats['low']:,.2f}")
+        metric_cols[5].metric('Avg sentiment', 'n/a' if pd.isna(stats['avg_sentiment']) else f"{stats['avg_sentiment']:.3f}")
 
 
 ### Streamlit layout settings
@@ -237,4 +366,13 @@ st.markdown(
     </div>
     """,
     unsafe_allow_html=True
-)
\ No newline at end of file
+)
+
+
+### Filling in the prediction card once the background task completes (every chart above is already rendered)
+if not prediction_future.done() or prediction_future.exception() is not None:
+    try:
+        high_pred, low_pred = prediction_future.result()
+        render_prediction(prediction_placeholder, high_pred, low_pred)
+    except Exception as e:
+        prediction_placeholder.error(f"Prediction failed: {e}")
@@ -3,14 +3,40 @@ from pytorch_tabnet.tab_model import TabNetRegressor
 from datetime import datetime, timedelta
 import pandas as pd
 import pickle
+import time
 import os
+import threading
+from config import INTRADAY_LATENCY_BUDGET, MARKET_REFRESH_MINUTES
+from metrics import timer, counter, current_rss_bytes
+from runtime import inference_slot
+from prediction_log import get_prediction_log
+from timeseries_store import TimeSeriesStore
 from plot_utils import plot_all_indicators, plot_with_sma, plot_with_ema, plot_with_rsi, plot_with_macd, plot_with_bollinger_bands, plot_with_atr, plot_with_stochastic, plot_with_obv
 
 
-def load_models():
+### The last hourly figure as (key, figure), the key being the bars and predictions it was built from, shared by every session
+_HOURLY_FIGURE = (None, None)
+_HOURLY_FIGURE_LOCK = threading.Lock()
+
+### Files of a model version, relative to the models directory
+DEFAULT_MODEL_FILES = {
+    'x_scaler': 'scalers/x_scaler.pkl',
+    'y_high_scaler': 'scalers/y_high_scaler.pkl',
+    'y_low_scaler': 'scalers/y_low_scaler.pkl',
+    'high_model': 'high/high.keras',
+    'low_model': 'low/low.zip',
+}
+
+
+@timer('load_models', 'Time to load the models and scalers')
+def load_models(root='models', files=DEFAULT_MODEL_FILES):
     """
     Load the pre-trained models and scalers used for prediction.
 
+    Args:
+        root (str, optional): The models directory. Defaults to 'models'.
+        files (dict, optional): The path of each artifact relative to `root`. Defaults to DEFAULT_MODEL_FILES.
+
     Returns:
         x_scaler (object): The scaler used for scaling the input features.
         y_high_scaler (object): The scaler used for scaling the high prediction target.
@@ -19,22 +45,23 @@ def load_models():
         low_model (object): The pre-trained model for low prediction.
     """
 
-    with open('models/scalers/x_scaler.pkl', 'rb') as f:
+    with open(os.path.join(root, files['x_scaler']), 'rb') as f:
         x_scaler = pickle.load(f)
 
-    with open('models/scalers/y_high_scaler.pkl', 'rb') as f:
+    with open(os.path.join(root, files['y_high_scaler']), 'rb') as f:
         y_high_scaler = pickle.load(f)
 
-    with open('models/scalers/y_low_scaler.pkl', 'rb') as f:
+    with open(os.path.join(root, files['y_low_scaler']), 'rb') as f:
         y_low_scaler = pickle.load(f)
 
-    high_model = load_model('models/high/high.keras')
+    high_model = load_model(os.path.join(root, files['high_model']))
     low_model = TabNetRegressor()
-    low_model.load_model('models/low/low.zip')
+    low_model.load_model(os.path.join(root, files['low_model']))
 
     return x_scaler, y_high_scaler, y_low_scaler, high_model, low_model
 
 
+@timer('get_data', 'Time to build the feature row for prediction')
 def getData(textDataPipeline, bitcoinDataPipeline, scaler):
     """
     Retrieves the latest Bitcoin data and sentiment score, combines them into a DataFrame,
@@ -51,8 +78,23 @@ def getData(textDataPipeline, bitcoinDataPipeline, scaler):
     """
     sentiment_score = textDataPipeline.getSentimentScoreForPast24Hours()
     bitcoin_data = bitcoinDataPipeline.getLatestBitcoinData()
-    
-    date = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+    return buildFeatures(sentiment_score, bitcoin_data, scaler)
+
+
+def buildFeatures(sentiment_score, bitcoin_data, scaler, date=None):
+    """
+    Combines yesterday's Bitcoin indicators and sentiment score into a single scaled feature row.
+
+    Parameters:
+    - sentiment_score: A DataFrame of aggregated sentiment scores indexed by date.
+    - bitcoin_data: A DataFrame of Bitcoin data with technical indicators indexed by date.
+    - scaler: An object used for scaling the data.
+    - date: The day of the features, in the format 'YYYY-MM-DD' (default: yesterday).
+
+    Returns:
+    - Transformed data: A DataFrame containing the transformed data.
+    """
+    date = date or (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
     
     try:
         bitcoin_data = bitcoin_data.loc[date]
@@ -83,38 +125,92 @@ def predict_price(model, data, scaler, flag=False):
     Returns:
     - The predicted price as a single value.
     """
+    return predict_prices(model, data, scaler, flag)[0]
+
+
+def predict_prices(model, data, scaler, flag=False):
+    """
+    Predicts the prices of a batch of feature rows in a single model call.
+
+    Parameters:
+    - model: The trained model used for prediction.
+    - data: The scaled feature rows.
+    - scaler: The scaler used to scale the target.
+    - flag: A boolean flag indicating whether the data needs to be reshaped.
+
+    Returns:
+    - numpy.ndarray: The predicted price of every row.
+    """
     if flag:
         data = data.reshape((data.shape[0], 1, data.shape[1]))
-    pred = model.predict(data)
+    with inference_slot(), timer('model_predict', 'Latency of a single model prediction'):
+        pred = model.predict(data)
     pred = scaler.inverse_transform(pred)
-    return pred.flatten()[0]
+    return pred.flatten()
+
+
+def buildIntradayFeatures(sentiment_score, bitcoin_data, scaler):
+    """
+    Combines the 24-hour bars and indicators ending at each hour with the latest sentiment score of its day
+    into scaled feature rows, laid out like `buildFeatures`.
+
+    Parameters:
+    - sentiment_score: A DataFrame of aggregated sentiment scores indexed by date.
+    - bitcoin_data: A DataFrame of 24-hour bars with technical indicators indexed by hour.
+    - scaler: An object used for scaling the data.
+
+    Returns:
+    - Transformed data: The scaled feature rows, one per hour.
+    """
+    if sentiment_score.empty:
+        raise ValueError("No sentiment score available for the intraday predictions")
+    sentiment_score = sentiment_score.set_axis(pd.to_datetime(sentiment_score.index)).sort_index()
+    days = pd.DatetimeIndex(bitcoin_data.index).tz_localize(None).normalize()
+    positions = (sentiment_score.index.searchsorted(days, side='right') - 1).clip(0)
+    data = pd.concat([bitcoin_data, sentiment_score.iloc[positions].set_axis(bitcoin_data.index)], axis=1)
+    return scaler.transform(data)
+
 
 def plot_hourly_data(bitcoinDataPipeline):
     """
-    Plots the hourly data for Bitcoin.
+    Plots the hourly data for Bitcoin. Only the new bars are downloaded, and the figure is rebuilt only if a bar,
+    a daily prediction or an intraday prediction was added or revised since the last call. The sessions share the
+    figure, and only one of them rebuilds it while the others wait.
 
     Args:
         bitcoinDataPipeline: An instance of the BitcoinDataPipeline class.
 
     Returns:
-        fig: The matplotlib figure object containing the plotted data.
+        fig: The plotly figure object containing the plotted data.
     """
-    hourly_data = bitcoinDataPipeline.getHourlyData()
+    base = bitcoinDataPipeline.updateBaseSeries().base
     start_date = (datetime.now() - timedelta(days=5)).strftime('%Y-%m-%d')
     end_date = datetime.now().strftime('%Y-%m-%d')
-    fig = plot_all_indicators(hourly_data, start_date, end_date, prediction_file='data/predictions.csv')
-    return fig
+    prediction_log = get_prediction_log()
+    key = (start_date, end_date, base.index[-1], tuple(base.iloc[-1]), prediction_log.last_prediction_id(), prediction_log.last_intraday())
+
+    global _HOURLY_FIGURE
+    with _HOURLY_FIGURE_LOCK:
+        cached_key, figure = _HOURLY_FIGURE
+        if cached_key != key:
+            hourly_data = bitcoinDataPipeline.getHourlyData(refresh=False)
+            figure = plot_all_indicators(hourly_data, start_date, end_date, prediction_log)
+            _HOURLY_FIGURE = (key, figure)
+    return figure
 
 
 
-def plot_daily_data(bitcoinDataPipeline, start_date, end_date):
+def plot_daily_data(bitcoinDataPipeline, start_date, end_date, symbol='BTC-USD', marketDataPipeline=None):
     """
-    Plots various technical indicators based on daily Bitcoin data.
+    Plots various technical indicators based on daily data, of Bitcoin or of another symbol of the market pipeline.
 
     Args:
         bitcoinDataPipeline (object): An object representing the Bitcoin data pipeline.
         start_date (str): The start date for the data range.
         end_date (str): The end date for the data range.
+        symbol (str, optional): The Yahoo Finance ticker plotted. Defaults to 'BTC-USD'.
+        marketDataPipeline (MarketDataPipeline, optional): The pipeline of the symbols other than 'BTC-USD'.
+            Bitcoin is always read from `bitcoinDataPipeline`, the data the models are fed from.
 
     Returns:
         list: A list of plots for each technical indicator.
@@ -122,45 +218,129 @@ def plot_daily_data(bitcoinDataPipeline, start_date, end_date):
     """
     from config import SMA7, SMA14, EMA7, EMA14, RSI, MACD, SIGNAL_LINE ,BOLLINGER_SMA
     from config import UPPER_BAND_BB, LOWER_BAND_BB, ATR, K, D, OBV
-    daily_data = bitcoinDataPipeline.getLatestBitcoinData()
+    if symbol == 'BTC-USD' or marketDataPipeline is None:
+        daily_data, asset = bitcoinDataPipeline.getLatestBitcoinData(), 'Bitcoin'
+    else:
+        daily_data, asset = marketDataPipeline.getSymbolData(symbol, timedelta(minutes=MARKET_REFRESH_MINUTES)), symbol
     plots = []
-    plots.append(plot_with_sma(daily_data, start_date, end_date, SMA7, SMA14))
-    plots.append(plot_with_ema(daily_data, start_date, end_date, EMA7, EMA14))
-    plots.append(plot_with_rsi(daily_data, start_date, end_date, RSI))
-    plots.append(plot_with_macd(daily_data, start_date, end_date, MACD, SIGNAL_LINE))
-    plots.append(plot_with_bollinger_bands(daily_data, start_date, end_date, BOLLINGER_SMA, UPPER_BAND_BB, LOWER_BAND_BB))
-    plots.append(plot_with_atr(daily_data, start_date, end_date, ATR))
-    plots.append(plot_with_stochastic(daily_data, start_date, end_date, K, D))
-    plots.append(plot_with_obv(daily_data, start_date, end_date, OBV))
+    plots.append(plot_with_sma(daily_data, start_date, end_date, SMA7, SMA14, asset))
+    plots.append(plot_with_ema(daily_data, start_date, end_date, EMA7, EMA14, asset))
+    plots.append(plot_with_rsi(daily_data, start_date, end_date, RSI, asset))
+    plots.append(plot_with_macd(daily_data, start_date, end_date, MACD, SIGNAL_LINE, asset))
+    plots.append(plot_with_bollinger_bands(daily_data, start_date, end_date, BOLLINGER_SMA, UPPER_BAND_BB, LOWER_BAND_BB, asset))
+    plots.append(plot_with_atr(daily_data, start_date, end_date, ATR, asset))
+    plots.append(plot_with_stochastic(daily_data, start_date, end_date, K, D, asset))
+    plots.append(plot_with_obv(daily_data, start_date, end_date, OBV, asset))
     return plots
 
 
 def save_predictions(high_pred, low_pred):
     """
-    Saves the predictions to a CSV file in the data folder.
+    Appends the predictions of the day to the prediction log in the data folder.
 
     Args:
         high_pred (float): Predicted high price.
         low_pred (float): Predicted low price.
     """
-    os.makedirs('data', exist_ok=True)
-    file_path = os.path.join('data', 'predictions.csv')
     current_date = datetime.now().strftime('%Y-%m-%d')
-    
-    new_data = pd.DataFrame({
-        'date': [current_date],
-        'predicted_high': [high_pred],
-        'predicted_low': [low_pred]
-    })
-
-    if os.path.exists(file_path):
-        existing_data = pd.read_csv(file_path)
-
-        if current_date in existing_data['date'].values:
-            existing_data.loc[existing_data['date'] == current_date, ['predicted_high', 'predicted_low']] = [high_pred, low_pred]
-        else:
-            existing_data = pd.concat([existing_data, new_data], ignore_index=True)
-        
-        existing_data.to_csv(file_path, index=False)
-    else:
-        new_data.to_csv(file_path, index=False)
\ No newline at end of file
+    get_prediction_log().append(current_date, high_pred, low_pred)
+
+
+@timer('intraday_refresh', 'Time of an hourly intraday prediction refresh')
+def update_intraday_predictions(textDataPipeline, bitcoinDataPipeline, x_scaler, high_model, y_high_scaler, low_model, y_low_scaler,
+                                prediction_log=None, budget=INTRADAY_LATENCY_BUDGET):
+    """
+    Predicts the high and low of the next 24 hours at every hour not predicted yet, and logs them.
+
+    The features come from the hourly base series (only the new bars are downloaded) and the cached sentiment
+    score, and each model runs once on the whole batch of hours, so a refresh stays within a fixed budget.
+
+    Args:
+        textDataPipeline: An instance of the TextDataPipeline class.
+        bitcoinDataPipeline: An instance of the BitcoinDataPipeline class.
+        x_scaler, high_model, y_high_scaler, low_model, y_low_scaler: The models and scalers of the daily predictions.
+        prediction_log (PredictionLog, optional): The log the predictions are appended to. Defaults to the default log.
+        budget (float, optional): The seconds a refresh may take. Defaults to INTRADAY_LATENCY_BUDGET.
+
+    Returns:
+        pandas.DataFrame: The new 'predicted_high' and 'predicted_low' indexed by hour (naive UTC).
+    """
+    start = time.perf_counter()
+    prediction_log = prediction_log or get_prediction_log()
+    last = prediction_log.last_intraday()
+
+    features = bitcoinDataPipeline.getIntradayFeatures()
+    hours = pd.DatetimeIndex(features.index)
+    hours = hours.tz_convert('UTC').tz_localize(None) if hours.tz is not None else hours
+    features = features.set_axis(hours)
+    if last is not None:
+        features = features[features.index > last]
+    if features.empty:
+        return pd.DataFrame(columns=['predicted_high', 'predicted_low'])
+
+    data = buildIntradayFeatures(textDataPipeline.getCachedSentimentScores(), features, x_scaler)
+    predictions = pd.DataFrame({
+        'predicted_high': predict_prices(high_model, data, y_high_scaler, flag=True),
+        'predicted_low': predict_prices(low_model, data, y_low_scaler, flag=False),
+    }, index=features.index)
+    prediction_log.append_intraday(predictions)
+
+    elapsed = time.perf_counter() - start
+    if elapsed > budget:
+        counter('intraday_over_budget', 'Intraday refreshes slower than their latency budget').inc()
+        print(f"Intraday refresh of {len(predictions)} hours took {elapsed:.2f}s, over its {budget:.1f}s budget")
+    return predictions
+
+
+def memory_report(textDataPipeline, bitcoinDataPipeline, modelRegistry=None):
+    """
+    Breaks down the memory held by the serving process.
+
+    Args:
+        textDataPipeline: An instance of the TextDataPipeline class.
+        bitcoinDataPipeline: An instance of the BitcoinDataPipeline class.
+        modelRegistry (optional): The ModelRegistry serving the models.
+
+    Returns:
+        dict: The resident memory of the process and the share of the sentiment model, the cached frames and
+            each loaded model version, in MB.
+    """
+    frames = {}
+    if bitcoinDataPipeline.btc is not None:
+        frames['daily'] = bitcoinDataPipeline.btc
+    if bitcoinDataPipeline.timeframes is not None:
+        frames['base'] = bitcoinDataPipeline.timeframes.base
+        frames.update(bitcoinDataPipeline.timeframes.frames)
+
+    report = {
+        'rss_mb': current_rss_bytes() / 2**20,
+        'sentiment_model_mb': textDataPipeline.modelMemoryBytes() / 2**20,
+        'frames_mb': {name: frame.memory_usage(deep=True).sum() / 2**20 for name, frame in frames.items()},
+    }
+    if modelRegistry is not None:
+        report['model_versions'] = modelRegistry.report()
+    return report
+
+
+def range_analytics(bitcoinDataPipeline, start_date, end_date, timeframe='1d'):
+    """
+    Returns the return, volatility, max drawdown, high and low close and average sentiment between two dates,
+    from the range index of the timeframe (updated with the bars and sentiment added since the last call).
+
+    Args:
+        bitcoinDataPipeline: An instance of the BitcoinDataPipeline class.
+        start_date (str or date): The start of the range.
+        end_date (str or date): The end of the range (inclusive).
+        timeframe (str, optional): The bars to analyse ('1d' or '1h'). Defaults to '1d'.
+
+    Returns:
+        dict or None: The analytics (see `RangeIndex.query`), or None if the range has no bar.
+    """
+    ### The index is shared by every session: read its last bar, update it and query it without another session in between
+    with bitcoinDataPipeline.rangeLock:
+        index = bitcoinDataPipeline.rangeIndexes.get(timeframe)
+        since = pd.Timestamp(index.timestamps[-1]).strftime('%Y-%m-%d') if index is not None and len(index) else None
+        store = bitcoinDataPipeline.store or TimeSeriesStore() ## The store the app writes to, the default one without
+        sentiment = store.read_daily_sentiment(start=since)['aggregated_sentiment']
+        return bitcoinDataPipeline.getRangeIndex(timeframe, sentiment=sentiment).query(start_date, end_date)
+
@@ -0,0 +1,391 @@
+"""
+Author: Zeeshan Hameed
+
+Offline, deterministic benchmarks of the pipeline stages on recorded fixtures (see `profile_run.py record`).
+
+Usage:
+    python benchmarks.py --fixtures fixtures/day
+    python benchmarks.py --fixtures fixtures/day --repeat 5 scrape indicators
+"""
+
+import argparse
+import statistics
+import time
+
+
+def time_it(func, repeat):
+    """
+    Runs the function several times and returns the wall times.
+
+    Args:
+        func (callable): The function to time.
+        repeat (int): The number of runs.
+
+    Returns:
+        list: The wall time of every run in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def report(name, times, items=None, unit='items'):
+    """
+    Prints the best and mean wall time of a benchmark, and the throughput if a number of items is given.
+
+    Args:
+        name (str): The benchmark name.
+        times (list): The wall times in seconds.
+        items (int, optional): The number of items processed per run.
+        unit (str, optional): The name of the items. Defaults to 'items'.
+    """
+    line = f"{name:<28} best {min(times):9.4f}s   mean {statistics.mean(times):9.4f}s"
+    if items:
+        line += f"   {items / min(times):12.1f} {unit}/s"
+    print(line)
+
+
+def bench_scrape(args):
+    """
+    Benchmarks the GDELT queries and article parsing on replayed responses.
+    """
+    from profile_run import replay_articles
+    articles = replay_articles(args.fixtures)
+    report('scrape', time_it(lambda: replay_articles(args.fixtures), args.repeat), len(articles), 'articles')
+
+
+def bench_clean(args):
+    """
+    Benchmarks `clean_text` over the recorded articles.
+    """
+    from profile_run import replay_articles
+    from text_utils import clean_text
+    articles = replay_articles(args.fixtures)
+    report('clean', time_it(lambda: articles['content'].apply(clean_text), args.repeat), len(articles), 'articles')
+
+
+def bench_score_aggregate(args):
+    """
+    Benchmarks sentiment scoring and aggregation of the recorded articles.
+    """
+    from profile_run import replay_articles
+    from text_data_pipeline import TextDataPipeline
+    from config import LLM
+    articles = replay_articles(args.fixtures)
+    textDataPipeline = TextDataPipeline(LLM)
+    report('score_aggregate', time_it(lambda: textDataPipeline.scoreArticles(articles.copy()), args.repeat), len(articles), 'articles')
+
+
+def bench_stream(args):
+    """
+    Compares the staged (download everything, then clean and score) and the streaming sentiment pipelines
+    on replayed responses with a simulated network latency per request.
+    """
+    from datetime import datetime
+    from profile_run import load_manifest
+    from data_scrapper import fetch_24hrs
+    from replay import ReplayFetcher, use_fetcher
+    from text_data_pipeline import TextDataPipeline
+    from config import LLM
+
+    day = datetime.strptime(load_manifest(args.fixtures)['date'], '%Y-%m-%d')
+    textDataPipeline = TextDataPipeline(LLM)
+
+    with use_fetcher(ReplayFetcher(args.fixtures, latency=args.latency)):
+        staged = time_it(lambda: textDataPipeline.scoreArticles(fetch_24hrs(start=day)), args.repeat)
+        streamed = time_it(lambda: textDataPipeline.streamSentimentScores(start=day), args.repeat)
+        same = textDataPipeline.scoreArticles(fetch_24hrs(start=day)).equals(textDataPipeline.streamSentimentScores(start=day))
+
+    report('score_staged', staged)
+    report('score_streamed', streamed)
+    print(f"streamed output identical to staged output: {same}")
+
+
+def bench_title_first(args):
+    """
+    Compares the full-body and title-first sentiment modes on replayed responses: wall time, downloads and
+    forward passes saved, and the difference in the aggregated score.
+    """
+    from datetime import datetime
+    from profile_run import load_manifest
+    from replay import ReplayFetcher, use_fetcher
+    from text_data_pipeline import TextDataPipeline
+    from config import LLM
+
+    day = datetime.strptime(load_manifest(args.fixtures)['date'], '%Y-%m-%d')
+    textDataPipeline = TextDataPipeline(LLM)
+
+    with use_fetcher(ReplayFetcher(args.fixtures, latency=args.latency)):
+        full = time_it(lambda: textDataPipeline.streamSentimentScores(start=day), args.repeat)
+        tiered = time_it(lambda: textDataPipeline.tieredSentimentScores(start=day), args.repeat)
+        difference = (textDataPipeline.tieredSentimentScores(start=day) - textDataPipeline.streamSentimentScores(start=day)).abs().max().iloc[0]
+
+    report('score_full_bodies', full)
+    report('score_title_first', tiered)
+    print(f"savings: {textDataPipeline.lastTieredReport}")
+    print(f"max difference in aggregated sentiment: {difference:.4f}")
+
+
+def bench_query_plan(args):
+    """
+    Compares one GDELT query per category with the merged queries of the query planner on replayed responses:
+    API calls, wall time per day and rows per category.
+    """
+    from datetime import datetime
+    from profile_run import load_manifest
+    from data_scrapper import fetch_24hrs
+    from replay import ReplayFetcher, use_fetcher
+    from metrics import counter
+    import pandas as pd
+
+    day = datetime.strptime(load_manifest(args.fixtures)['date'], '%Y-%m-%d')
+    requests_sent = counter('gdelt_requests')
+    results = {}
+
+    with use_fetcher(ReplayFetcher(args.fixtures, latency=args.latency)):
+        for name, merged in (('per_category', False), ('merged', True)):
+            before = requests_sent.value
+            times = time_it(lambda: results.__setitem__(name, fetch_24hrs(start=day, merged=merged)), args.repeat)
+            report(f'query_plan_{name}', times, len(results[name]), 'rows')
+            print(f"  API calls per day: {(requests_sent.value - before) / args.repeat:.0f}")
+
+    counts = pd.DataFrame({name: data['category'].value_counts() for name, data in results.items()})
+    print(counts.fillna(0).astype(int).to_string())
+
+
+def bench_long_docs(args):
+    """
+    Compares truncated (first 512 tokens) and sliding-window scoring of the recorded articles:
+    tokens processed, throughput and how often the two modes agree.
+    """
+    from profile_run import replay_articles
+    from text_utils import clean_text, get_sentiments, get_sentiments_long
+    from text_data_pipeline import TextDataPipeline
+    from config import LLM, WINDOW_STRIDE, SENTIMENT_BATCH_SIZE
+
+    texts = replay_articles(args.fixtures)['content'].apply(clean_text).tolist()
+    textDataPipeline = TextDataPipeline(LLM)
+    tokenizer, model = textDataPipeline.tokenizer, textDataPipeline.model
+    tokens = sum(len(ids) for ids in tokenizer(texts, add_special_tokens=False)['input_ids'])
+
+    def truncated():
+        return [s for i in range(0, len(texts), SENTIMENT_BATCH_SIZE) for s in get_sentiments(texts[i:i + SENTIMENT_BATCH_SIZE], tokenizer, model)]
+
+    def windowed():
+        return get_sentiments_long(texts, tokenizer, model, stride=WINDOW_STRIDE, batch_size=SENTIMENT_BATCH_SIZE)
+
+    report('score_truncated', time_it(truncated, args.repeat), len(texts), 'articles')
+    report('score_windowed', time_it(windowed, args.repeat), len(texts), 'articles')
+    agreement = sum(a == b for a, b in zip(truncated(), windowed())) / max(len(texts), 1)
+    truncated_tokens = sum(min(len(ids), 510) for ids in tokenizer(texts, add_special_tokens=False)['input_ids'])
+    print(f"tokens seen: truncated {truncated_tokens} / windowed {tokens} of {tokens} (texts x 512 = {len(texts) * 512})")
+    print(f"label agreement between modes: {agreement:.1%}")
+
+
+def bench_tokenizer(args):
+    """
+    Checks that the fast tokenizer gives the same token ids as the Python tokenizer on the cleaned corpus, and
+    compares their tokens/sec: one `encode_plus` per text (the former path), and one batched call per tokenizer.
+    """
+    import pandas as pd
+    from transformers import BertTokenizer, BertTokenizerFast
+    from text_utils import clean_texts, encode_texts
+    from config import LLM
+
+    texts = clean_texts(pd.read_csv(args.corpus, nrows=args.rows)['content'].fillna('').astype(str).tolist())
+    slow, fast = BertTokenizer.from_pretrained(LLM), BertTokenizerFast.from_pretrained(LLM)
+
+    reference, candidate = encode_texts(texts, slow), encode_texts(texts, fast)
+    mismatches = [i for i, (a, b) in enumerate(zip(reference, candidate)) if a != b]
+    print(f"token id parity: {len(texts) - len(mismatches)}/{len(texts)} texts identical")
+    if mismatches:
+        print(f"  first mismatch at row {mismatches[0]}: {texts[mismatches[0]][:200]!r}")
+
+    tokens = sum(len(ids) for ids in reference)
+    report('tokenize_python_per_text', time_it(lambda: [slow.encode_plus(text, max_length=512, truncation=True) for text in texts], args.repeat), tokens, 'tokens')
+    report('tokenize_python_batched', time_it(lambda: encode_texts(texts, slow), args.repeat), tokens, 'tokens')
+    report('tokenize_fast_batched', time_it(lambda: encode_texts(texts, fast), args.repeat), tokens, 'tokens')
+
+
+def bench_contention(args):
+    """
+    Measures the tail latency of sentiment scoring plus a high/low prediction when N sessions request them at
+    the same time, with every model call running at once and with the inference slots of `runtime`.
+    """
+    import threading
+    import numpy as np
+    from runtime import configure_threads, set_inference_limit
+    from config import LLM, SENTIMENT_BATCH_SIZE, MAX_CONCURRENT_INFERENCE
+    print(f"threads: {configure_threads()}")
+
+    from profile_run import replay_articles
+    from text_utils import clean_text
+    from text_data_pipeline import TextDataPipeline
+    from model_registry import ModelRegistry
+    from app_utils import predict_price
+
+    texts = replay_articles(args.fixtures)['content'].apply(clean_text).tolist()[:SENTIMENT_BATCH_SIZE]
+    textDataPipeline = TextDataPipeline(LLM)
+    x_scaler, y_high_scaler, y_low_scaler, high_model, low_model = ModelRegistry().current().models
+    features = np.zeros((1, x_scaler.n_features_in_))
+
+    def request():
+        textDataPipeline.scoreTexts(texts)
+        predict_price(high_model, features, y_high_scaler, flag=True)
+        predict_price(low_model, features, y_low_scaler, flag=False)
+
+    request() ## Warm-up
+    for limit in (None, MAX_CONCURRENT_INFERENCE):
+        set_inference_limit(limit)
+        for sessions in args.sessions:
+            latencies, lock = [], threading.Lock()
+
+            def session():
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    request()
+                    with lock:
+                        latencies.append(time.perf_counter() - start)
+
+            threads = [threading.Thread(target=session) for _ in range(sessions)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            print(f"contention[limit={limit or 'none'}, {sessions} sessions] p50 {p50:8.3f}s   p95 {p95:8.3f}s   p99 {p99:8.3f}s   max {max(latencies):8.3f}s")
+    set_inference_limit(MAX_CONCURRENT_INFERENCE)
+
+
+def bench_clean_scaling(args):
+    """
+    Measures the rows/sec of the parallel corpus cleaner at 1, 2, 4 and 8 workers.
+    """
+    from preprocess_corpus import benchmark_clean_corpus
+    benchmark_clean_corpus(args.corpus, worker_counts=(1, 2, 4, 8), rows=args.rows)
+
+
+def peak_rss_mb(code):
+    """
+    Runs the code in a fresh interpreter and returns its peak resident set size.
+
+    Args:
+        code (str): The Python code to run.
+
+    Returns:
+        float: The peak RSS in MB.
+    """
+    import subprocess
+    import sys
+    script = code + "\nimport resource; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+    output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True).stdout
+    return int(output.strip().splitlines()[-1]) / 1024
+
+
+def bench_combine_memory(args):
+    """
+    Compares the peak RSS of loading every scraped news file at once with the streaming `combine_news_data`.
+    """
+    import tempfile
+    in_memory = peak_rss_mb(
+        "import os, pandas as pd\n"
+        f"files = [os.path.join({args.news_dir!r}, f) for f in sorted(os.listdir({args.news_dir!r})) if f.startswith('bitcoin_news_data_')]\n"
+        "df = pd.concat([pd.read_csv(f) for f in files], ignore_index=True).sort_values('publish_date')"
+    )
+    with tempfile.TemporaryDirectory() as output_dir:
+        streaming = peak_rss_mb(
+            "from data_scrapper import combine_news_data\n"
+            f"combine_news_data({args.news_dir!r}, None, None, output_dir={output_dir!r})"
+        )
+    print(f"combine peak RSS: in-memory {in_memory:.1f} MB, streaming {streaming:.1f} MB")
+
+
+def bench_indicators(args):
+    """
+    Benchmarks the indicator calculations on the recorded daily bars.
+    """
+    from profile_run import replay_bars
+    from btc_data_pipeline import BitcoinDataPipeline
+    bars = replay_bars(args.fixtures)
+    bitcoinDataPipeline = BitcoinDataPipeline()
+    report('indicators', time_it(lambda: bitcoinDataPipeline.processDailyData(bars.copy()), args.repeat), len(bars), 'bars')
+
+
+def bench_indicator_kernels(args):
+    """
+    Times every indicator backend on synthetic minute bars (1M and 10M rows by default) and checks their
+    results against the pandas path: within NUMPY_TOLERANCE for NumPy and NUMBA_TOLERANCE for Numba.
+    """
+    import numpy as np
+    import pandas as pd
+    from btc_utils import calculate_indicators
+    from indicator_kernels import NUMBA_AVAILABLE, NUMBA_TOLERANCE, NUMPY_TOLERANCE
+    backends = ['pandas', 'numpy'] + (['numba'] if NUMBA_AVAILABLE else [])
+    rng = np.random.default_rng(0)
+    for rows in args.kernel_rows:
+        close = 30000 + np.cumsum(rng.normal(0, 5, rows))
+        bars = pd.DataFrame({
+            'Open': close, 'High': close + rng.random(rows) * 10, 'Low': close - rng.random(rows) * 10,
+            'Close': close, 'Volume': rng.random(rows) * 100,
+        }, index=pd.date_range('2015-01-01', periods=rows, freq='min'))
+        expected = None
+        for backend in backends:
+            if backend == 'numba':
+                calculate_indicators(bars.iloc[:1000].copy(), backend) ### Compiles the kernels outside the timing
+            report(f'indicator_kernels[{backend}, {rows} rows]', time_it(lambda: calculate_indicators(bars.copy(), backend), args.repeat), rows, 'bars')
+            result = calculate_indicators(bars.copy(), backend)
+            if expected is None:
+                expected = result
+                continue
+            ### One column at a time, full-frame temporaries do not fit in memory at 10M rows
+            difference = max(np.nanmax(np.abs(result[column].to_numpy() - expected[column].to_numpy())
+                                       / np.maximum(1, np.abs(expected[column].to_numpy()))) for column in expected.columns)
+            same_nans = all(result[column].isna().equals(expected[column].isna()) for column in expected.columns)
+            tolerance = NUMBA_TOLERANCE if backend == 'numba' else NUMPY_TOLERANCE
+            print(f"  max relative difference from pandas: {difference:.2e} (tolerance {tolerance:.0e})")
+            if difference > tolerance or not same_nans:
+                raise AssertionError(f"The {backend} indicators differ from the pandas path beyond the tolerance")
+        del bars, expected, result
+
+
+BENCHMARKS = {
+    'scrape': bench_scrape,
+    'clean': bench_clean,
+    'score_aggregate': bench_score_aggregate,
+    'stream': bench_stream,
+    'title_first': bench_title_first,
+    'query_plan': bench_query_plan,
+    'long_docs': bench_long_docs,
+    'clean_scaling': bench_clean_scaling,
+    'tokenizer': bench_tokenizer,
+    'contention': bench_contention,
+    'combine_memory': bench_combine_memory,
+    'indicators': bench_indicators,
+    'indicator_kernels': bench_indicator_kernels,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the offline BitAnalytica benchmarks.')
+    parser.add_argument('benchmarks', nargs='*', help=f"Benchmarks to run, among {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument('--fixtures', default='fixtures/day')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--corpus', default='bitcoin_news_data/2021-05.csv', help='Corpus used by the corpus-level benchmarks')
+    parser.add_argument('--news-dir', default='news_data', help='Directory of the scraped bitcoin_news_data_*.csv files')
+    parser.add_argument('--rows', type=int, default=20000, help='Number of corpus rows used by the corpus-level benchmarks')
+    parser.add_argument('--kernel-rows', type=lambda value: [int(rows) for rows in value.split(',')], default=[1_000_000, 10_000_000],
+                        help='Comma-separated row counts of the indicator kernel benchmark')
+    parser.add_argument('--sessions', type=lambda value: [int(n) for n in value.split(',')], default=[1, 2, 4, 8],
+                        help='Comma-separated numbers of concurrent sessions of the contention benchmark')
+    parser.add_argument('--latency', type=float, default=0.2, help='Simulated network latency per request (seconds)')
+    args = parser.parse_args()
+
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    for name in args.benchmarks or BENCHMARKS:
+        BENCHMARKS[name](args)
@@ -1,6 +1,10 @@
 from btc_utils import *
 from config import *
 from datetime import datetime, timedelta
+from metrics import timer
+from range_index import RangeIndex
+import threading
+import pandas as pd
 
 class BitcoinDataPipeline:
     """
@@ -10,58 +14,373 @@ class BitcoinDataPipeline:
 
     Attributes:
         btc (pandas.DataFrame): Bitcoin data with calculated technical indicators.
+        dailyBars (pandas.DataFrame): The raw daily bars, extended with only the new days on every refresh.
+        timeframes (TimeframeCache): The hourly base series and the timeframes built from it.
+        store (TimeSeriesStore): The store the daily bars are loaded from and saved to, or None.
+        rangeIndexes (dict): The range analytics index of each timeframe.
+        rangeLock (threading.RLock): The lock of the range indexes, held from their update to the end of a query.
+
+    The base series is updated under a lock, so the intraday predictions can refresh it from a background thread.
+    The range indexes are shared by every session, so they are only updated and queried under `rangeLock`.
     """
 
-    def __init__(self):
+    def __init__(self, store=None):
         """
         Initializes a new instance of the BitcoinDataPipeline class.
+
+        Args:
+            store (TimeSeriesStore, optional): The store of the daily bars. Defaults to None (Yahoo Finance only).
         """
+        self.store = store
         self.btc = None
+        self.dailyBars = None
+        self.timeframes = None
+        self.rangeIndexes = {}
+        self.rangeLock = threading.RLock()
+        self._baseLock = threading.RLock()
 
 
+    @timer('btc_pipeline_daily', 'Time to download daily bars and compute indicators')
     def getLatestBitcoinData(self):
         """
         Retrieves the latest Bitcoin data from Yahoo Finance and calculates various technical indicators.
+        All the days since 2016 are downloaded on the first call, only the new ones afterwards. With a store, the
+        first call loads the stored days instead and the new days are saved to it.
+
+        Returns:
+            pandas.DataFrame: Bitcoin data with calculated technical indicators.
+        """
+        if self.dailyBars is None and self.store is not None:
+            self.dailyBars = self.loadStoredDailyBars()
+
+        if self.dailyBars is None:
+            data = new_bars = get_data_from_yahoo(start=DAILY_HISTORY_START)
+        else:
+            ### Re-download the last stored day too, it may have been incomplete
+            new_bars = get_data_from_yahoo(start=self.dailyBars.index[-1].strftime('%Y-%m-%d'))
+            data = pd.concat([self.dailyBars, new_bars])
+            data = data[~data.index.duplicated(keep='last')].sort_index()
+        if self.store is not None and not new_bars.empty:
+            self.store.upsert_bars(new_bars, '1d')
+        self.dailyBars = data
+        return self.processDailyData(data.copy())
+
+
+    def loadStoredDailyBars(self):
+        """
+        Reads the daily bars of the store, if they reach back to DAILY_HISTORY_START. Shorter histories are not
+        used: the cumulative and exponential indicators (OBV, EMAs) depend on the first bar.
+
+        Returns:
+            pandas.DataFrame or None: The stored bars, or None if the store does not hold the whole history.
+        """
+        bars = self.store.read_bars('1d').dropna(axis=1, how='all') ## e.g. no 'Adj Close' when Yahoo did not send it
+        if bars.empty or bars.index[0] > pd.Timestamp(DAILY_HISTORY_START):
+            return None
+        return bars
+
+
+    def processDailyData(self, data):
+        """
+        Calculates the technical indicators on raw daily bars and keeps the rows used by the models.
+
+        Args:
+            data (pandas.DataFrame): Raw daily bars as returned by `get_data_from_yahoo`.
 
         Returns:
             pandas.DataFrame: Bitcoin data with calculated technical indicators.
         """
-        data = get_data_from_yahoo(start='2016-12-01')
-        data[SMA7] = calculate_sma(data, 7) ### Calculating SMA for 7 Days
-        data[SMA14] = calculate_sma(data, 14) ### Calculating SMA for 14 Days
-        data[EMA7] = calculate_ema(data, 7) ### Calculating EMA for 7 Days
-        data[EMA14] = calculate_ema(data, 14) ### Calculating SMA for 14 Days
-        data[RSI] = calculate_rsi(data, window=14) ### Calculating SMA for 14 Days
-        data[[MACD, SIGNAL_LINE]] = calculat_macd(data, short_window=12, long_window=26, signal_window=9) ### Calculating MACD
-        data[[BOLLINGER_SMA, UPPER_BAND_BB, LOWER_BAND_BB]] = calculate_bollinger_bands(data, window=20, num_std=2) ### Calculating Bollinger Bands
-        data[ATR] = calculate_atr(data, window=14) ### Calculating ATR
-        data[[K, D]] = calculate_stochastic_oscillator(data, window=14) ### Calculating Stochastic Oscillator
-        data[OBV] = calculate_obv(data) ### Calculating OBV
-
-        self.btc = data.loc['2017-01-08':]
+        data = self.calculateIndicators(data)
+        self.btc = data.loc['2017-01-08':] ## Kept in float64 even in memory-budget mode, the models are fed from it
         return self.btc
     
 
-    def getHourlyData(self):
+    @timer('btc_pipeline_hourly', 'Time to download hourly bars and compute indicators')
+    def getHourlyData(self, refresh=True):
         """
-        Retrieves hourly data for the past 14 days and calculates various technical indicators.
+        Retrieves hourly data for the past 30 days and calculates various technical indicators. The indicators
+        are only calculated over those days and the warm-up bars before them, not the whole base series.
+
+        Args:
+            refresh (bool, optional): Whether to download the new bars first. Defaults to True.
 
         Returns:
             pandas.DataFrame: A DataFrame containing the hourly data and calculated indicators.
         """
-        end = datetime.now()
-        start = end - timedelta(days=30)
-        data = get_data_from_yahoo(start=start.strftime('%Y-%m-%d'), end=end.strftime('%Y-%m-%d'), interval='1h')
-        data[SMA7] = calculate_sma(data, 7) ### Calculating SMA for 7 Hours
-        data[SMA14] = calculate_sma(data, 14) ### Calculating SMA for 14 Hours
-        data[EMA7] = calculate_ema(data, 7) ### Calculating EMA for 7 Hours
-        data[EMA14] = calculate_ema(data, 14) ### Calculating SMA for 14 Hours
-        data[RSI] = calculate_rsi(data, window=14) ### Calculating SMA for 14 Hours
-        data[[MACD, SIGNAL_LINE]] = calculat_macd(data, short_window=12, long_window=26, signal_window=9) ### Calculating MACD
-        data[[BOLLINGER_SMA, UPPER_BAND_BB, LOWER_BAND_BB]] = calculate_bollinger_bands(data, window=20, num_std=2) ### Calculating Bollinger Bands
-        data[ATR] = calculate_atr(data, window=14) ### Calculating ATR
-        data[[K, D]] = calculate_stochastic_oscillator(data, window=14) ### Calculating Stochastic Oscillator
-        data[OBV] = calculate_obv(data) ### Calculating OBV
-
-        return data
+        return self.getTimeframeData('1h', refresh, days=30)
+
+
+    def updateBaseSeries(self):
+        """
+        Downloads the hourly bars missing from the base series (all of BASE_HISTORY_DAYS on the first call)
+        and refreshes the cached timeframes.
+
+        Returns:
+            TimeframeCache: The updated timeframe cache.
+        """
+        with self._baseLock:
+            end = datetime.now()
+            if self.timeframes is None:
+                start = end - timedelta(days=BASE_HISTORY_DAYS)
+                self.timeframes = TimeframeCache(get_data_from_yahoo(start=start.strftime('%Y-%m-%d'), end=end, interval='1h'))
+            else:
+                ### Re-download the last stored bar too, it may have been incomplete
+                last = self.timeframes.base.index[-1]
+                self.timeframes.update(get_data_from_yahoo(start=last.strftime('%Y-%m-%d'), end=end, interval='1h'))
+            return self.timeframes
+
+
+    @timer('btc_pipeline_timeframe', 'Time to refresh the base series and build a timeframe')
+    def getTimeframeData(self, timeframe, refresh=True, days=None):
+        """
+        Returns the bars of any timeframe built from the hourly base series, with every technical indicator.
+
+        Args:
+            timeframe (str): One of TIMEFRAMES ('1h', '4h', '1d' or '1w').
+            refresh (bool, optional): Whether to download the new base bars first. Defaults to True.
+            days (int, optional): Returns only the bars of the last days. Defaults to None (every bar).
+
+        Returns:
+            pandas.DataFrame: The bars of the timeframe with calculated indicators.
+        """
+        timeframes = self.updateBaseSeries() if refresh or self.timeframes is None else self.timeframes
+        return timeframes.get(timeframe, days=days)
+
+
+    @timer('btc_pipeline_intraday', 'Time to build the intraday feature rows from the hourly base series')
+    def getIntradayFeatures(self, hours=INTRADAY_MAX_BATCH, days=INTRADAY_HISTORY_DAYS):
+        """
+        Builds the daily feature rows of the 24 hours ending at each of the last hours of the base series.
+
+        Every hour of the day anchors its own series of 24-hour bars (like daily bars closing at that hour), and
+        the indicators of all anchors are calculated in one vectorized pass over an (field, anchor) panel.
+        Once the daily bars are loaded, the OBV continues the daily OBV instead of starting from zero.
+
+        Args:
+            hours (int, optional): The number of most recent hours returned, at most 24. Defaults to INTRADAY_MAX_BATCH.
+            days (int, optional): The number of 24-hour bars behind every row. Defaults to INTRADAY_HISTORY_DAYS.
+
+        Returns:
+            pandas.DataFrame: The bars and indicators of the 24 hours ending at each hour, indexed by that hour,
+                with the columns of `getLatestBitcoinData`.
+        """
+        with self._baseLock:
+            base = self.updateBaseSeries().base
+        bars = rolling_window_bars(base.iloc[-(days + 1) * 24:])
+        panel, anchors = anchored_panel(bars, days)
+        panel = self.calculateIndicators(panel)
+
+        latest = panel.iloc[-1].unstack(level=0)
+        indicators = [column for column in panel.columns.get_level_values(0).unique() if column not in base.columns]
+        features = latest.reindex(columns=list(base.columns) + indicators).astype(float).set_axis(anchors)
+
+        if self.btc is not None:
+            ### OBV is cumulative: continue the daily OBV from the last day closed before the first 24-hour bar
+            daily = self.btc[OBV]
+            days = daily.index.tz_convert('UTC').tz_localize(None) if daily.index.tz is not None else daily.index
+            first = panel.index[0].tz_convert('UTC').tz_localize(None) if panel.index.tz is not None else panel.index[0]
+            previous = daily[days < first.normalize()]
+            if not previous.empty:
+                features[OBV] += float(previous.iloc[-1])
+        return features.iloc[-hours:]
+
+
+    def getRangeIndex(self, timeframe='1d', sentiment=None):
+        """
+        Returns the range analytics index of a timeframe, appending only the bars added since the last call.
+
+        The daily index covers the daily bars since 2017 (`getLatestBitcoinData`), the other timeframes the
+        hourly base series. Callers querying the index must hold `rangeLock` until the query returns.
+
+        Args:
+            timeframe (str, optional): '1d' or any other timeframe of TIMEFRAMES. Defaults to '1d'.
+            sentiment (pandas.Series, optional): Daily sentiment indexed by date, for the average sentiment.
+
+        Returns:
+            RangeIndex: The up-to-date index.
+        """
+        if timeframe == '1d':
+            bars = self.btc if self.btc is not None else self.getLatestBitcoinData()
+        else:
+            bars = self.updateBaseSeries().get(timeframe, indicators=False)
+
+        with self.rangeLock:
+            index = self.rangeIndexes.get(timeframe)
+            if index is None:
+                index = self.rangeIndexes[timeframe] = RangeIndex.from_frame(bars, sentiment=sentiment)
+            elif len(index):
+                ### Re-append from the last indexed bar, it may have been incomplete
+                last = pd.Timestamp(index.timestamps[-1])
+                naive = bars.index.tz_convert('UTC').tz_localize(None) if bars.index.tz is not None else bars.index
+                index.append(bars[naive >= last], sentiment=sentiment)
+            else:
+                index.append(bars, sentiment=sentiment)
+            return index
+
+
+    def calculateIndicators(self, data):
+        """
+        Calculates every technical indicator used by the app on the given bars.
+
+        Args:
+            data (pandas.DataFrame): Bars containing 'Open', 'High', 'Low', 'Close' and 'Volume' columns.
+
+        Returns:
+            pandas.DataFrame: The bars with the indicator columns added.
+        """
+        return calculate_indicators(data)
+
+
+class TimeframeCache:
+    """
+    Builds every timeframe from one stored base series and keeps each of them cached.
+
+    New base bars are merged into the base series and only the periods they touch are re-aggregated,
+    so appending an hour of data never rebuilds a whole timeframe.
+
+    In memory-budget mode the cached timeframes and the indicator frames returned are float32, while the base
+    series stays float64 because the intraday feature rows of the models are built from it.
+
+    The base series and the cached timeframes are read and written under a lock, so sessions reading a timeframe
+    never see them half updated by the intraday thread.
+
+    Attributes:
+        base (pandas.DataFrame): The base OHLCV bars.
+        frames (dict): The cached bars of each requested timeframe.
+    """
+
+    def __init__(self, base):
+        """
+        Initializes the cache with the base series.
+
+        Args:
+            base (pandas.DataFrame): The base OHLCV bars (e.g. hourly).
+        """
+        self.base = base.sort_index()
+        self.frames = {}
+        self._lock = threading.RLock()
+
+
+    def update(self, new_bars):
+        """
+        Appends new (or revised) base bars and refreshes the affected periods of every cached timeframe.
+
+        Args:
+            new_bars (pandas.DataFrame): Base bars to merge; bars already stored are replaced.
+        """
+        if new_bars.empty:
+            return
+        with self._lock:
+            combined = pd.concat([self.base, new_bars])
+            self.base = combined[~combined.index.duplicated(keep='last')].sort_index()
+
+            first_new = new_bars.index.min()
+            for timeframe, bars in list(self.frames.items()):
+                ### The first period to rebuild is the one containing the first new bar
+                position = bars.index.searchsorted(first_new, side='right') - 1
+                cutoff = bars.index[position] if position >= 0 else self.base.index[0]
+                refreshed = self._resample(self.base[self.base.index >= cutoff], timeframe)
+                self.frames[timeframe] = pd.concat([bars[bars.index < cutoff], refreshed])
+
+
+    def get(self, timeframe, indicators=True, days=None):
+        """
+        Returns the bars of a timeframe, optionally with every technical indicator.
+
+        With `days`, the indicators are calculated over the last days and the INDICATOR_WARMUP_BARS bars before
+        them only, and the OBV continues the OBV of the earlier bars, so a refresh never recomputes them all.
 
+        Args:
+            timeframe (str): One of TIMEFRAMES ('1h', '4h', '1d' or '1w').
+            indicators (bool, optional): Whether to calculate the indicators. Defaults to True.
+            days (int, optional): Returns only the bars of the last days. Defaults to None (every bar).
+
+        Returns:
+            pandas.DataFrame: The bars of the timeframe.
+        """
+        with self._lock:
+            if timeframe not in self.frames:
+                self.frames[timeframe] = self._resample(self.base, timeframe)
+            frame = self.frames[timeframe]
+            since, start, obv_offset = None, 0, 0.0
+            if days is not None and not frame.empty:
+                since = frame.index[-1] - timedelta(days=days)
+                start = max(0, frame.index.searchsorted(since) - INDICATOR_WARMUP_BARS)
+                if indicators and start > 0:
+                    obv_offset = float(calculate_obv(frame.iloc[:start + 1]).iloc[-1]) ## The OBV up to the first bar kept
+            bars = frame.iloc[start:].copy()
+        if indicators: ### The indicators are calculated on the copy, outside the lock
+            bars = calculate_indicators(bars)
+            bars[OBV] += obv_offset
+            if MEMORY_BUDGET_MODE:
+                bars = downcast_frame(bars)
+        return bars if since is None else bars[bars.index >= since]
+
+
+    def _resample(self, base, timeframe):
+        bars = resample_bars(base, timeframe)
+        return downcast_frame(bars) if MEMORY_BUDGET_MODE else bars
+
+
+class MarketDataPipeline:
+    """
+    A class that represents a multi-symbol market data pipeline.
+
+    All symbols are downloaded in one bulk Yahoo Finance call and kept as a panel with MultiIndex
+    (field, symbol) columns, and every indicator is calculated for all symbols in one vectorized pass.
+
+    Attributes:
+        symbols (list): The Yahoo Finance tickers of the pipeline.
+        panel (pandas.DataFrame): The latest daily panel with calculated technical indicators.
+        updated (datetime): When the panel was downloaded, or None.
+        lock (threading.Lock): The lock of the panel, shared by every session of the app.
+    """
+
+    def __init__(self, symbols=SYMBOLS):
+        """
+        Initializes a new instance of the MarketDataPipeline class.
+
+        Args:
+            symbols (list, optional): The Yahoo Finance tickers. Defaults to SYMBOLS.
+        """
+        self.symbols = list(symbols)
+        self.panel = None
+        self.updated = None
+        self.lock = threading.Lock()
+
+
+    @timer('market_pipeline_daily', 'Time to download daily bars for every symbol and compute indicators')
+    def getLatestData(self, start=DAILY_HISTORY_START, interval='1d'):
+        """
+        Retrieves the daily bars of every symbol and calculates the technical indicators on the whole panel.
+
+        Args:
+            start (str, optional): The first date to download. Defaults to DAILY_HISTORY_START.
+            interval (str, optional): The bar interval. Defaults to '1d'.
+
+        Returns:
+            pandas.DataFrame: The panel with MultiIndex (field, symbol) columns.
+        """
+        data = get_data_from_yahoo(start=start, interval=interval, tickers=self.symbols)
+        self.panel = calculate_indicators(data)
+        self.updated = datetime.now()
+        return self.panel
+
+
+    def getSymbolData(self, symbol, max_age=None):
+        """
+        Returns the bars and indicators of one symbol as a flat frame, like `BitcoinDataPipeline.getLatestBitcoinData`.
+        The panel is downloaded on the first call, and again once it is older than `max_age`.
+
+        Args:
+            symbol (str): The Yahoo Finance ticker.
+            max_age (timedelta, optional): The age after which the panel is downloaded again. Defaults to None (never).
+
+        Returns:
+            pandas.DataFrame: The data of the symbol with one column per field.
+        """
+        with self.lock:
+            if self.panel is None or (max_age is not None and datetime.now() - self.updated > max_age):
+                self.getLatestData()
+            panel = self.panel
+        return panel.xs(symbol, axis=1, level=1)
@@ -1,8 +1,21 @@
+import numpy as np
 import pandas as pd
-import yfinance as yf
 import datetime
-
-def get_data_from_yahoo(start=None, end=None, interval='1d'):
+from metrics import timer
+from replay import get_fetcher
+from config import SMA7, SMA14, EMA7, EMA14, RSI, MACD, SIGNAL_LINE, BOLLINGER_SMA
+from config import UPPER_BAND_BB, LOWER_BAND_BB, ATR, K, D, OBV, INDICATOR_BACKEND
+from indicator_kernels import run_kernel, run_obv, resolve_backend
+
+### Every indicator below works on a single-symbol frame (flat 'Open', 'High', ... columns) as well as on a
+### symbol panel (MultiIndex (field, symbol) columns), in which case each field is a DataFrame with one column
+### per symbol and pandas computes the indicator for all symbols in one vectorized pass.
+###
+### Every indicator also takes a `backend`: 'pandas' (default), or 'numba', 'numpy' or 'auto' to run the rolling
+### and exponential windows on the kernels of `indicator_kernels` for very long series.
+
+@timer('yahoo_download', 'Latency of a Yahoo Finance download')
+def get_data_from_yahoo(start=None, end=None, interval='1d', tickers='BTC-USD'):
     """
     Retrieves historical Bitcoin price data from Yahoo Finance.
 
@@ -10,6 +23,8 @@ def get_data_from_yahoo(start=None, end=None, interval='1d'):
         start (datetime): The start date of the data range (default: None).
         end (datetime): The end date of the data range (default: None).
         interval (str): The time interval for the data (default: '1d').
+        tickers (str or list): The ticker, or a list of tickers downloaded in one bulk call as a
+            (field, symbol) panel (default: 'BTC-USD').
 
     Returns:
         pandas.DataFrame: The historical Bitcoin price data.
@@ -18,41 +33,124 @@ def get_data_from_yahoo(start=None, end=None, interval='1d'):
     end = datetime.datetime.now() if end is None else end
     start = end - datetime.timedelta(days=1) if start is None else start
 
-    data = yf.download('BTC-USD', start=start, end=end, interval=interval)
+    data = get_fetcher().download_bars(tickers, start=start, end=end, interval=interval)
     return data
 
 
-def calculate_sma(data, window):
+### How each OHLCV field is aggregated when building a higher timeframe
+OHLCV_AGGREGATION = {
+    'Open': 'first',
+    'High': 'max',
+    'Low': 'min',
+    'Close': 'last',
+    'Adj Close': 'last',
+    'Volume': 'sum',
+}
+
+### Bars before a window that settle every indicator of `calculate_indicators` on it: the longest window is
+### the MACD signal (26 + 9 bars) and the EMAs forget their first bar within ~10 spans (< 1e-9 after 300 bars)
+INDICATOR_WARMUP_BARS = 300
+
+### pandas resampling rules of the supported timeframes (weekly bars start on Monday like Yahoo's)
+TIMEFRAMES = {
+    '1h': '1h',
+    '4h': '4h',
+    '1d': '1D',
+    '1w': 'W-MON',
+}
+
+
+def rolling(values, window, statistic, backend='pandas'):
+    """
+    Rolling-window statistic with the selected backend.
+
+    Parameters:
+    - values: pandas Series or DataFrame.
+    - window: Integer window size.
+    - statistic: 'mean', 'std', 'min' or 'max'.
+    - backend: 'pandas', 'numba', 'numpy' or 'auto'.
+
+    Returns:
+    - The rolling statistic, shaped like `values`.
+    """
+    if resolve_backend(backend) == 'pandas':
+        return getattr(values.rolling(window=window), statistic)()
+    return run_kernel(f'rolling_{statistic}', backend, values, window)
+
+
+def ewm_mean(values, span, backend='pandas'):
+    """
+    Exponentially weighted mean (adjust=False) with the selected backend.
+
+    Parameters:
+    - values: pandas Series or DataFrame.
+    - span: Integer span of the average.
+    - backend: 'pandas', 'numba', 'numpy' or 'auto'.
+
+    Returns:
+    - The exponentially weighted mean, shaped like `values`.
+    """
+    if resolve_backend(backend) == 'pandas':
+        return values.ewm(span=span, adjust=False).mean()
+    return run_kernel('ewm_mean', backend, values, span)
+
+
+@timer('resample_bars', 'Time to aggregate bars into a higher timeframe')
+def resample_bars(data, timeframe):
+    """
+    Aggregates OHLCV bars into a higher timeframe.
+
+    Args:
+        data (pandas.DataFrame): Bars indexed by time, single-symbol or (field, symbol) panel.
+        timeframe (str): One of TIMEFRAMES ('1h', '4h', '1d' or '1w').
+
+    Returns:
+        pandas.DataFrame: The aggregated bars, labelled by the start of each period. Periods without any
+        base bar are dropped.
+    """
+    field = (lambda column: column[0]) if isinstance(data.columns, pd.MultiIndex) else (lambda column: column)
+    aggregation = {column: OHLCV_AGGREGATION[field(column)] for column in data.columns if field(column) in OHLCV_AGGREGATION}
+
+    resampled = data.resample(TIMEFRAMES[timeframe], label='left', closed='left').agg(aggregation)
+    return resampled.dropna(subset=[c for c in resampled.columns if field(c) == 'Close'], how='all')
+
+
+@timer('indicator_sma', 'Time to calculate the SMA indicator')
+def calculate_sma(data, window, backend='pandas'):
     """
     Calculate the Simple Moving Average (SMA) for a given data set.
 
     Parameters:
     - data: Pandas DataFrame containing the data set.
     - window: Integer representing the window size for the moving average calculation.
+    - backend: The indicator backend (default: 'pandas').
 
     Returns:
     - sma: Pandas Series representing the Simple Moving Average.
     """
-    sma = data['Close'].rolling(window=window).mean()
+    sma = rolling(data['Close'], window, 'mean', backend)
     return sma
 
 
-def calculate_ema(data, window):
+@timer('indicator_ema', 'Time to calculate the EMA indicator')
+def calculate_ema(data, window, backend='pandas'):
     """
     Calculate the Exponential Moving Average (EMA) of the 'Close' prices in the given data.
 
     Parameters:
     - data: A pandas DataFrame containing the 'Close' prices.
     - window: An integer specifying the window size for the EMA calculation.
+    - backend: The indicator backend (default: 'pandas').
 
     Returns:
     - ema: A pandas Series representing the EMA values.
     """
-    ema = data['Close'].ewm(span=window, adjust=False).mean()
+    ema = ewm_mean(data['Close'], window, backend)
     return ema
 
 
-def calculate_rsi(data, window=14):
+@timer('indicator_rsi', 'Time to calculate the RSI indicator')
+def calculate_rsi(data, window=14, backend='pandas'):
     """
     Calculate the Relative Strength Index (RSI) for a given dataset.
 
@@ -60,6 +158,7 @@ def calculate_rsi(data, window=14):
     - data: pandas DataFrame or Series containing the 'Close' prices.
     - window: int, optional (default=14)
         The number of periods to use for the RSI calculation.
+    - backend: The indicator backend (default: 'pandas').
 
     Returns:
     - rsi: pandas Series
@@ -67,14 +166,15 @@ def calculate_rsi(data, window=14):
 
     """
     delta = data['Close'].diff()
-    gain = (delta.where(delta>0, 0)).rolling(window=window).mean()
-    loss = (-delta.where(delta<0, 0)).rolling(window=window).mean()
+    gain = rolling(delta.where(delta>0, 0), window, 'mean', backend)
+    loss = rolling(-delta.where(delta<0, 0), window, 'mean', backend)
     rs = gain / loss
     rsi = 100 - (100 / (1 + rs))
     return rsi
 
 
-def calculat_macd(data, short_window=12, long_window=26, signal_window=9):
+@timer('indicator_macd', 'Time to calculate the MACD indicator')
+def calculat_macd(data, short_window=12, long_window=26, signal_window=9, backend='pandas'):
     """
     Calculate the Moving Average Convergence Divergence (MACD) indicator.
 
@@ -83,18 +183,20 @@ def calculat_macd(data, short_window=12, long_window=26, signal_window=9):
     - short_window: The window size for the short-term exponential moving average (default: 12).
     - long_window: The window size for the long-term exponential moving average (default: 26).
     - signal_window: The window size for the signal line exponential moving average (default: 9).
+    - backend: The indicator backend (default: 'pandas').
 
     Returns:
     - A DataFrame containing the MACD and Signal Line values.
     """
-    short_ema = calculate_ema(data, short_window)
-    long_ema = calculate_ema(data, long_window)
+    short_ema = calculate_ema(data, short_window, backend)
+    long_ema = calculate_ema(data, long_window, backend)
     macd = short_ema - long_ema 
-    signal = macd.ewm(span=signal_window, adjust=False).mean()
-    return pd.DataFrame({'MACD':macd, 'Signal Line':signal})
+    signal = ewm_mean(macd, signal_window, backend)
+    return pd.concat({'MACD':macd, 'Signal Line':signal}, axis=1)
 
 
-def calculate_bollinger_bands(data, window=20, num_std=2):
+@timer('indicator_bollinger_bands', 'Time to calculate the Bollinger Bands indicator')
+def calculate_bollinger_bands(data, window=20, num_std=2, backend='pandas'):
     """
     Calculate Bollinger Bands for a given dataset.
 
@@ -102,28 +204,31 @@ def calculate_bollinger_bands(data, window=20, num_std=2):
     - data (DataFrame): The input dataset.
     - window (int): The window size for calculating the simple moving average (SMA). Default is 20.
     - num_std (int): The number of standard deviations to use for calculating the upper and lower bands. Default is 2.
+    - backend (str): The indicator backend. Default is 'pandas'.
 
     Returns:
     - DataFrame: A DataFrame containing the Bollinger Bands, including the SMA, upper band, and lower band.
     """
-    sma = calculate_sma(data, window)
-    rolling_std = data['Close'].rolling(window=window).std()
+    sma = calculate_sma(data, window, backend)
+    rolling_std = rolling(data['Close'], window, 'std', backend)
     upper_band = sma + (rolling_std * num_std)
     lower_band = sma - (rolling_std * num_std)
-    return pd.DataFrame({
+    return pd.concat({
         "Bollinger_SMA": sma,
         "Upper_Band" : upper_band,
         "Lower_Band" : lower_band, 
-    })
+    }, axis=1)
 
 
-def calculate_atr(data, window=14):
+@timer('indicator_atr', 'Time to calculate the ATR indicator')
+def calculate_atr(data, window=14, backend='pandas'):
     """
     Calculate the Average True Range (ATR) for a given dataset.
 
     Parameters:
     - data: pandas DataFrame containing the necessary columns ('High', 'Low', 'Close').
     - window: int, optional (default=14). The window size for calculating the rolling mean.
+    - backend: str, optional (default='pandas'). The indicator backend.
 
     Returns:
     - atr: pandas Series containing the calculated Average True Range values.
@@ -132,40 +237,157 @@ def calculate_atr(data, window=14):
     high_low = data['High'] - data['Low']
     high_close = (data['High'] - data['Close'].shift()).abs()
     low_close = (data['Low'] - data['Close'].shift()).abs()
-    true_range = high_low.combine(high_close, max).combine(low_close, max)
-    atr = true_range.rolling(window=window).mean()
+    true_range = np.fmax(np.fmax(high_low, high_close), low_close) ## NaN-skipping element-wise max
+    atr = rolling(true_range, window, 'mean', backend)
     return atr
 
 
-def calculate_stochastic_oscillator(data, window=14):
+@timer('indicator_stochastic_oscillator', 'Time to calculate the Stochastic Oscillator indicator')
+def calculate_stochastic_oscillator(data, window=14, backend='pandas'):
     """
     Calculate the Stochastic Oscillator for a given dataset.
 
     Args:
         data (pandas.DataFrame): The input dataset containing 'low', 'High', and 'Close' columns.
         window (int): The window size for calculating the rolling minimum and maximum values. Default is 14.
+        backend (str): The indicator backend. Default is 'pandas'.
 
     Returns:
         pandas.DataFrame: A DataFrame containing the '%K' and '%D' columns.
 
     """
-    low_min = data['Low'].rolling(window=window).min()
-    high_max = data['High'].rolling(window=window).max()
-    data['%K'] = 100 * ((data['Close']- low_min) / (high_max - low_min))
-    data['%D'] = data['%K'].rolling(window=3).mean()
-    return data[['%K', '%D']]
+    low_min = rolling(data['Low'], window, 'min', backend)
+    high_max = rolling(data['High'], window, 'max', backend)
+    k = 100 * ((data['Close']- low_min) / (high_max - low_min))
+    d = rolling(k, 3, 'mean', backend)
+    return pd.concat({'%K': k, '%D': d}, axis=1)
 
 
-def calculate_obv(data):
+@timer('indicator_obv', 'Time to calculate the OBV indicator')
+def calculate_obv(data, backend='pandas'):
     """
     Calculate the On-Balance Volume (OBV) for the given data.
 
     Parameters:
     data (pandas.DataFrame): The input data containing 'Volume' and 'Close' columns.
+    backend (str): The indicator backend (default: 'pandas').
 
     Returns:
     pandas.Series: The calculated On-Balance Volume (OBV) values.
     """
-    obv = (data['Volume'] * ((data['Close'] > data['Close'].shift()).astype(int) - 
-                             (data['Close'] < data['Close'].shift()).astype(int))).cumsum()
+    if resolve_backend(backend) != 'pandas':
+        return run_obv(backend, data['Close'], data['Volume'])
+    direction = np.sign(data['Close'].diff()).fillna(0).astype('int8') ## +1 up, -1 down, 0 flat, without boolean temporaries
+    obv = (data['Volume'] * direction).cumsum()
     return obv
+
+
+def calculate_indicators(data, backend=INDICATOR_BACKEND):
+    """
+    Calculate every technical indicator used by the app, for a single symbol or for a whole symbol panel at once.
+
+    Parameters:
+    - data: pandas DataFrame with 'Open', 'High', 'Low', 'Close' and 'Volume' columns, or a panel with
+      MultiIndex (field, symbol) columns as returned by `get_data_from_yahoo` for a list of tickers.
+    - backend: The indicator backend: 'pandas', 'numba', 'numpy' or 'auto' (default: INDICATOR_BACKEND).
+
+    Returns:
+    - pandas DataFrame: The input with the indicator columns added (as (indicator, symbol) columns for a panel).
+    """
+    if isinstance(data.columns, pd.MultiIndex):
+        data = data.sort_index(axis=1) ## Align the symbol order of every field
+    macd = calculat_macd(data, short_window=12, long_window=26, signal_window=9, backend=backend)
+    bollinger_bands = calculate_bollinger_bands(data, window=20, num_std=2, backend=backend)
+    stochastic = calculate_stochastic_oscillator(data, window=14, backend=backend)
+
+    indicators = {
+        SMA7: calculate_sma(data, 7, backend),
+        SMA14: calculate_sma(data, 14, backend),
+        EMA7: calculate_ema(data, 7, backend),
+        EMA14: calculate_ema(data, 14, backend),
+        RSI: calculate_rsi(data, window=14, backend=backend),
+        MACD: macd['MACD'],
+        SIGNAL_LINE: macd['Signal Line'],
+        BOLLINGER_SMA: bollinger_bands['Bollinger_SMA'],
+        UPPER_BAND_BB: bollinger_bands['Upper_Band'],
+        LOWER_BAND_BB: bollinger_bands['Lower_Band'],
+        ATR: calculate_atr(data, window=14, backend=backend),
+        K: stochastic['%K'],
+        D: stochastic['%D'],
+        OBV: calculate_obv(data, backend),
+    }
+
+    if isinstance(data.columns, pd.MultiIndex):
+        return pd.concat([data, pd.concat(indicators, axis=1)], axis=1)
+
+    for column, values in indicators.items():
+        data[column] = values
+    return data
+
+
+def downcast_frame(data):
+    """
+    Downcasts the float64 columns of a frame to float32 in place, halving their memory.
+
+    Parameters:
+    - data: pandas DataFrame of bars and indicators.
+
+    Returns:
+    - pandas DataFrame: The same frame with float32 columns.
+    """
+    floats = data.select_dtypes('float64').columns
+    if len(floats):
+        data[floats] = data[floats].astype('float32')
+    return data
+
+
+def rolling_window_bars(data, hours=24):
+    """
+    Builds the bars covering the `hours` hours up to every hourly bar, on a complete hourly grid.
+
+    Parameters:
+    - data: pandas DataFrame of hourly OHLCV bars.
+    - hours: Integer length of the window (default: 24).
+
+    Returns:
+    - pandas DataFrame: One bar per hour with the columns of `data`, aggregated over the window ending at that hour.
+    """
+    grid = data.asfreq('h') ## Missing hours stay NaN so every window spans the same time
+    closes = grid['Close'].ffill()
+    bars = pd.DataFrame(index=grid.index)
+    for column in data.columns:
+        if column == 'Open':
+            bars[column] = grid['Open'].shift(hours - 1).fillna(closes.shift(hours))
+        elif column == 'High':
+            bars[column] = grid['High'].rolling(window=hours, min_periods=1).max()
+        elif column == 'Low':
+            bars[column] = grid['Low'].rolling(window=hours, min_periods=1).min()
+        elif column == 'Volume':
+            bars[column] = grid['Volume'].rolling(window=hours, min_periods=1).sum()
+        else:
+            bars[column] = grid[column].ffill()
+    return bars.iloc[hours:]
+
+
+def anchored_panel(bars, periods, hours=24):
+    """
+    Reshapes rolling-window bars into a panel with one column per anchor hour, so consecutive rows of a column
+    are consecutive non-overlapping windows, like daily bars closing at that hour.
+
+    Parameters:
+    - bars: pandas DataFrame as returned by `rolling_window_bars`.
+    - periods: Integer number of windows kept per anchor.
+    - hours: Integer length of the window (default: 24).
+
+    Returns:
+    - pandas DataFrame: The panel with MultiIndex (field, anchor) columns, the anchor being the position of the
+      hour among the last `hours` ones, and the end of each window of anchor 0 as index.
+    - pandas DatetimeIndex: The timestamp of the last window of every anchor.
+    """
+    periods = min(periods, len(bars) // hours)
+    bars = bars.iloc[len(bars) - periods * hours:]
+    panel = pd.concat(
+        {column: pd.DataFrame(bars[column].to_numpy().reshape(periods, hours), index=bars.index[::hours]) for column in bars.columns},
+        axis=1
+    )
+    return panel, bars.index[-hours:]
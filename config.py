@@ -25,6 +25,20 @@ QUERIES = {
 ### Defining the common parameters
 MODE = "ArtList"
 FORMAT = "json"
+MAXRECORDS = 250          ### Results per merged query (GDELT returns 75 articles per request by default and at most 250)
+CATEGORY_MAXRECORDS = 75  ### Results per category query, GDELT's default as originally sent by the per-category plan
+
+### Query planner: send the category queries merged into a few broader ones and classify the articles locally
+MERGE_QUERIES = True
+QUERY_MAX_PHRASES = 20
+DOWNLOAD_WORKERS = 4
+
+### Historical backfills: checkpointed window length, concurrent GDELT queries, minimum seconds between two GDELT
+### requests, and the smallest window a query hitting the MAXRECORDS cap is split down to
+BACKFILL_WINDOW_DAYS = 1
+BACKFILL_WORKERS = 4
+GDELT_MIN_INTERVAL = 1
+MIN_QUERY_WINDOW_MINUTES = 15
 
 ### Defining the imapct weights for news categories
 IMPACT_WEIGHTS = {
@@ -58,4 +72,75 @@ LOWER_BAND_BB = 'Lower_Band_BB'
 ATR = 'ATR'
 K = '%K'
 D = '%D'
-OBV = 'OBV'
\ No newline at end of file
+OBV = 'OBV'
+
+### Port and interface of the Prometheus metrics endpoint (set the port to None to disable it). The endpoint is not
+### authenticated: bind it to '0.0.0.0' only behind a firewall or a scraping sidecar
+METRICS_PORT = 9100
+METRICS_HOST = '127.0.0.1'
+
+### SQLite time-series store (bars, articles, sentiment) and append-only log of the predictions, in the same database
+STORE_PATH = 'data/bitanalytica.db'
+PREDICTION_LOG = STORE_PATH
+### CSV file the predictions were saved to before, imported once into an empty default log
+LEGACY_PREDICTIONS_CSV = 'data/predictions.csv'
+
+
+### Processes cleaning the text of the offline corpus jobs (sentiment DAG, preprocess_corpus); the app cleans in-thread
+CLEAN_WORKERS = 4
+### Articles scored per forward pass
+SENTIMENT_BATCH_SIZE = 16
+
+### Long-document scoring: score whole articles with overlapping 512-token windows instead of truncating them
+LONG_DOCUMENT_SCORING = False
+WINDOW_STRIDE = 128
+
+### Tokenize with the fast (Rust) tokenizer, every text of a scoring call in one batched call
+FAST_TOKENIZER = True
+
+### Cache of the sentiment recomputation DAG (see sentiment_dag.py)
+SENTIMENT_DAG_DIR = 'data/sentiment_dag'
+
+### Title-first scoring: download and score the article body only when the title prediction is less confident than the threshold
+TITLE_FIRST_SCORING = False
+TITLE_CONFIDENCE_THRESHOLD = 0.9
+
+### Yahoo Finance tickers of the multi-asset pipeline
+SYMBOLS = ['BTC-USD', 'ETH-USD', 'SOL-USD', 'BNB-USD', 'XRP-USD']
+
+### Minutes the multi-asset panel of the daily charts is served before it is downloaded again
+MARKET_REFRESH_MINUTES = 60
+
+### First day of the daily bars the indicators are calculated from (the models use the days since 2017-01-08)
+DAILY_HISTORY_START = '2016-12-01'
+
+### Days of hourly history kept as the base series of every timeframe (Yahoo serves at most 730 days of 1h bars)
+BASE_HISTORY_DAYS = 365
+
+### Backend of the indicator calculations: 'pandas', or 'numba', 'numpy' or 'auto' for the kernels of indicator_kernels.py
+INDICATOR_BACKEND = 'pandas'
+
+### Memory-budget mode: keep indicator frames in float32 and release the sentiment model between daily runs
+MEMORY_BUDGET_MODE = False
+
+### Warm-start snapshot built at image build time (python warm_snapshot.py build), loaded at boot when present
+WARM_SNAPSHOT_DIR = 'snapshot'
+NLTK_PACKAGES = ['punkt', 'punkt_tab', 'stopwords', 'wordnet']
+
+### Minutes between two refreshes of the hourly chart (only the chart fragment re-executes)
+CHART_REFRESH_MINUTES = 10
+
+### Intraday predictions: next-24h high/low refreshed every hour from 24-hour bars ending at each of the last hours
+INTRADAY_PREDICTIONS = True
+
+### Minutes a failed prediction task waits before a session starts it again (e.g. during a GDELT or Yahoo outage)
+PREDICTION_RETRY_MINUTES = 15
+INTRADAY_HISTORY_DAYS = 120     ### 24-hour bars behind each intraday feature row
+INTRADAY_MAX_BATCH = 24         ### Hours predicted at most per refresh, in one batch per model
+INTRADAY_LATENCY_BUDGET = 5.0   ### Seconds a refresh may take, incremental bar download included
+
+### CPU threading and inference concurrency (see runtime.py)
+INTRA_OP_THREADS = None         ### Threads of one model operation; None splits the cores between the concurrent model calls
+INTER_OP_THREADS = 1            ### Operations run in parallel within one model call
+MAX_CONCURRENT_INFERENCE = 2    ### Model calls running at once across every session, the others queue
+HEAVY_WORKERS = 2               ### Threads of the executor running the daily and intraday prediction tasks
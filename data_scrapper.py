@@ -3,10 +3,44 @@ import pandas as pd
 from newspaper import Article
 import time
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 import os
-from config import BASE_URL, QUERIES, MODE, FORMAT
+import threading
+from config import BASE_URL, QUERIES, MODE, FORMAT, MAXRECORDS, CATEGORY_MAXRECORDS, MERGE_QUERIES, DOWNLOAD_WORKERS
+from config import GDELT_MIN_INTERVAL, BACKFILL_WINDOW_DAYS, BACKFILL_WORKERS, MIN_QUERY_WINDOW_MINUTES
+from metrics import timer, counter
+from query_planner import plan_queries, build_category_matchers, classify_article
+from replay import get_fetcher
 
 
+class RateLimiter:
+    """
+    Spaces out the requests sent to a service from any number of threads.
+
+    The interval is scaled by the polite delay of the active fetcher, so replays are not throttled.
+
+    Attributes:
+        min_interval (float): The minimum number of seconds between two requests.
+    """
+
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """
+        Blocks until the next request is allowed.
+        """
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.min_interval * get_fetcher().polite_delay
+        time.sleep(slot - now)
+
+
+GDELT_RATE_LIMITER = RateLimiter(GDELT_MIN_INTERVAL)
+
 
 def scrape_url(url, retries=3, delay=5):
     """
@@ -22,89 +56,264 @@ def scrape_url(url, retries=3, delay=5):
     """
     for i in range(retries):
         try:
-            response = requests.get(url)
+            GDELT_RATE_LIMITER.wait()
+            counter('gdelt_requests', 'Requests sent to the GDELT API').inc()
+            with timer('gdelt_request', 'Latency of a single HTTP request'):
+                response = get_fetcher().get(url)
             if response.status_code == 200:
                 return response
             else:
                 print(f"Error fetching data (attempt {i+1}/{retries}): {response.status_code}, {response.text}")
         except requests.exceptions.RequestException as e:
             print(f"Request error (attempt {i+1}/{retries}): {e}")
-        time.sleep(delay)
+        time.sleep(delay * get_fetcher().polite_delay)
     return None
 
 
 
-def fetch_data(start_date, end_date, file_index=None, base_dir=None, save=False):
+def download_article(article_url):
     """
-    Fetches news articles from the GDELT API based on the specified date range and saves the data to a CSV file.
+    Downloads and parses the full text of a news article.
 
     Args:
-        start_date (str): The start date of the date range in the format 'YYYY-MM-DD'.
-        end_date (str): The end date of the date range in the format 'YYYY-MM-DD'.
-        file_index (int): The index of the file to be saved.
+        article_url (str): The URL of the article.
 
     Returns:
-        None
+        str: The article text, or an empty string if the article could not be downloaded.
     """
+    # Attempt to scrape the article content with increased timeout
+    try:
+        with timer('article_download', 'Latency of downloading and parsing an article'):
+            news_article = Article(article_url)
+            news_article.download(input_html=get_fetcher().get_article_html(article_url))
+            news_article.parse()
+        counter('articles_fetched', 'Articles downloaded successfully').inc()
+        return news_article.text
+    except Exception as e:
+        counter('articles_failed', 'Articles that failed to download').inc()
+        print(f"Failed to scrape {article_url}: {e}")
+        return ''
+
+
+def build_query_url(query, start_date, end_date, maxrecords=MAXRECORDS):
+    """
+    Builds the GDELT ArtList URL of a query over a date range.
 
-    df_all_articles = pd.DataFrame()
+    Args:
+        query (str): The GDELT query.
+        start_date (datetime): The start of the date range.
+        end_date (datetime): The end of the date range.
+        maxrecords (int, optional): The maximum number of articles returned. Defaults to MAXRECORDS.
+
+    Returns:
+        str: The request URL.
+    """
     start_date = start_date.strftime('%Y%m%d%H%M%S')
     end_date = end_date.strftime('%Y%m%d%H%M%S')
+    return f"{BASE_URL}?query={query}&mode={MODE}&format={FORMAT}&maxrecords={maxrecords}&startdatetime={start_date}&enddatetime={end_date}"
+
+
+def query_articles(name, query, start_date, end_date, maxrecords=MAXRECORDS):
+    """
+    Sends a query to the GDELT API and returns the metadata of the articles found.
+
+    Args:
+        name (str): The name of the query, used in the error messages.
+        query (str): The GDELT query.
+        start_date (datetime): The start of the date range.
+        end_date (datetime): The end of the date range.
+        maxrecords (int, optional): The maximum number of articles returned. Defaults to MAXRECORDS.
+
+    Returns:
+        list or None: The articles returned by GDELT, or None if the request failed.
+    """
+    response = scrape_url(build_query_url(query, start_date, end_date, maxrecords))
+    if not response:
+        print(f"Failed to fetch data for query '{name}' after multiple attempts")
+        return None
+    try:
+        return response.json().get('articles', [])
+    except requests.JSONDecodeError as e:
+        print(f"JSON decode error for query '{name}': {e}")
+        print("Response text:", response.text)
+        return None
+
+
+def query_all_articles(name, query, start_date, end_date, maxrecords=MAXRECORDS, min_window=timedelta(minutes=MIN_QUERY_WINDOW_MINUTES)):
+    """
+    Sends a query like `query_articles`, but splits the date range in two halves and queries them again whenever
+    the response hits the `maxrecords` cap, down to `min_window`, so a busy range does not silently lose articles.
+
+    Args:
+        name (str): The name of the query, used in the error messages.
+        query (str): The GDELT query.
+        start_date (datetime): The start of the date range.
+        end_date (datetime): The end of the date range.
+        maxrecords (int, optional): The maximum number of articles returned per request. Defaults to MAXRECORDS.
+        min_window (timedelta, optional): The smallest range split. Defaults to MIN_QUERY_WINDOW_MINUTES minutes.
+
+    Returns:
+        list or None: The articles of the whole range, or None if a request failed.
+    """
+    articles = query_articles(name, query, start_date, end_date, maxrecords)
+    if articles is None or len(articles) < maxrecords:
+        return articles
+    if end_date - start_date <= min_window:
+        counter('gdelt_windows_capped', 'Minimum-size query windows still hitting the result cap').inc()
+        print(f"Query '{name}' still capped at {maxrecords} results between {start_date} and {end_date}")
+        return articles
+
+    counter('gdelt_window_splits', 'Query windows split because the response hit the result cap').inc()
+    middle = start_date + (end_date - start_date) / 2
+    first = query_all_articles(name, query, start_date, middle, maxrecords, min_window)
+    second = query_all_articles(name, query, middle, end_date, maxrecords, min_window) if first is not None else None
+    return None if second is None else first + second
+
+
+def iter_articles(start_date, end_date, download=True, merged=MERGE_QUERIES):
+    """
+    Queries the GDELT API for every category and yields each article as soon as its content is downloaded.
+
+    Args:
+        start_date (datetime): The start of the date range.
+        end_date (datetime): The end of the date range.
+        download (bool, optional): Whether to download the content of the articles. If False, only the
+            GDELT metadata is returned and 'content' is empty. Defaults to True.
+        merged (bool, optional): Whether to send the merged queries of the query planner instead of one query
+            per category (see `iter_merged_articles`). Defaults to MERGE_QUERIES.
+
+    Yields:
+        dict: The article details ('category', 'publish_date', 'title', 'url' and 'content').
+    """
+    if merged:
+        yield from iter_merged_articles(start_date, end_date, download=download)
+        return
+
     for category, query in QUERIES.items():
-        # Construct the full URL with parameters
-        url = f"{BASE_URL}?query={query}&mode={MODE}&format={FORMAT}&startdatetime={start_date}&enddatetime={end_date}"
-        
         # Make the request to the GDELT API
-        response = scrape_url(url)
-        
-        if response:
-            try:
-                data = response.json()
-            except requests.JSONDecodeError as e:
-                print(f"JSON decode error for query '{category}': {e}")
-                print("Response text:", response.text)
-                continue
-            
-            # Extract the list of articles
-            articles = data.get('articles', [])
-            
-            # Create a list to hold the article details
-            article_data = []
+        articles = query_articles(category, query, start_date, end_date, CATEGORY_MAXRECORDS)
 
+        if articles is not None:
             # Loop through each article to fetch the full text
             for article in articles:
                 article_url = article.get('url', '')
-                title = article.get('title', '')
-                publish_date = article.get('seendate', '')
-                
-                # Attempt to scrape the article content with increased timeout
-                try:
-                    news_article = Article(article_url)
-                    news_article.download()
-                    news_article.parse()
-                    content = news_article.text
-                except Exception as e:
-                    content = ''
-                    print(f"Failed to scrape {article_url}: {e}")
-                
-                # Append the article details to the list
-                article_data.append({
+
+                yield {
                     'category': category,
-                    'publish_date': publish_date,
-                    'title': title,
+                    'publish_date': article.get('seendate', ''),
+                    'title': article.get('title', ''),
                     'url': article_url,
+                    'content': download_article(article_url) if download else ''
+                }
+
+                if download:
+                    time.sleep(get_fetcher().polite_delay)  # Sleep for 1 second between requests to not overload the server (skipped on replays)
+
+
+def iter_merged_articles(start_date, end_date, download=True, workers=DOWNLOAD_WORKERS):
+    """
+    Sends the few merged queries of the query planner concurrently, downloads every distinct article once and
+    yields it once per category whose keyword clause matches its title or content.
+
+    An article matching several categories is yielded once for each of them, so the impact weights still apply
+    per category. A merged query hitting the MAXRECORDS cap is split into smaller windows (`query_all_articles`),
+    so a busy day keeps all its articles. The rows are not identical to those of one query per category: that
+    plan stops at CATEGORY_MAXRECORDS articles per category, and articles matching no category here (the phrase
+    GDELT matched is not in the parsed text) are dropped and counted.
+
+    Args:
+        start_date (datetime): The start of the date range.
+        end_date (datetime): The end of the date range.
+        download (bool, optional): Whether to download the content of the articles. If False, the articles are
+            classified from their title only. Defaults to True.
+        workers (int, optional): The number of articles downloaded concurrently. Defaults to DOWNLOAD_WORKERS.
+
+    Yields:
+        dict: The article details ('category', 'publish_date', 'title', 'url' and 'content').
+    """
+    plan = plan_queries(QUERIES)
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=len(plan)) as pool:
+        results = list(pool.map(lambda entry: query_all_articles(', '.join(entry['categories']), entry['query'], start_date, end_date), plan))
+
+    stats = {}
+    yield from iter_downloaded_articles([found for found in results if found is not None], download=download, workers=workers, stats=stats)
+    print(f"Merged {len(QUERIES)} category queries into {len(plan)} API calls: {stats['articles']} distinct articles, "
+          f"{stats['rows']} category rows, {stats['unclassified']} unclassified, {time.perf_counter() - start:.1f}s")
+
+
+def iter_downloaded_articles(results, download=True, workers=DOWNLOAD_WORKERS, categories=None, stats=None):
+    """
+    Downloads every distinct article of a set of GDELT results once, concurrently, and yields it once per category.
+
+    By default the categories of an article are those whose keyword clause matches its title or content;
+    articles matching no category are dropped and counted.
+
+    Args:
+        results (list): The article lists returned by `query_articles`.
+        download (bool, optional): Whether to download the content of the articles. Defaults to True.
+        workers (int, optional): The number of articles downloaded concurrently. Defaults to DOWNLOAD_WORKERS.
+        categories (list, optional): The categories of each result list, when they are known (one query per
+            category) and the articles do not need to be classified. Defaults to None.
+        stats (dict, optional): Filled with the number of distinct 'articles', of yielded 'rows' and of
+            'unclassified' articles.
+
+    Yields:
+        dict: The article details ('category', 'publish_date', 'title', 'url' and 'content').
+    """
+    articles = {} ### url -> (metadata, categories), an article is often returned by several queries
+    for i, found in enumerate(results):
+        for article in found:
+            _, known = articles.setdefault(article.get('url', ''), (article, []))
+            if categories is not None and categories[i] not in known:
+                known.append(categories[i])
+    matchers = build_category_matchers(QUERIES) if categories is None else None
+
+    def fetch(url):
+        content = download_article(url) if download else ''
+        if download:
+            time.sleep(get_fetcher().polite_delay)
+        return url, content
+
+    stats = stats if stats is not None else {}
+    stats.update(articles=len(articles), rows=0, unclassified=0)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in as_completed([pool.submit(fetch, url) for url in articles]):
+            url, content = future.result()
+            article, known = articles[url]
+            matched = known if matchers is None else classify_article(f"{article.get('title', '')}\n{content}", matchers)
+            if not matched:
+                stats['unclassified'] += 1
+                counter('articles_unclassified', 'Articles returned by a merged query that match no category').inc()
+                continue
+            for category in matched:
+                stats['rows'] += 1
+                yield {
+                    'category': category,
+                    'publish_date': article.get('seendate', ''),
+                    'title': article.get('title', ''),
+                    'url': url,
                     'content': content
-                })
-                                
-                time.sleep(1)  # Sleep for 1 second between requests to not overload the server
-
-            # Convert to a DataFrame for easier handling
-            df_articles = pd.DataFrame(article_data)
-            
-            # Append to the main DataFrame
-            df_all_articles = pd.concat([df_all_articles, df_articles], ignore_index=True)
-        else:
-            print(f"Failed to fetch data for query '{category}' after multiple attempts")
+                }
+
+
+@timer('fetch_data', 'Time to query GDELT and download every article in a window')
+def fetch_data(start_date, end_date, file_index=None, base_dir=None, save=False, download=True, merged=MERGE_QUERIES):
+    """
+    Fetches news articles from the GDELT API based on the specified date range and saves the data to a CSV file.
+
+    Args:
+        start_date (str): The start date of the date range in the format 'YYYY-MM-DD'.
+        end_date (str): The end date of the date range in the format 'YYYY-MM-DD'.
+        file_index (int): The index of the file to be saved.
+        download (bool, optional): Whether to download the content of the articles. Defaults to True.
+        merged (bool, optional): Whether to use the merged queries of the query planner. Defaults to MERGE_QUERIES.
+
+    Returns:
+        None
+    """
+    df_all_articles = pd.DataFrame(list(iter_articles(start_date, end_date, download=download, merged=merged)))
 
     if save:
         os.makedirs(base_dir, exist_ok=True)
@@ -139,7 +348,9 @@ def clean_dates(dataframe):
 
 def fetch_historical_data(start_date, file_index, base_dir, end_date=None):
     """
-    Fetches historical data from a specified start date to an optional end date.
+    Fetches historical data from a specified start date to an optional end date (see `backfill_news`).
+
+    Running it again after an interruption only fetches the windows that were not saved yet.
 
     Args:
         start_date (str): The start date in the format 'YYYY-MM-DD'.
@@ -148,20 +359,139 @@ def fetch_historical_data(start_date, file_index, base_dir, end_date=None):
         end_date (str, optional): The end date in the format 'YYYY-MM-DD'. Defaults to the current date.
 
     Returns:
-        None
+        list: The paths of the saved windows.
     """
     start_date = datetime.strptime(start_date, '%Y-%m-%d')
     end_date = datetime.strptime(end_date, '%Y-%m-%d') if end_date is not None else datetime.now()
 
-    fetch_data(start_date=start_date, end_date=end_date, file_index=file_index, base_dir=base_dir, save=True)
+    return backfill_news(start_date, end_date, base_dir, file_index=file_index)
 
 
-def fetch_24hrs(start=None, end=None):
+def split_window(start_date, end_date, window):
     """
-    Fetches data for the entire previous day by default or for a specific day if start is provided.
+    Splits a date range into consecutive windows of a fixed length (the last one may be shorter).
+
+    Args:
+        start_date (datetime): The start of the range.
+        end_date (datetime): The end of the range.
+        window (timedelta): The length of a window.
 
     Returns:
-        The data fetched for the specified day.
+        list: The (start, end) pairs of the windows.
+    """
+    windows = []
+    while start_date < end_date:
+        windows.append((start_date, min(start_date + window, end_date)))
+        start_date += window
+    return windows
+
+
+def checkpoint_path(base_dir, file_index, window_start):
+    """
+    Returns the file a backfilled window is saved to. The files are picked up by `combine_news_data`.
+    """
+    return os.path.join(base_dir, f"bitcoin_news_data_{file_index}_{window_start.strftime('%Y%m%d%H%M')}.csv")
+
+
+@timer('backfill_news', 'Time to backfill the news of a date range')
+def backfill_news(start_date, end_date, base_dir, file_index=0, window=timedelta(days=BACKFILL_WINDOW_DAYS),
+                  workers=BACKFILL_WORKERS, merged=MERGE_QUERIES):
+    """
+    Backfills the news of a long date range completely, in parallel and resumably.
+
+    The range is cut into windows of `window` that are checkpointed to their own file once every article
+    is downloaded, and windows already checkpointed by an earlier run are skipped. The queries of all the
+    windows run concurrently (spaced out by `GDELT_RATE_LIMITER`) and a query whose response hits the
+    result cap (MAXRECORDS for merged queries, CATEGORY_MAXRECORDS per category) is split in two halves and sent
+    again, down to MIN_QUERY_WINDOW_MINUTES, so no article is silently dropped. A window with a failed query is not checkpointed and is retried by the next run.
+
+    Args:
+        start_date (datetime): The start of the range.
+        end_date (datetime): The end of the range.
+        base_dir (str): The directory the windows are saved to.
+        file_index (int, optional): The index prefixed to the file names. Defaults to 0.
+        window (timedelta, optional): The length of a checkpointed window. Defaults to BACKFILL_WINDOW_DAYS days.
+        workers (int, optional): The number of concurrent GDELT queries. Defaults to BACKFILL_WORKERS.
+        merged (bool, optional): Whether to use the merged queries of the query planner. Defaults to MERGE_QUERIES.
+
+    Returns:
+        list: The paths of the checkpoint files of the range.
+    """
+    os.makedirs(base_dir, exist_ok=True)
+    windows = split_window(start_date, end_date, window)
+    todo = [w for w in windows if not os.path.exists(checkpoint_path(base_dir, file_index, w[0]))]
+    print(f"Backfilling {len(todo)} of {len(windows)} windows ({len(windows) - len(todo)} already checkpointed)")
+
+    if merged:
+        plan = [(', '.join(entry['categories']), entry['query'], None) for entry in plan_queries(QUERIES)]
+    else:
+        plan = [(category, query, category) for category, query in QUERIES.items()]
+    maxrecords = MAXRECORDS if merged else CATEGORY_MAXRECORDS
+    min_window = timedelta(minutes=MIN_QUERY_WINDOW_MINUTES)
+
+    def save(window_start, results, categories):
+        rows = list(iter_downloaded_articles(results, categories=None if merged else categories))
+        path = checkpoint_path(base_dir, file_index, window_start)
+        pd.DataFrame(rows, columns=NEWS_COLUMNS).to_csv(path + '.tmp', index=False)
+        os.replace(path + '.tmp', path) ## A checkpoint is either complete or missing
+        return path
+
+    pending = {}   ### query future -> (window start, plan entry, sub-window start, sub-window end)
+    remaining = {} ### window start -> queries still running
+    collected = {w: ([], []) for w, _ in todo} ### window start -> (article lists, their categories)
+    failed = set()
+    saves = []
+
+    with ThreadPoolExecutor(max_workers=workers) as query_pool, ThreadPoolExecutor(max_workers=1) as save_pool:
+        def submit(window_start, entry, start, end):
+            pending[query_pool.submit(query_articles, entry[0], entry[1], start, end, maxrecords)] = (window_start, entry, start, end)
+            remaining[window_start] = remaining.get(window_start, 0) + 1
+
+        for window_start, window_end in todo:
+            for entry in plan:
+                submit(window_start, entry, window_start, window_end)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                window_start, entry, start, end = pending.pop(future)
+                remaining[window_start] -= 1
+                articles = future.result()
+
+                if articles is None:
+                    failed.add(window_start)
+                elif len(articles) >= maxrecords and end - start > min_window:
+                    ### The response was capped: query both halves instead
+                    counter('gdelt_window_splits', 'Query windows split because the response hit the result cap').inc()
+                    middle = start + (end - start) / 2
+                    submit(window_start, entry, start, middle)
+                    submit(window_start, entry, middle, end)
+                else:
+                    if len(articles) >= maxrecords:
+                        counter('gdelt_windows_capped', 'Minimum-size query windows still hitting the result cap').inc()
+                        print(f"Query '{entry[0]}' still capped at {maxrecords} results between {start} and {end}")
+                    collected[window_start][0].append(articles)
+                    collected[window_start][1].append(entry[2])
+
+                if remaining[window_start] == 0:
+                    results, categories = collected.pop(window_start)
+                    if window_start in failed:
+                        print(f"Window starting {window_start} is incomplete, it will be fetched again by the next run")
+                    else:
+                        saves.append(save_pool.submit(save, window_start, results, categories))
+
+        for future in saves:
+            print(f"Saved data to {future.result()}")
+
+    return [checkpoint_path(base_dir, file_index, w) for w, _ in windows if w not in failed]
+
+
+def get_24hr_window(start=None, end=None):
+    """
+    Returns the date range of the entire previous day by default or of a specific day if start is provided.
+
+    Returns:
+        tuple: The start and end datetimes of the window.
     """
     if start is None and end is None:
         now = datetime.now()
@@ -180,45 +510,111 @@ def fetch_24hrs(start=None, end=None):
         start_date = start
         end_date = end
 
-    dataframe = fetch_data(start_date=start_date, end_date=end_date)
+    return start_date, end_date
+
+
+def fetch_24hrs(start=None, end=None, merged=MERGE_QUERIES):
+    """
+    Fetches data for the entire previous day by default or for a specific day if start is provided.
+
+    Returns:
+        The data fetched for the specified day.
+    """
+    start_date, end_date = get_24hr_window(start, end)
+    dataframe = fetch_data(start_date=start_date, end_date=end_date, merged=merged)
     dataframe = clean_dates(dataframe)
 
     return dataframe
 
 
-def combine_news_data(base_dir, start_date, end_date):
+### Columns kept when combining the scraped news files
+NEWS_COLUMNS = ['category', 'publish_date', 'title', 'url', 'content']
+
+
+def combine_news_data(base_dir, start_date, end_date, output_dir='bitcoin_news_data', chunksize=5000, columns=NEWS_COLUMNS):
     """
-    Combine multiple CSV files containing bitcoin news data into a single DataFrame.
+    Combine multiple CSV files containing bitcoin news data into monthly partitions, with bounded memory.
+
+    The files are streamed `chunksize` rows at a time, reading only the needed columns. Rows without content
+    and rows already seen (same URL in the same category) are dropped on the fly, and every chunk is appended
+    to the partition of its month (`<output_dir>/<YYYY-MM>.csv`). Each partition is finally sorted by date,
+    so peak memory is bounded by the largest month instead of the whole corpus.
 
     Args:
         base_dir (str): The base directory where the CSV files are located.
         start_date (str): The start date of the time range for the news data.
         end_date (str): The end date of the time range for the news data.
+        output_dir (str, optional): The directory of the partitions. Defaults to 'bitcoin_news_data'.
+        chunksize (int, optional): The number of rows read at a time. Defaults to 5000.
+        columns (list, optional): The columns to keep. Defaults to NEWS_COLUMNS.
 
     Returns:
-        None
+        list: The paths of the written partitions.
 
     Raises:
         FileNotFoundError: If the base directory does not exist or is empty.
 
     """
-    base_dir = base_dir
+    os.makedirs(output_dir, exist_ok=True)
 
-    dataframes = []
+    seen = set() ### Hashes of (url, category): the same article legitimately appears once per category
+    partitions = set()
+    duplicates = 0
 
     for filename in sorted(os.listdir(base_dir)):
         if filename.startswith('bitcoin_news_data_') and filename.endswith('.csv'):
             filepath = os.path.join(base_dir, filename)
-            df = pd.read_csv(filepath)
-            dataframes.append(df)
+            for chunk in pd.read_csv(filepath, usecols=columns, dtype=str, chunksize=chunksize):
+                chunk = chunk.dropna(subset='content')
+
+                keys = pd.util.hash_pandas_object(chunk[['url', 'category']], index=False)
+                new = ~keys.duplicated() & ~keys.map(seen.__contains__).astype(bool)
+                duplicates += len(chunk) - int(new.sum())
+                seen.update(keys[new])
+                chunk = clean_dates(chunk[new.values])
+
+                for month, rows in chunk.groupby(chunk.index.str[:7]):
+                    partition = os.path.join(output_dir, f'{month}.csv')
+                    rows.to_csv(partition, mode='a' if partition in partitions else 'w', header=partition not in partitions)
+                    partitions.add(partition)
+
+    for partition in partitions:
+        df = pd.read_csv(partition, index_col='publish_date', dtype=str)
+        df.sort_index(kind='stable').to_csv(partition)
 
+    print(f"All bitcoin news data saved in {len(partitions)} monthly partitions of '{output_dir}' for time range {start_date} to {end_date} ({duplicates} duplicates dropped).")
+    return sorted(partitions)
 
-    combined_df = pd.concat(dataframes, ignore_index=True)
-    combined_df = clean_dates(combined_df)
-    combined_df.dropna(subset='content', inplace=True)
-    combined_df.to_csv('bitcoin_news_data.csv')
 
-    print(f"All bitcoin news data saved in 'bitcoin_news_data.csv' for time range {start_date} to {end_date}.")
+def read_news_partitions(output_dir='bitcoin_news_data', start_date=None, end_date=None, columns=None):
+    """
+    Reads the news partitions written by `combine_news_data` for a date range.
+
+    Args:
+        output_dir (str, optional): The directory of the partitions. Defaults to 'bitcoin_news_data'.
+        start_date (str, optional): The first date to read, in the format 'YYYY-MM-DD'. Defaults to the first partition.
+        end_date (str, optional): The last date to read, in the format 'YYYY-MM-DD'. Defaults to the last partition.
+        columns (list, optional): The columns to read. Defaults to every column.
+
+    Returns:
+        pd.DataFrame: The articles of the date range, indexed and sorted by publish date (empty, with the
+            expected columns, when no partition matches).
+    """
+    usecols = None if columns is None else ['publish_date'] + [c for c in columns if c != 'publish_date']
+    dataframes = []
+    for filename in sorted(os.listdir(output_dir)):
+        if not filename.endswith('.csv'):
+            continue
+        month = filename[:-len('.csv')]
+        if (start_date is not None and month < start_date[:7]) or (end_date is not None and month > end_date[:7]):
+            continue
+        dataframes.append(pd.read_csv(os.path.join(output_dir, filename), index_col='publish_date', usecols=usecols))
+
+    if not dataframes:
+        return pd.DataFrame(columns=[c for c in (usecols or NEWS_COLUMNS) if c != 'publish_date'],
+                            index=pd.Index([], name='publish_date'))
+    combined_df = pd.concat(dataframes)
+    return combined_df.loc[start_date:end_date]
 
 
 if __name__ == '__main__':
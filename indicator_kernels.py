@@ -0,0 +1,360 @@
+"""
+Author: Zeeshan Hameed
+
+Compiled and vectorized kernels behind the indicators of `btc_utils`, for very long series (e.g. years of
+minute bars).
+
+Two backends are available besides the default pandas path:
+    - 'numba': single-pass loops compiled with Numba (only if Numba is installed),
+    - 'numpy': plain NumPy, processed CHUNK_ROWS rows at a time so the temporaries stay small: running sums
+      (cumsum) for the rolling mean, sliding-window views for the rolling std, min and max, a blocked closed
+      form of the EWM recursion and a cumsum for the OBV.
+'auto' picks Numba when it is installed and the pandas path otherwise (the NumPy kernels avoid pandas but are
+slower than its compiled ones). Every kernel follows the pandas
+semantics (`rolling(window)` is NaN until the window is full or while it contains a NaN, `ewm(adjust=False)`
+carries its value over NaNs). The kernels sum in a different order than pandas, so their results match the
+pandas path within a relative difference of NUMBA_TOLERANCE and NUMPY_TOLERANCE (checked by
+`python benchmarks.py indicator_kernels`).
+
+The kernels take 1-D arrays (one series) or 2-D arrays (one column per symbol of a panel).
+"""
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+try:
+    import numba
+    NUMBA_AVAILABLE = True
+except ImportError:
+    numba = None
+    NUMBA_AVAILABLE = False
+
+BACKENDS = ('pandas', 'numpy', 'numba', 'auto')
+### Largest relative differences of the kernels from the pandas path. The widest is on the Bollinger bands:
+### pandas' online rolling variance drifts on long price series (2e-9 at 10M minute bars), the kernels'
+### two-pass std does not
+NUMBA_TOLERANCE = 1e-8
+NUMPY_TOLERANCE = 1e-8
+
+
+def resolve_backend(backend):
+    """
+    Returns the backend actually used for a requested backend.
+
+    Args:
+        backend (str): One of BACKENDS.
+
+    Returns:
+        str: 'pandas', 'numpy' or 'numba'.
+
+    Raises:
+        ValueError: If the backend is unknown, or is 'numba' and Numba is not installed.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown indicator backend {backend!r}, expected one of {BACKENDS}")
+    if backend == 'auto':
+        return 'numba' if NUMBA_AVAILABLE else 'pandas'
+    if backend == 'numba' and not NUMBA_AVAILABLE:
+        raise ValueError("The 'numba' indicator backend requires Numba (pip install numba)")
+    return backend
+
+
+### NumPy kernels (along axis 0)
+
+CHUNK_ROWS = 1 << 18 ### Windows reduced at a time, so temporaries stay small on millions of rows
+EWM_BLOCK_GROWTH = 1e3 ### Largest decay factor inverted by the blocked EWM, bounds its rounding error
+
+
+def _numpy_rolling(values, window, reduce):
+    out = np.full(values.shape, np.nan)
+    if len(values) >= window:
+        windows = sliding_window_view(values, window, axis=0)
+        for start in range(0, len(windows), CHUNK_ROWS):
+            chunk = windows[start:start + CHUNK_ROWS]
+            out[window - 1 + start:window - 1 + start + len(chunk)] = reduce(chunk, axis=-1) ## NaN propagates like min_periods=window
+    return out
+
+
+def _numpy_rolling_mean(values, window):
+    ### Window sums as differences of a running sum, restarted every chunk and taken around the chunk mean
+    ### so the running sum stays small and loses no precision on millions of rows
+    out = np.full(values.shape, np.nan)
+    missing = np.isnan(values)
+    filled = np.where(missing, 0.0, values)
+    for start in range(window - 1, len(values), CHUNK_ROWS):
+        stop = min(start + CHUNK_ROWS, len(values))
+        block, block_missing = filled[start - window + 1:stop], missing[start - window + 1:stop]
+        count = np.maximum((~block_missing).sum(axis=0, keepdims=True), 1)
+        reference = block.sum(axis=0, keepdims=True) / count
+        sums = np.cumsum(np.where(block_missing, 0.0, block - reference), axis=0)
+        nans = np.cumsum(block_missing, axis=0)
+        window_sums = sums[window - 1:] - np.concatenate([np.zeros_like(sums[:1]), sums[:-window]])
+        window_nans = nans[window - 1:] - np.concatenate([np.zeros_like(nans[:1]), nans[:-window]])
+        out[start:stop] = np.where(window_nans == 0, window_sums / window + reference, np.nan) ## NaN like min_periods=window
+    return out
+
+
+def _numpy_rolling_std(values, window):
+    ### Two passes over each window: sums of squares from running sums cancel catastrophically on prices
+    return _numpy_rolling(values, window, lambda windows, axis: np.std(windows, axis=axis, ddof=1))
+
+
+def _numpy_rolling_min(values, window):
+    return _numpy_rolling(values, window, np.min)
+
+
+def _numpy_rolling_max(values, window):
+    return _numpy_rolling(values, window, np.max)
+
+
+def _numpy_ewm_mean(values, span):
+    alpha = 2.0 / (span + 1.0)
+    out = np.full(values.shape, np.nan)
+    columns = values.reshape(len(values), -1)
+    for c in range(columns.shape[1]):
+        column = columns[:, c]
+        valid = ~np.isnan(column)
+        if not valid.any():
+            continue
+        first = int(np.argmax(valid))
+        ewm = _ewm_blocked if valid[first:].all() else _ewm_loop
+        out.reshape(len(values), -1)[first:, c] = ewm(column[first:], alpha)
+    return out
+
+
+def _ewm_blocked(values, alpha):
+    ### y[i] = decay * y[i - 1] + alpha * x[i]. Inside a block of B rows starting after y[s - 1]:
+    ###   y[s + k] = decay^(k + 1) * y[s - 1] + alpha * decay^k * cumsum(x[s + j] / decay^j)[k]
+    ### B is the largest block whose decay^-B stays under EWM_BLOCK_GROWTH, so the scaling loses no precision;
+    ### only the carry from block to block is sequential
+    decay = 1.0 - alpha
+    block = max(1, int(np.log(EWM_BLOCK_GROWTH) / -np.log(decay))) if decay > 0 else 1
+    rows = len(values)
+    padded = np.zeros(-(-rows // block) * block)
+    padded[:rows] = values
+    blocks = padded.reshape(-1, block)
+    powers = decay ** np.arange(block)
+    partial = alpha * powers * np.cumsum(blocks / powers, axis=1) ## Every block started from y[s - 1] = 0
+    carry = np.empty(len(blocks))
+    previous, end_decay = values[0], decay ** block ## y[-1] = x[0] makes y[0] = x[0], like pandas
+    for b in range(len(blocks)):
+        carry[b] = previous
+        previous = end_decay * previous + partial[b, -1]
+    return (partial + decay * powers * carry[:, None]).reshape(-1)[:rows]
+
+
+def _ewm_loop(values, alpha):
+    ### Gaps inside the series follow pandas (ignore_na=False): the old value keeps decaying over NaNs
+    out = np.empty(len(values))
+    weighted, old_weight = values[0], 1.0
+    for i, x in enumerate(values):
+        if x == x:
+            if i:
+                old_weight *= 1.0 - alpha
+                weighted = (old_weight * weighted + alpha * x) / (old_weight + alpha)
+                old_weight = 1.0
+        else:
+            old_weight *= 1.0 - alpha
+        out[i] = weighted
+    return out
+
+
+def _numpy_obv(close, volume):
+    direction = np.sign(np.diff(close, axis=0, prepend=close[:1] * np.nan))
+    direction[np.isnan(direction)] = 0
+    flows = volume * direction
+    missing = np.isnan(flows)
+    obv = np.cumsum(np.where(missing, 0, flows), axis=0)
+    obv[missing] = np.nan ### Like pandas' cumsum, a missing volume is NaN but does not stop the running total
+    return obv
+
+
+### Numba kernels (2-D, one column at a time)
+
+if NUMBA_AVAILABLE:
+    @numba.njit(cache=True)
+    def _numba_rolling_mean(values, window):
+        rows, cols = values.shape
+        out = np.full((rows, cols), np.nan)
+        for c in range(cols):
+            total = 0.0
+            compensation = 0.0 ### Kahan summation, like pandas
+            nans = 0
+            for i in range(rows):
+                x = values[i, c]
+                if np.isnan(x):
+                    nans += 1
+                else:
+                    y = x - compensation
+                    t = total + y
+                    compensation = (t - total) - y
+                    total = t
+                if i >= window:
+                    old = values[i - window, c]
+                    if np.isnan(old):
+                        nans -= 1
+                    else:
+                        y = -old - compensation
+                        t = total + y
+                        compensation = (t - total) - y
+                        total = t
+                if i >= window - 1 and nans == 0:
+                    out[i, c] = total / window
+        return out
+
+    @numba.njit(cache=True)
+    def _numba_rolling_std(values, window):
+        rows, cols = values.shape
+        out = np.full((rows, cols), np.nan)
+        for c in range(cols):
+            for i in range(window - 1, rows):
+                mean = 0.0
+                valid = True
+                for j in range(i - window + 1, i + 1):
+                    if np.isnan(values[j, c]):
+                        valid = False
+                        break
+                    mean += values[j, c]
+                if not valid:
+                    continue
+                mean /= window
+                squares = 0.0
+                for j in range(i - window + 1, i + 1):
+                    squares += (values[j, c] - mean) ** 2
+                out[i, c] = np.sqrt(squares / (window - 1))
+        return out
+
+    @numba.njit(cache=True)
+    def _numba_rolling_extreme(values, window, sign):
+        ### sign=1 for the max, -1 for the min; a monotonic deque of indices keeps every step O(1) amortized
+        rows, cols = values.shape
+        out = np.full((rows, cols), np.nan)
+        queue = np.empty(rows, dtype=np.int64)
+        for c in range(cols):
+            head, tail = 0, 0
+            last_nan = -1
+            for i in range(rows):
+                x = values[i, c]
+                if np.isnan(x):
+                    last_nan = i
+                else:
+                    while tail > head and sign * values[queue[tail - 1], c] <= sign * x:
+                        tail -= 1
+                    queue[tail] = i
+                    tail += 1
+                while tail > head and queue[head] <= i - window:
+                    head += 1
+                if i >= window - 1 and last_nan <= i - window and tail > head:
+                    out[i, c] = values[queue[head], c]
+        return out
+
+    @numba.njit(cache=True)
+    def _numba_ewm_mean(values, span):
+        rows, cols = values.shape
+        out = np.full((rows, cols), np.nan)
+        alpha = 2.0 / (span + 1.0)
+        for c in range(cols):
+            weighted = np.nan
+            old_weight = 1.0
+            for i in range(rows):
+                x = values[i, c]
+                if not np.isnan(x):
+                    if np.isnan(weighted):
+                        weighted = x
+                    else:
+                        old_weight *= 1.0 - alpha
+                        weighted = (old_weight * weighted + alpha * x) / (old_weight + alpha)
+                        old_weight = 1.0
+                elif not np.isnan(weighted):
+                    old_weight *= 1.0 - alpha ### pandas ignore_na=False: the old value keeps decaying over NaNs
+                out[i, c] = weighted
+        return out
+
+    @numba.njit(cache=True)
+    def _numba_obv(close, volume):
+        rows, cols = close.shape
+        out = np.empty((rows, cols))
+        for c in range(cols):
+            total = 0.0
+            for i in range(rows):
+                if np.isnan(volume[i, c]):
+                    out[i, c] = np.nan
+                    continue
+                if i > 0 and not np.isnan(close[i, c]) and not np.isnan(close[i - 1, c]):
+                    if close[i, c] > close[i - 1, c]:
+                        total += volume[i, c]
+                    elif close[i, c] < close[i - 1, c]:
+                        total -= volume[i, c]
+                out[i, c] = total
+        return out
+
+    def _numba_rolling_min(values, window):
+        return _numba_rolling_extreme(values, window, -1.0)
+
+    def _numba_rolling_max(values, window):
+        return _numba_rolling_extreme(values, window, 1.0)
+
+
+KERNELS = {
+    'numpy': {
+        'rolling_mean': _numpy_rolling_mean,
+        'rolling_std': _numpy_rolling_std,
+        'rolling_min': _numpy_rolling_min,
+        'rolling_max': _numpy_rolling_max,
+        'ewm_mean': _numpy_ewm_mean,
+        'obv': _numpy_obv,
+    },
+}
+if NUMBA_AVAILABLE:
+    KERNELS['numba'] = {
+        'rolling_mean': _numba_rolling_mean,
+        'rolling_std': _numba_rolling_std,
+        'rolling_min': _numba_rolling_min,
+        'rolling_max': _numba_rolling_max,
+        'ewm_mean': _numba_ewm_mean,
+        'obv': _numba_obv,
+    }
+
+
+def _as_2d(data):
+    return np.ascontiguousarray(data.to_numpy(dtype=np.float64).reshape(len(data), -1))
+
+
+def _wrap(like, values):
+    if isinstance(like, pd.DataFrame):
+        return pd.DataFrame(values, index=like.index, columns=like.columns)
+    return pd.Series(values[:, 0], index=like.index, name=like.name)
+
+
+def run_kernel(name, backend, data, *args):
+    """
+    Runs a kernel on a Series (one symbol) or a DataFrame (one column per symbol) and wraps the result the same way.
+
+    Args:
+        name (str): The kernel name ('rolling_mean', 'rolling_std', 'rolling_min', 'rolling_max' or 'ewm_mean').
+        backend (str): One of BACKENDS except 'pandas'.
+        data (pandas.Series or pandas.DataFrame): The input values.
+        *args: The window or span of the kernel.
+
+    Returns:
+        pandas.Series or pandas.DataFrame: The kernel output, with the index and columns of `data`.
+    """
+    return _wrap(data, KERNELS[resolve_backend(backend)][name](_as_2d(data), *args))
+
+
+def run_obv(backend, close, volume):
+    """
+    Computes the On-Balance Volume with a kernel backend.
+
+    Args:
+        backend (str): One of BACKENDS except 'pandas'.
+        close (pandas.Series or pandas.DataFrame): The closes.
+        volume (pandas.Series or pandas.DataFrame): The volumes.
+
+    Returns:
+        pandas.Series or pandas.DataFrame: The On-Balance Volume, with the index and columns of `close`.
+    """
+    obv = _wrap(close, KERNELS[resolve_backend(backend)]['obv'](_as_2d(close), _as_2d(volume)))
+    integer = volume.dtypes.map(pd.api.types.is_integer_dtype).all() if isinstance(volume, pd.DataFrame) else pd.api.types.is_integer_dtype(volume)
+    return obv.astype('int64') if integer else obv ## Integer volumes give an integer OBV, like the pandas path
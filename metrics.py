@@ -0,0 +1,349 @@
+"""
+Author: Zeeshan Hameed
+"""
+
+import json
+import os
+import time
+import threading
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+### Default latency buckets (seconds) shared by every histogram
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Counter:
+    """
+    A monotonically increasing counter.
+
+    Attributes:
+        name (str): The metric name.
+        help (str): A short description of the metric.
+        value (float): The current value of the counter.
+    """
+
+    def __init__(self, name, help=''):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        """
+        Increments the counter by the given amount.
+
+        Args:
+            amount (int, optional): The amount to add. Defaults to 1.
+        """
+        with self._lock:
+            self.value += amount
+
+
+class Histogram:
+    """
+    A fixed-bucket latency histogram.
+
+    Observations are only binned and summed, so recording one is O(number of buckets)
+    and the memory footprint does not grow with the number of observations.
+
+    Attributes:
+        name (str): The metric name.
+        help (str): A short description of the metric.
+        buckets (tuple): The upper bounds of the buckets.
+        counts (list): The number of observations in each bucket (not cumulative).
+        sum (float): The sum of all observed values.
+        count (int): The number of observations.
+    """
+
+    def __init__(self, name, help='', buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """
+        Records a single observation.
+
+        Args:
+            value (float): The observed value (usually a duration in seconds).
+        """
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class MetricsRegistry:
+    """
+    A registry holding every counter and histogram of the process.
+
+    Methods:
+        counter: Returns (and creates if needed) a counter.
+        histogram: Returns (and creates if needed) a histogram.
+        timer: Returns a timer that records into a histogram.
+        to_prometheus: Renders all metrics in the Prometheus text exposition format.
+        to_dict: Returns all metrics as a JSON-serializable dictionary.
+    """
+
+    def __init__(self, prefix='bitanalytica'):
+        self.prefix = prefix
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help=''):
+        """
+        Returns the counter with the given name, creating it on first use.
+
+        Args:
+            name (str): The metric name.
+            help (str, optional): A short description of the metric.
+
+        Returns:
+            Counter: The counter object.
+        """
+        with self._lock:
+            if name not in self._counters:
+                self._counters[name] = Counter(name, help)
+            return self._counters[name]
+
+    def histogram(self, name, help='', buckets=DEFAULT_BUCKETS):
+        """
+        Returns the histogram with the given name, creating it on first use.
+
+        Args:
+            name (str): The metric name.
+            help (str, optional): A short description of the metric.
+            buckets (tuple, optional): The bucket upper bounds. Defaults to DEFAULT_BUCKETS.
+
+        Returns:
+            Histogram: The histogram object.
+        """
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = Histogram(name, help, buckets)
+            return self._histograms[name]
+
+    def timer(self, name, help=''):
+        """
+        Returns a timer recording into the `<name>_seconds` histogram.
+
+        Args:
+            name (str): The stage name.
+            help (str, optional): A short description of the stage.
+
+        Returns:
+            Timer: A timer usable as a context manager or a decorator.
+        """
+        return Timer(self.histogram(f'{name}_seconds', help))
+
+    def reset(self):
+        """
+        Removes every registered metric.
+        """
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def to_prometheus(self):
+        """
+        Renders all metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The rendered metrics.
+        """
+        lines = []
+        for counter in list(self._counters.values()):
+            name = f'{self.prefix}_{counter.name}_total'
+            lines.append(f'# HELP {name} {counter.help}')
+            lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name} {counter.value}')
+
+        for histogram in list(self._histograms.values()):
+            name = f'{self.prefix}_{histogram.name}'
+            lines.append(f'# HELP {name} {histogram.help}')
+            lines.append(f'# TYPE {name} histogram')
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{le="+Inf"}} {histogram.count}')
+            lines.append(f'{name}_sum {histogram.sum}')
+            lines.append(f'{name}_count {histogram.count}')
+
+        return '\n'.join(lines) + '\n'
+
+    def to_dict(self):
+        """
+        Returns all metrics as a JSON-serializable dictionary.
+
+        Returns:
+            dict: Counters mapped to their values and histograms mapped to their count, sum, mean and buckets.
+        """
+        return {
+            'counters': {c.name: c.value for c in list(self._counters.values())},
+            'histograms': {
+                h.name: {
+                    'count': h.count,
+                    'sum': h.sum,
+                    'mean': h.sum / h.count if h.count else 0.0,
+                    'buckets': dict(zip([str(b) for b in h.buckets] + ['+Inf'], h.counts)),
+                }
+                for h in list(self._histograms.values())
+            },
+        }
+
+
+class Timer:
+    """
+    Measures wall time into a histogram, as a context manager or as a decorator.
+
+    Example:
+        with timer('clean_text'):
+            ...
+
+        @timer('get_sentiment')
+        def get_sentiment(...):
+            ...
+    """
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self._local = threading.local()
+
+    def __enter__(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(time.perf_counter())
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        start = self._local.stack.pop()
+        self.histogram.observe(time.perf_counter() - start)
+        return False
+
+    def __call__(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+        return wrapper
+
+
+### The process-wide registry used across the pipelines
+REGISTRY = MetricsRegistry()
+
+
+def timer(name, help=''):
+    """
+    Returns a timer on the process-wide registry.
+
+    Args:
+        name (str): The stage name.
+        help (str, optional): A short description of the stage.
+
+    Returns:
+        Timer: A timer usable as a context manager or a decorator.
+    """
+    return REGISTRY.timer(name, help)
+
+
+def counter(name, help=''):
+    """
+    Returns a counter on the process-wide registry.
+
+    Args:
+        name (str): The metric name.
+        help (str, optional): A short description of the metric.
+
+    Returns:
+        Counter: The counter object.
+    """
+    return REGISTRY.counter(name, help)
+
+
+def log_metrics(path='data/metrics.jsonl', extra=None):
+    """
+    Appends a timestamped JSON snapshot of all metrics to the given file.
+
+    Args:
+        path (str, optional): The JSON-lines file to append to. Defaults to 'data/metrics.jsonl'.
+        extra (dict, optional): Additional JSON-serializable fields to store in the snapshot.
+    """
+    snapshot = REGISTRY.to_dict()
+    snapshot.update(extra or {})
+    snapshot['timestamp'] = time.time()
+    with open(path, 'a') as f:
+        f.write(json.dumps(snapshot) + '\n')
+
+
+def current_rss_bytes():
+    """
+    Returns the current resident set size of the process.
+
+    Returns:
+        int: The RSS in bytes (the peak RSS where the current one is not available).
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            body = REGISTRY.to_prometheus().encode()
+            content_type = 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body = json.dumps(REGISTRY.to_dict()).encode()
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port=9100, host='127.0.0.1'):
+    """
+    Serves the metrics on `/metrics` (Prometheus) and `/metrics.json` from a daemon thread. The endpoint is not
+    authenticated, so it only listens on the loopback interface unless another host is given.
+
+    Args:
+        port (int, optional): The port to listen on. Defaults to 9100.
+        host (str, optional): The interface to bind. Defaults to '127.0.0.1'.
+
+    Returns:
+        ThreadingHTTPServer or None: The running server, or None if the port is already in use (e.g. by
+            another replica on the same host).
+    """
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f"Metrics endpoint not started on {host}:{port}: {e}")
+        return None
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
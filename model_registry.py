@@ -0,0 +1,162 @@
+"""
+Author: Zeeshan Hameed
+
+Versioned, hot-reloadable registry over the `models/` tree.
+
+`models/manifest.json` lists every version with the path of each artifact (relative to `models/`) and names
+the active one. When the active version changes, the new version is loaded and warmed up in a background
+thread while the current one keeps serving, and is then swapped in atomically.
+"""
+
+import json
+import os
+import threading
+import time
+import numpy as np
+from app_utils import load_models, DEFAULT_MODEL_FILES
+from metrics import current_rss_bytes, counter
+
+
+class ModelBundle:
+    """
+    The models and scalers of one version, ready to serve.
+
+    Attributes:
+        version (str): The version name.
+        models (tuple): (x_scaler, y_high_scaler, y_low_scaler, high_model, low_model), as returned by `load_models`.
+        load_seconds (float): The time taken to load and warm up the version.
+        memory_bytes (int): The growth of the process RSS while loading the version.
+    """
+
+    def __init__(self, version, models, load_seconds, memory_bytes):
+        self.version = version
+        self.models = models
+        self.load_seconds = load_seconds
+        self.memory_bytes = memory_bytes
+
+
+class ModelRegistry:
+    """
+    Loads model versions from the manifest and swaps the active version without blocking serving.
+
+    Methods:
+        current: Returns the active bundle, loading it synchronously on first use.
+        refresh: Starts loading the active version of the manifest in the background if it changed.
+        report: Returns the load time and memory of every loaded version.
+    """
+
+    def __init__(self, root='models', manifest='manifest.json'):
+        """
+        Initializes the registry.
+
+        Args:
+            root (str, optional): The models directory. Defaults to 'models'.
+            manifest (str, optional): The manifest file name inside `root`. Defaults to 'manifest.json'.
+        """
+        self.root = root
+        self.manifest_path = os.path.join(root, manifest)
+        self._active = None
+        self._loading = None
+        self._manifest_mtime = None
+        self._stats = {}
+        self._lock = threading.RLock() ## Re-entered by `load_version` when `current` loads under it
+
+    def read_manifest(self):
+        """
+        Reads the manifest, falling back to the historical single-version layout when there is none.
+
+        Returns:
+            dict: The manifest with the 'active' version name and the 'versions' artifacts.
+        """
+        if not os.path.exists(self.manifest_path):
+            return {'active': 'v1', 'versions': {'v1': DEFAULT_MODEL_FILES}}
+        with open(self.manifest_path) as f:
+            return json.load(f)
+
+    def load_version(self, version, files):
+        """
+        Loads and warms up a version (one dummy prediction per model so the first real request is not slower).
+
+        Args:
+            version (str): The version name.
+            files (dict): The path of each artifact relative to the models directory.
+
+        Returns:
+            ModelBundle: The loaded version.
+        """
+        rss_before = current_rss_bytes()
+        start = time.perf_counter()
+
+        models = load_models(self.root, files)
+        x_scaler, _, _, high_model, low_model = models
+        warmup = np.zeros((1, x_scaler.n_features_in_))
+        high_model.predict(warmup.reshape((1, 1, warmup.shape[1])), verbose=0)
+        low_model.predict(warmup)
+
+        bundle = ModelBundle(version, models, time.perf_counter() - start, current_rss_bytes() - rss_before)
+        with self._lock: ## Written from the background loader while sessions read `report`
+            self._stats[version] = {'load_seconds': bundle.load_seconds, 'memory_mb': bundle.memory_bytes / 2**20}
+        print(f"Loaded model version {version} in {bundle.load_seconds:.1f}s (+{bundle.memory_bytes / 2**20:.0f} MB)")
+        return bundle
+
+    def current(self):
+        """
+        Returns the active bundle, loading the active version of the manifest synchronously on first use.
+
+        Returns:
+            ModelBundle: The bundle to serve predictions with.
+        """
+        if self._active is None:
+            with self._lock:
+                if self._active is None:
+                    manifest = self.read_manifest()
+                    self._manifest_mtime = self._mtime()
+                    self._active = self.load_version(manifest['active'], manifest['versions'][manifest['active']])
+        return self._active
+
+    def refresh(self):
+        """
+        Checks the manifest and, if another version became active, loads it in a background thread and swaps
+        it in once it is warm. The current version keeps serving in the meantime.
+
+        Returns:
+            bool: Whether a new version started loading.
+        """
+        mtime = self._mtime()
+        if mtime == self._manifest_mtime:
+            return False
+
+        with self._lock:
+            if self._loading is not None and self._loading.is_alive():
+                return False
+            self._manifest_mtime = mtime
+            manifest = self.read_manifest()
+            version = manifest['active']
+            if self._active is not None and self._active.version == version:
+                return False
+
+            def load_and_swap():
+                try:
+                    bundle = self.load_version(version, manifest['versions'][version])
+                except Exception as e:
+                    print(f"Failed to load model version {version}: {e}")
+                    return
+                self._active = bundle ## A single reference assignment: requests see either the old or the new bundle
+                counter('model_swaps', 'Model versions swapped in').inc()
+
+            self._loading = threading.Thread(target=load_and_swap, name=f'load-model-{version}', daemon=True)
+            self._loading.start()
+            return True
+
+    def report(self):
+        """
+        Returns the load time and memory of every version loaded by this process.
+
+        Returns:
+            dict: Version name mapped to its 'load_seconds' and 'memory_mb', plus the 'active' version.
+        """
+        with self._lock:
+            return {'active': self._active.version if self._active else None, 'versions': dict(self._stats)}
+
+    def _mtime(self):
+        return os.path.getmtime(self.manifest_path) if os.path.exists(self.manifest_path) else None
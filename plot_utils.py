@@ -5,6 +5,7 @@ Author: Zeeshan Hameed
 import plotly.graph_objects as go
 import pandas as pd
 import os
+from prediction_log import get_prediction_log
 
 TEMPLATE = 'plotly_dark' ### DEFINING A GLOBAL THEME FOR THE CHARTS
 
@@ -30,7 +31,7 @@ def add_candlestick_trace(fig, data):
 
 
 
-def plot_with_sma(data, start_date, end_date, sma7, sma14):
+def plot_with_sma(data, start_date, end_date, sma7, sma14, asset='Bitcoin'):
     """
     Plots a candlestick chart with SMA7 and SMA14 lines.
 
@@ -40,6 +41,7 @@ def plot_with_sma(data, start_date, end_date, sma7, sma14):
         end_date (str): The end date of the date range.
         sma7 (str): The column name for SMA7.
         sma14 (str): The column name for SMA14.
+        asset (str, optional): The name of the asset in the title. Defaults to 'Bitcoin'.
 
     Returns:
         go.Figure: The plotly figure object containing the candlestick chart and SMA lines.
@@ -64,7 +66,7 @@ def plot_with_sma(data, start_date, end_date, sma7, sma14):
     ))
 
     fig.update_layout(
-        title=f"Bitcoin Candlestick with {sma7} and {sma14}",
+        title=f"{asset} Candlestick with {sma7} and {sma14}",
         yaxis_title='Price (USD)',
         xaxis_title='Date',
         template=TEMPLATE
@@ -73,7 +75,7 @@ def plot_with_sma(data, start_date, end_date, sma7, sma14):
     return fig
 
 
-def plot_with_ema(data, start_date, end_date, ema7, ema14):
+def plot_with_ema(data, start_date, end_date, ema7, ema14, asset='Bitcoin'):
     """
     Plots a candlestick chart with EMA7 and EMA14 lines.
 
@@ -83,6 +85,7 @@ def plot_with_ema(data, start_date, end_date, ema7, ema14):
         end_date (str): The end date of the date range.
         ema7 (str): The column name for EMA7.
         ema14 (str): The column name for EMA14.
+        asset (str, optional): The name of the asset in the title. Defaults to 'Bitcoin'.
 
     Returns:
         go.Figure: The plotly figure object containing the candlestick chart and EMA lines.
@@ -107,7 +110,7 @@ def plot_with_ema(data, start_date, end_date, ema7, ema14):
     ))
 
     fig.update_layout(
-        title=f"Bitcoin Candlestick with {ema7} and {ema14}",
+        title=f"{asset} Candlestick with {ema7} and {ema14}",
         yaxis_title='Price (USD)',
         xaxis_title='Date',
         template=TEMPLATE
@@ -117,7 +120,7 @@ def plot_with_ema(data, start_date, end_date, ema7, ema14):
 
 
 
-def plot_with_rsi(data, start_date, end_date, column):
+def plot_with_rsi(data, start_date, end_date, column, asset='Bitcoin'):
     """
     Plots a candlestick chart with a specified column and RSI (Relative Strength Index) overlay.
 
@@ -126,6 +129,7 @@ def plot_with_rsi(data, start_date, end_date, column):
         start_date (str): The start date of the data to be plotted.
         end_date (str): The end date of the data to be plotted.
         column (str): The column name to be plotted on the secondary y-axis.
+        asset (str, optional): The name of the asset in the title. Defaults to 'Bitcoin'.
 
     Returns:
         go.Figure: The plotted figure.
@@ -145,7 +149,7 @@ def plot_with_rsi(data, start_date, end_date, column):
     ))
 
     fig.update_layout(
-        title=f'Bitcoin Candlestick with {column}',
+        title=f'{asset} Candlestick with {column}',
         yaxis_title="Price (USD)",
         xaxis_title="Date",
         template=TEMPLATE,
@@ -160,7 +164,7 @@ def plot_with_rsi(data, start_date, end_date, column):
     return fig
 
 
-def plot_with_macd(data, start_date, end_date, macd_column, signal_column):
+def plot_with_macd(data, start_date, end_date, macd_column, signal_column, asset='Bitcoin'):
     """
     Plots a candlestick chart of Bitcoin prices with MACD and signal lines.
 
@@ -170,6 +174,7 @@ def plot_with_macd(data, start_date, end_date, macd_column, signal_column):
         end_date (str): The end date for the plot.
         macd_column (str): The column name for the MACD line in the data.
         signal_column (str): The column name for the signal line in the data.
+        asset (str, optional): The name of the asset in the title. Defaults to 'Bitcoin'.
 
     Returns:
         go.Figure: The plotly figure object containing the candlestick chart with MACD and signal lines.
@@ -194,7 +199,7 @@ def plot_with_macd(data, start_date, end_date, macd_column, signal_column):
     ))
 
     fig.update_layout(
-        title=f'Bitcoin Candlestick with {macd_column} and {signal_column}',
+        title=f'{asset} Candlestick with {macd_column} and {signal_column}',
         yaxis_title='Price (USD)',
         xaxis_title='Date',
         template=TEMPLATE
@@ -203,7 +208,7 @@ def plot_with_macd(data, start_date, end_date, macd_column, signal_column):
     return fig
 
 
-def plot_with_bollinger_bands(data, start_date, end_date, sma_column, upper_band, lower_band):
+def plot_with_bollinger_bands(data, start_date, end_date, sma_column, upper_band, lower_band, asset='Bitcoin'):
     """
     Plots a candlestick chart with Bollinger Bands.
 
@@ -214,6 +219,7 @@ def plot_with_bollinger_bands(data, start_date, end_date, sma_column, upper_band
         sma_column (str): The column name for the Simple Moving Average (SMA) line.
         upper_band (str): The column name for the Upper Bollinger Band line.
         lower_band (str): The column name for the Lower Bollinger Band line.
+        asset (str, optional): The name of the asset in the title. Defaults to 'Bitcoin'.
 
     Returns:
         plotly.graph_objects.Figure: The plotted figure.
@@ -245,7 +251,7 @@ def plot_with_bollinger_bands(data, start_date, end_date, sma_column, upper_band
     ))
 
     fig.update_layout(
-        title=f'Bitcoin Candlestick with Bollinger Bands ({sma_column}, {upper_band}, {lower_band})',
+        title=f'{asset} Candlestick with Bollinger Bands ({sma_column}, {upper_band}, {lower_band})',
         yaxis_title='Price (USD)',
         xaxis_title='Date',
         template=TEMPLATE
@@ -254,7 +260,7 @@ def plot_with_bollinger_bands(data, start_date, end_date, sma_column, upper_band
     return fig
 
 
-def plot_with_atr(data, start_date, end_date, column):
+def plot_with_atr(data, start_date, end_date, column, asset='Bitcoin'):
     """
     Plots a Bitcoin candlestick chart with a specified column.
 
@@ -263,6 +269,7 @@ def plot_with_atr(data, start_date, end_date, column):
         start_date (str): The start date for the plot.
         end_date (str): The end date for the plot.
         column (str): The column to be plotted.
+        asset (str, optional): The name of the asset in the title. Defaults to 'Bitcoin'.
 
     Returns:
         plotly.graph_objects.Figure: The plotted figure.
@@ -281,7 +288,7 @@ def plot_with_atr(data, start_date, end_date, column):
     ))
 
     fig.update_layout(
-        title=f'Bitcoin Candlestick with {column}',
+        title=f'{asset} Candlestick with {column}',
         yaxis_title='Price (USD)',
         xaxis_title='Date',
         template=TEMPLATE,
@@ -295,7 +302,7 @@ def plot_with_atr(data, start_date, end_date, column):
     return fig
 
 
-def plot_with_stochastic(data, start_date, end_date, k_column, d_column):
+def plot_with_stochastic(data, start_date, end_date, k_column, d_column, asset='Bitcoin'):
     """
     Plots a candlestick chart with the Stochastic Oscillator (%K and %D) overlay.
 
@@ -305,6 +312,7 @@ def plot_with_stochastic(data, start_date, end_date, k_column, d_column):
         end_date (str): The end date for the data to be plotted.
         k_column (str): The column name for the %K line data.
         d_column (str): The column name for the %D line data.
+        asset (str, optional): The name of the asset in the title. Defaults to 'Bitcoin'.
 
     Returns:
         plotly.graph_objects.Figure: The figure object representing the candlestick chart with the Stochastic Oscillator overlay.
@@ -331,7 +339,7 @@ def plot_with_stochastic(data, start_date, end_date, k_column, d_column):
     ))
 
     fig.update_layout(
-        title=f'Bitcoin Candlestick with Stochastic Oscillator (%K and %D)',
+        title=f'{asset} Candlestick with Stochastic Oscillator (%K and %D)',
         yaxis_title='Price (USD)',
         xaxis_title='Date',
         template=TEMPLATE,
@@ -352,7 +360,7 @@ def plot_with_stochastic(data, start_date, end_date, k_column, d_column):
     return fig
 
 
-def plot_with_obv(data, start_date, end_date, column):
+def plot_with_obv(data, start_date, end_date, column, asset='Bitcoin'):
     """
     Plots a candlestick chart with On-Balance Volume (OBV) line.
 
@@ -361,6 +369,7 @@ def plot_with_obv(data, start_date, end_date, column):
         start_date (str): The start date for the data to be plotted.
         end_date (str): The end date for the data to be plotted.
         column (str): The column name for the OBV data.
+        asset (str, optional): The name of the asset in the title. Defaults to 'Bitcoin'.
 
     Returns:
         go.Figure: The figure object containing the candlestick chart with OBV line.
@@ -379,7 +388,7 @@ def plot_with_obv(data, start_date, end_date, column):
     ))
 
     fig.update_layout(
-        title=f'Bitcoin Candlestick with {column}',
+        title=f'{asset} Candlestick with {column}',
         yaxis_title='Price (USD)',
         xaxis_title='Date',
         template=TEMPLATE,
@@ -393,15 +402,16 @@ def plot_with_obv(data, start_date, end_date, column):
     return fig
 
 
-def plot_all_indicators(data, start_date, end_date, prediction_file='data/predictions.csv'):
+def plot_all_indicators(data, start_date, end_date, prediction_log=None):
     """
-    Plots a candlestick chart with all indicators toggled off initially and includes prediction markers.
+    Plots a candlestick chart with all indicators toggled off initially and includes prediction markers,
+    and the next-24h high and low predicted at every hour if the intraday predictions are enabled.
 
     Args:
         data (pandas.DataFrame): The data containing the candlestick and indicators data.
         start_date (str): The start date for the data to be plotted.
         end_date (str): The end date for the data to be plotted.
-        prediction_file (str): Path to the CSV file containing predictions.
+        prediction_log (PredictionLog, optional): The log the predictions are read from. Defaults to the default log.
 
     Returns:
         plotly.graph_objects.Figure: The figure object representing the candlestick chart with all indicators.
@@ -439,30 +449,39 @@ def plot_all_indicators(data, start_date, end_date, prediction_file='data/predic
                 visible='legendonly'
             ))
 
-    # Check if predictions.csv exists and is not empty
-    if os.path.exists(prediction_file) and os.path.getsize(prediction_file) > 0:
-        predictions = pd.read_csv(prediction_file)
-        if not predictions.empty:
-            predictions['date'] = pd.to_datetime(predictions['date'])
-            predictions = predictions.set_index('date')
-            predictions = predictions.loc[start_date:end_date]
-
-            if not predictions.empty:
-                fig.add_trace(go.Scatter(
-                    x=predictions.index,
-                    y=predictions['predicted_high'],
-                    mode='markers',
-                    marker=dict(color='green', symbol='triangle-up', size=10),
-                    name='Predicted High'
-                ))
-
-                fig.add_trace(go.Scatter(
-                    x=predictions.index,
-                    y=predictions['predicted_low'],
-                    mode='markers',
-                    marker=dict(color='red', symbol='triangle-down', size=10),
-                    name='Predicted Low'
-                ))
+    # Read only the predictions of the plotted range
+    prediction_log = prediction_log or get_prediction_log()
+    predictions = prediction_log.read(start_date, end_date)
+    if not predictions.empty:
+        fig.add_trace(go.Scatter(
+            x=predictions.index,
+            y=predictions['predicted_high'],
+            mode='markers',
+            marker=dict(color='green', symbol='triangle-up', size=10),
+            name='Predicted High'
+        ))
+
+        fig.add_trace(go.Scatter(
+            x=predictions.index,
+            y=predictions['predicted_low'],
+            mode='markers',
+            marker=dict(color='red', symbol='triangle-down', size=10),
+            name='Predicted Low'
+        ))
+
+    # Overlay the hourly next-24h predictions at the hour they were made
+    intraday = prediction_log.read_intraday(start_date, end_date)
+    if not intraday.empty:
+        if data.index.tz is not None:
+            intraday.index = intraday.index.tz_localize('UTC').tz_convert(data.index.tz)
+        for column, name, color in [('predicted_high', 'Next 24h High (hourly)', 'green'), ('predicted_low', 'Next 24h Low (hourly)', 'red')]:
+            fig.add_trace(go.Scatter(
+                x=intraday.index,
+                y=intraday[column],
+                mode='lines',
+                line=dict(color=color, dash='dot', shape='hv'),
+                name=name
+            ))
 
     fig.update_layout(
         title='Bitcoin Candlestick Chart with Indicators',
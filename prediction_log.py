@@ -0,0 +1,226 @@
+"""
+Author: Zeeshan Hameed
+
+Append-only log of the daily predictions, stored in SQLite in WAL mode.
+
+Every prediction is a new row, so writers never rewrite existing data: concurrent writers (app replicas,
+worker processes) are serialized by SQLite and readers always see complete rows. A day predicted several
+times is read back with its latest prediction, and reads go through the date index instead of parsing a file.
+
+The app shares one log per database (`get_prediction_log`), so the schema is only set up once per process.
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+import pandas as pd
+from config import PREDICTION_LOG, LEGACY_PREDICTIONS_CSV
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT NOT NULL,
+    predicted_high REAL NOT NULL,
+    predicted_low REAL NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS predictions_date ON predictions (date, id);
+CREATE TABLE IF NOT EXISTS intraday_predictions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts TEXT NOT NULL,
+    predicted_high REAL NOT NULL,
+    predicted_low REAL NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS intraday_predictions_ts ON intraday_predictions (ts, id);
+"""
+
+_logs = {}
+_lock = threading.Lock()
+
+
+class PredictionLog:
+    """
+    An append-only, concurrent-safe log of the predictions.
+
+    Attributes:
+        path (str): The path of the SQLite database.
+
+    Methods:
+        append: Appends the prediction of a day.
+        read: Returns the latest prediction of every day of a date range.
+        append_intraday: Appends the next-24h predictions made at a batch of hours.
+        read_intraday: Returns the latest intraday prediction of every hour of a range.
+        last_prediction_id: Returns the id of the last daily prediction.
+        last_intraday: Returns the last hour with an intraday prediction.
+        import_csv: Appends the rows of a legacy predictions CSV file.
+    """
+
+    def __init__(self, path=PREDICTION_LOG, legacy_csv=None):
+        """
+        Opens (and creates if needed) the log. An empty log is seeded with the rows of the legacy CSV file, if any.
+
+        Args:
+            path (str, optional): The path of the SQLite database. Defaults to PREDICTION_LOG.
+            legacy_csv (str, optional): The CSV file the predictions were saved to before. Defaults to None.
+        """
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL') ## Readers never block writers and never see partial writes
+            connection.executescript(SCHEMA)
+        if legacy_csv is not None and os.path.exists(legacy_csv) and os.path.getsize(legacy_csv) > 0 and self._isEmpty():
+            self.import_csv(legacy_csv, if_empty=True)
+
+    @contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30) ## Waits for concurrent writers instead of failing
+        try:
+            with connection: ## Commits, or rolls back on error
+                yield connection
+        finally:
+            connection.close()
+
+    def _isEmpty(self):
+        with self._connect() as connection:
+            return connection.execute('SELECT 1 FROM predictions LIMIT 1').fetchone() is None
+
+    def append(self, date, predicted_high, predicted_low):
+        """
+        Appends the prediction of a day. Earlier predictions of the same day are kept but no longer read.
+
+        Args:
+            date (str): The day predicted, in the format 'YYYY-MM-DD'.
+            predicted_high (float): Predicted high price.
+            predicted_low (float): Predicted low price.
+        """
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT INTO predictions (date, predicted_high, predicted_low, created_at) VALUES (?, ?, ?, ?)',
+                (date, float(predicted_high), float(predicted_low), datetime.now().isoformat(timespec='seconds'))
+            )
+
+    def read(self, start_date=None, end_date=None):
+        """
+        Returns the latest prediction of every day of a date range.
+
+        Args:
+            start_date (str, optional): The first day, in the format 'YYYY-MM-DD'. Defaults to the first prediction.
+            end_date (str, optional): The last day, in the format 'YYYY-MM-DD'. Defaults to the last prediction.
+
+        Returns:
+            pandas.DataFrame: 'predicted_high' and 'predicted_low' indexed by date.
+        """
+        query = """
+            SELECT date, predicted_high, predicted_low FROM predictions AS p
+            WHERE date BETWEEN ? AND ? AND id = (SELECT MAX(id) FROM predictions WHERE date = p.date)
+            ORDER BY date
+        """
+        with self._connect() as connection:
+            predictions = pd.read_sql_query(query, connection, params=(start_date or '0000-00-00', end_date or '9999-99-99'))
+        predictions['date'] = pd.to_datetime(predictions['date'])
+        return predictions.set_index('date')
+
+    def append_intraday(self, predictions):
+        """
+        Appends the next-24h predictions made at a batch of hours, in one transaction.
+
+        Args:
+            predictions (pandas.DataFrame): 'predicted_high' and 'predicted_low' indexed by the hour (naive UTC)
+                the prediction was made at.
+        """
+        created_at = datetime.now().isoformat(timespec='seconds')
+        with self._connect() as connection:
+            connection.executemany(
+                'INSERT INTO intraday_predictions (ts, predicted_high, predicted_low, created_at) VALUES (?, ?, ?, ?)',
+                [(ts.strftime('%Y-%m-%d %H:%M:%S'), float(high), float(low), created_at)
+                 for ts, high, low in zip(predictions.index, predictions['predicted_high'], predictions['predicted_low'])]
+            )
+
+    def read_intraday(self, start=None, end=None):
+        """
+        Returns the latest intraday prediction of every hour of a range.
+
+        Args:
+            start (str, optional): The first hour or day. Defaults to the first prediction.
+            end (str, optional): The last hour or day; a bare day includes all its hours. Defaults to the last prediction.
+
+        Returns:
+            pandas.DataFrame: 'predicted_high' and 'predicted_low' indexed by hour (naive UTC).
+        """
+        query = """
+            SELECT ts, predicted_high, predicted_low FROM intraday_predictions AS p
+            WHERE ts >= ? AND ts <= ? AND id = (SELECT MAX(id) FROM intraday_predictions WHERE ts = p.ts)
+            ORDER BY ts
+        """
+        if end is not None and len(end) == 10:
+            end += ' 23:59:59'
+        with self._connect() as connection:
+            predictions = pd.read_sql_query(query, connection, params=(start or '0000-00-00', end or '9999-99-99'))
+        predictions['ts'] = pd.to_datetime(predictions['ts'])
+        return predictions.set_index('ts')
+
+    def last_prediction_id(self):
+        """
+        Returns the id of the last daily prediction appended, which changes with every new or revised prediction.
+
+        Returns:
+            int or None: The id, or None if there is no prediction yet.
+        """
+        with self._connect() as connection:
+            return connection.execute('SELECT MAX(id) FROM predictions').fetchone()[0]
+
+    def last_intraday(self):
+        """
+        Returns the last hour with an intraday prediction.
+
+        Returns:
+            pandas.Timestamp or None: The hour (naive UTC), or None if there is no intraday prediction yet.
+        """
+        with self._connect() as connection:
+            last = connection.execute('SELECT MAX(ts) FROM intraday_predictions').fetchone()[0]
+        return pd.Timestamp(last) if last is not None else None
+
+    def import_csv(self, csv_path, if_empty=False):
+        """
+        Appends the rows of a predictions CSV file (columns 'date', 'predicted_high' and 'predicted_low').
+
+        Args:
+            csv_path (str): The path of the CSV file.
+            if_empty (bool, optional): Whether to import only into an empty log, so processes opening a new log
+                at the same time import the file once. Defaults to False.
+
+        Returns:
+            int: The number of rows imported.
+        """
+        created_at = datetime.now().isoformat(timespec='seconds')
+        with self._connect() as connection:
+            connection.execute('BEGIN IMMEDIATE') ## Holds the write lock from the check to the insert
+            if if_empty and connection.execute('SELECT 1 FROM predictions LIMIT 1').fetchone() is not None:
+                return 0 ## Checked before parsing the file, which a seeded log never reads again
+            predictions = pd.read_csv(csv_path, dtype={'date': str})
+            connection.executemany(
+                'INSERT INTO predictions (date, predicted_high, predicted_low, created_at) VALUES (?, ?, ?, ?)',
+                [(row.date[:10], float(row.predicted_high), float(row.predicted_low), created_at) for row in predictions.itertuples()]
+            )
+        print(f"Imported {len(predictions)} predictions from {csv_path} into {self.path}")
+        return len(predictions)
+
+
+def get_prediction_log(path=PREDICTION_LOG):
+    """
+    Returns the log of a database shared by the whole process, opened on first use. Only the default log of the
+    app (PREDICTION_LOG) is seeded with LEGACY_PREDICTIONS_CSV.
+
+    Args:
+        path (str, optional): The path of the SQLite database. Defaults to PREDICTION_LOG.
+
+    Returns:
+        PredictionLog: The shared log.
+    """
+    with _lock:
+        if path not in _logs:
+            _logs[path] = PredictionLog(path, LEGACY_PREDICTIONS_CSV if path == PREDICTION_LOG else None)
+        return _logs[path]
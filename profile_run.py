@@ -0,0 +1,327 @@
+"""
+Author: Zeeshan Hameed
+
+Runs a full prediction cycle, or a single pipeline stage, under a profiler on recorded inputs.
+
+Usage:
+    python profile_run.py record --fixtures fixtures/day
+    python profile_run.py run --fixtures fixtures/day --stage all --profiler pyinstrument
+    python profile_run.py compare profiles/before/all_hotspots.json profiles/after/all_hotspots.json
+"""
+
+import argparse
+import cProfile
+import json
+import os
+import pstats
+from datetime import datetime, timedelta
+
+STAGES = ['all', 'scrape', 'clean', 'sentiment', 'aggregate', 'yahoo', 'indicators', 'predict']
+
+MANIFEST_FILE = 'manifest.json'
+BARS_START = '2016-12-01'
+
+
+def record_fixtures(fixtures_dir, date=None):
+    """
+    Records every external response of a prediction cycle (GDELT, article pages and daily bars) into a fixture directory.
+
+    Args:
+        fixtures_dir (str): The directory to write the fixtures to.
+        date (str, optional): The day to record articles for, in the format 'YYYY-MM-DD'. Defaults to yesterday.
+    """
+    from data_scrapper import fetch_24hrs
+    from btc_utils import get_data_from_yahoo
+    from replay import RecordingFetcher, use_fetcher
+    from config import MERGE_QUERIES
+
+    day = datetime.strptime(date, '%Y-%m-%d') if date else datetime.now() - timedelta(days=1)
+    day = datetime(day.year, day.month, day.day)
+    bars_end = day + timedelta(days=1)
+
+    with use_fetcher(RecordingFetcher(fixtures_dir)):
+        articles = fetch_24hrs(start=day)
+        fetch_24hrs(start=day, merged=not MERGE_QUERIES) ## Record both query plans, to compare them offline
+        bars = get_data_from_yahoo(start=BARS_START, end=bars_end)
+
+    with open(os.path.join(fixtures_dir, MANIFEST_FILE), 'w') as f:
+        json.dump({'date': day.strftime('%Y-%m-%d'), 'bars_start': BARS_START, 'bars_end': bars_end.strftime('%Y-%m-%d')}, f, indent=2)
+
+    print(f"Recorded {len(articles)} articles and {len(bars)} daily bars into {fixtures_dir}")
+
+
+def load_manifest(fixtures_dir):
+    """
+    Reads the manifest written by `record_fixtures`.
+
+    Args:
+        fixtures_dir (str): The fixture directory.
+
+    Returns:
+        dict: The recorded day and bar range.
+    """
+    with open(os.path.join(fixtures_dir, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+def replay_articles(fixtures_dir):
+    """
+    Runs the scraper against the recorded responses.
+
+    Args:
+        fixtures_dir (str): The fixture directory.
+
+    Returns:
+        pandas.DataFrame: The articles as returned by `fetch_24hrs`.
+    """
+    from data_scrapper import fetch_24hrs
+    from replay import ReplayFetcher, use_fetcher
+
+    manifest = load_manifest(fixtures_dir)
+    with use_fetcher(ReplayFetcher(fixtures_dir)):
+        return fetch_24hrs(start=datetime.strptime(manifest['date'], '%Y-%m-%d'))
+
+
+def replay_bars(fixtures_dir):
+    """
+    Downloads the recorded daily bars.
+
+    Args:
+        fixtures_dir (str): The fixture directory.
+
+    Returns:
+        pandas.DataFrame: The raw daily bars as returned by `get_data_from_yahoo`.
+    """
+    from btc_utils import get_data_from_yahoo
+    from replay import ReplayFetcher, use_fetcher
+
+    manifest = load_manifest(fixtures_dir)
+    with use_fetcher(ReplayFetcher(fixtures_dir)):
+        return get_data_from_yahoo(start=manifest['bars_start'], end=manifest['bars_end'])
+
+
+def build_stage(stage, fixtures_dir):
+    """
+    Prepares everything a stage needs outside the profiled region and returns the callable to profile.
+
+    Args:
+        stage (str): One of STAGES.
+        fixtures_dir (str): The fixture directory.
+
+    Returns:
+        callable: A zero-argument function running only the requested stage.
+    """
+    from config import LLM, IMPACT_WEIGHTS
+    from text_utils import clean_text, aggregate_sentiment
+    from btc_data_pipeline import BitcoinDataPipeline
+
+    bitcoinDataPipeline = BitcoinDataPipeline()
+
+    if stage == 'scrape':
+        return lambda: replay_articles(fixtures_dir)
+
+    if stage == 'yahoo':
+        return lambda: replay_bars(fixtures_dir)
+
+    articles, bars = replay_articles(fixtures_dir), replay_bars(fixtures_dir)
+
+    if stage == 'clean':
+        return lambda: articles['content'].apply(clean_text)
+
+    if stage == 'indicators':
+        return lambda: bitcoinDataPipeline.processDailyData(bars.copy())
+
+    from text_data_pipeline import TextDataPipeline
+    textDataPipeline = TextDataPipeline(LLM)
+
+    if stage == 'sentiment':
+        cleaned = articles['content'].apply(clean_text)
+        return lambda: textDataPipeline.scoreTexts(cleaned.tolist())
+
+    if stage == 'aggregate':
+        scored = articles.copy()
+        scored['content'] = scored['content'].apply(clean_text)
+        scored['sentiment'] = textDataPipeline.scoreTexts(scored['content'].tolist())
+        return lambda: aggregate_sentiment(scored.copy(), IMPACT_WEIGHTS)
+
+    from app_utils import load_models, buildFeatures, predict_price
+    x_scaler, y_high_scaler, y_low_scaler, high_model, low_model = load_models()
+
+    date = load_manifest(fixtures_dir)['date'] ## The recorded day, so that a replay on any later day selects the same rows
+
+    def predict(sentiment_score, bitcoin_data):
+        data = buildFeatures(sentiment_score, bitcoin_data, x_scaler, date)
+        high_pred = predict_price(high_model, data, y_high_scaler, flag=True)
+        low_pred = predict_price(low_model, data, y_low_scaler, flag=False)
+        return high_pred, low_pred
+
+    if stage == 'predict':
+        sentiment_score = textDataPipeline.scoreArticles(articles.copy())
+        bitcoin_data = bitcoinDataPipeline.processDailyData(bars.copy())
+        return lambda: predict(sentiment_score, bitcoin_data)
+
+    ### stage == 'all': the same steps as `update_predictions` on replayed responses, minus the CSV write
+    return lambda: predict(
+        textDataPipeline.scoreArticles(replay_articles(fixtures_dir)),
+        bitcoinDataPipeline.processDailyData(replay_bars(fixtures_dir))
+    )
+
+
+def profile_with_cprofile(func, out_prefix, top):
+    """
+    Profiles the function with cProfile, writing a `.prof` dump, a top-N text report and a hotspot JSON.
+
+    Args:
+        func (callable): The function to profile.
+        out_prefix (str): The path prefix of the output files.
+        top (int): The number of hotspots to report.
+
+    Returns:
+        list: The hotspots as dictionaries sorted by self time.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    func()
+    profiler.disable()
+    profiler.dump_stats(f'{out_prefix}.prof') ### Open with snakeviz or flameprof for a flame graph
+
+    with open(f'{out_prefix}_top.txt', 'w') as f:
+        stats = pstats.Stats(profiler, stream=f)
+        stats.sort_stats('cumulative').print_stats(top)
+        stats.sort_stats('tottime').print_stats(top)
+
+    hotspots = []
+    for (filename, line, name), (_, ncalls, tottime, cumtime, _) in pstats.Stats(profiler).stats.items():
+        hotspots.append({
+            'function': f'{name} ({os.path.basename(filename)}:{line})',
+            'calls': ncalls,
+            'self_time': tottime,
+            'total_time': cumtime,
+        })
+    return sorted(hotspots, key=lambda h: h['self_time'], reverse=True)[:top]
+
+
+def profile_with_pyinstrument(func, out_prefix, top):
+    """
+    Profiles the function with the pyinstrument sampling profiler, writing an HTML flame view,
+    a speedscope JSON, a text call tree and a hotspot JSON.
+
+    Args:
+        func (callable): The function to profile.
+        out_prefix (str): The path prefix of the output files.
+        top (int): The number of hotspots to report.
+
+    Returns:
+        list: The hotspots as dictionaries sorted by self time.
+    """
+    from pyinstrument import Profiler
+    from pyinstrument.renderers import SpeedscopeRenderer
+
+    profiler = Profiler(interval=0.001)
+    profiler.start()
+    func()
+    profiler.stop()
+
+    with open(f'{out_prefix}.html', 'w') as f:
+        f.write(profiler.output_html())
+    with open(f'{out_prefix}.speedscope.json', 'w') as f:
+        f.write(profiler.output(renderer=SpeedscopeRenderer()))
+    with open(f'{out_prefix}_top.txt', 'w') as f:
+        f.write(profiler.output_text(unicode=False, color=False))
+
+    self_times = {}
+    frames = [profiler.last_session.root_frame()]
+    while frames:
+        frame = frames.pop()
+        if frame is None:
+            continue
+        key = f'{frame.function} ({os.path.basename(frame.file_path or "")}:{frame.line_no})'
+        self_times[key] = self_times.get(key, 0.0) + frame.total_self_time
+        frames.extend(frame.children)
+
+    hotspots = [{'function': k, 'self_time': v} for k, v in self_times.items()]
+    return sorted(hotspots, key=lambda h: h['self_time'], reverse=True)[:top]
+
+
+def run_profile(stage, fixtures_dir, out_dir, profiler='cprofile', top=30):
+    """
+    Profiles a stage on the recorded fixtures and writes the reports to the output directory.
+
+    Args:
+        stage (str): One of STAGES.
+        fixtures_dir (str): The fixture directory.
+        out_dir (str): The directory to write the reports to.
+        profiler (str, optional): 'cprofile' or 'pyinstrument'. Defaults to 'cprofile'.
+        top (int, optional): The number of hotspots to report. Defaults to 30.
+
+    Returns:
+        list: The hotspots as dictionaries sorted by self time.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    func = build_stage(stage, fixtures_dir)
+    out_prefix = os.path.join(out_dir, stage)
+
+    if profiler == 'pyinstrument':
+        hotspots = profile_with_pyinstrument(func, out_prefix, top)
+    else:
+        hotspots = profile_with_cprofile(func, out_prefix, top)
+
+    with open(f'{out_prefix}_hotspots.json', 'w') as f:
+        json.dump({'stage': stage, 'profiler': profiler, 'fixtures': fixtures_dir, 'hotspots': hotspots}, f, indent=2)
+
+    for hotspot in hotspots:
+        print(f"{hotspot['self_time']:10.4f}s  {hotspot['function']}")
+    print(f"Reports written to {out_dir}")
+    return hotspots
+
+
+def compare_hotspots(before_file, after_file, top=30):
+    """
+    Prints the change in self time per function between two hotspot reports.
+
+    Args:
+        before_file (str): The hotspot JSON of the baseline run.
+        after_file (str): The hotspot JSON of the new run.
+        top (int, optional): The number of functions to print. Defaults to 30.
+    """
+    with open(before_file) as f:
+        before = {h['function']: h['self_time'] for h in json.load(f)['hotspots']}
+    with open(after_file) as f:
+        after = {h['function']: h['self_time'] for h in json.load(f)['hotspots']}
+
+    rows = []
+    for function in set(before) | set(after):
+        old, new = before.get(function, 0.0), after.get(function, 0.0)
+        rows.append((new - old, old, new, function))
+
+    for delta, old, new, function in sorted(rows, key=lambda r: abs(r[0]), reverse=True)[:top]:
+        print(f"{old:10.4f}s -> {new:10.4f}s  ({delta:+.4f}s)  {function}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Profile the BitAnalytica prediction pipeline on recorded inputs.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = subparsers.add_parser('record', help='Record live inputs into a fixture directory')
+    record_parser.add_argument('--fixtures', required=True)
+    record_parser.add_argument('--date', default=None)
+
+    run_parser = subparsers.add_parser('run', help='Profile a stage on recorded inputs')
+    run_parser.add_argument('--fixtures', required=True)
+    run_parser.add_argument('--stage', choices=STAGES, default='all')
+    run_parser.add_argument('--profiler', choices=['cprofile', 'pyinstrument'], default='cprofile')
+    run_parser.add_argument('--out', default='profiles')
+    run_parser.add_argument('--top', type=int, default=30)
+
+    compare_parser = subparsers.add_parser('compare', help='Compare two hotspot reports')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--top', type=int, default=30)
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        record_fixtures(args.fixtures, args.date)
+    elif args.command == 'run':
+        run_profile(args.stage, args.fixtures, args.out, args.profiler, args.top)
+    else:
+        compare_hotspots(args.before, args.after, args.top)
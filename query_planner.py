@@ -0,0 +1,101 @@
+"""
+Author: Zeeshan Hameed
+
+Merges the category queries of `QUERIES` into a few broader GDELT queries and classifies the returned
+articles back into the categories locally.
+
+Every category query has the form `<anchor> AND (<phrase> OR <phrase> ...) <filters>`. Categories sharing the
+same anchor and filters are packed into one query ORing all their phrases, and an article belongs to every
+category one of whose phrases appears in its title or content, as it would have been returned by that
+category's own query.
+"""
+
+import re
+from config import QUERIES, QUERY_MAX_PHRASES
+
+QUERY_PATTERN = re.compile(r'^(?P<anchor>.*?) AND \((?P<clauses>.*)\)(?P<filters>.*)$')
+PHRASE_PATTERN = re.compile(r'"([^"]+)"')
+
+
+def parse_query(query):
+    """
+    Splits a category query into its anchor, its keyword phrases and its filters.
+
+    Args:
+        query (str): A query of the form `<anchor> AND (<phrase> OR ...) <filters>`.
+
+    Returns:
+        tuple: The anchor (str), the phrases (list of str) and the filters (str).
+
+    Raises:
+        ValueError: If the query does not have the expected form.
+    """
+    match = QUERY_PATTERN.match(query)
+    if match is None:
+        raise ValueError(f"Cannot plan query {query!r}: expected '<anchor> AND (<phrase> OR ...) <filters>'")
+    return match.group('anchor'), PHRASE_PATTERN.findall(match.group('clauses')), match.group('filters')
+
+
+def plan_queries(queries=QUERIES, max_phrases=QUERY_MAX_PHRASES):
+    """
+    Packs the category queries into as few queries as possible, without exceeding `max_phrases` phrases per query.
+
+    Categories are never split across queries, and phrases shared by several categories are sent only once.
+
+    Args:
+        queries (dict): The category queries. Defaults to QUERIES.
+        max_phrases (int, optional): The maximum number of phrases ORed in one query. Defaults to QUERY_MAX_PHRASES.
+
+    Returns:
+        list: One dict per query to send, with the 'query' and the 'categories' it covers.
+    """
+    plan = []
+    open_groups = {} ### (anchor, filters) -> the group currently being filled
+    for category, query in queries.items():
+        anchor, phrases, filters = parse_query(query)
+        group = open_groups.get((anchor, filters))
+        if group is None or len(group['phrases'].keys() | {p.lower() for p in phrases}) > max_phrases:
+            group = {'anchor': anchor, 'filters': filters, 'phrases': {}, 'categories': []}
+            open_groups[(anchor, filters)] = group
+            plan.append(group)
+        for phrase in phrases:
+            group['phrases'].setdefault(phrase.lower(), phrase)
+        group['categories'].append(category)
+
+    planned = []
+    for group in plan:
+        clauses = ' OR '.join('"' + phrase + '"' for phrase in group['phrases'].values())
+        planned.append({'query': f"{group['anchor']} AND ({clauses}){group['filters']}", 'categories': group['categories']})
+    return planned
+
+
+def build_category_matchers(queries=QUERIES):
+    """
+    Compiles one case-insensitive, whole-word regular expression per category matching any of its phrases.
+
+    Args:
+        queries (dict): The category queries. Defaults to QUERIES.
+
+    Returns:
+        dict: Category mapped to its compiled pattern.
+    """
+    matchers = {}
+    for category, query in queries.items():
+        _, phrases, _ = parse_query(query)
+        alternatives = '|'.join(r'\s+'.join(re.escape(word) for word in phrase.split()) for phrase in phrases)
+        matchers[category] = re.compile(rf'\b(?:{alternatives})\b', re.IGNORECASE)
+    return matchers
+
+
+def classify_article(text, matchers):
+    """
+    Returns the categories whose keyword clause matches the text.
+
+    Args:
+        text (str): The title and content of the article.
+        matchers (dict): The patterns returned by `build_category_matchers`.
+
+    Returns:
+        list: The matching categories, in the order of `matchers`.
+    """
+    return [category for category, pattern in matchers.items() if pattern.search(text)]
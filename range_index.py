@@ -0,0 +1,202 @@
+"""
+Author: Zeeshan Hameed
+
+Precomputed index answering range analytics between any two dates of a bar series without rescanning it.
+
+Return, volatility and average sentiment come from prefix sums (O(1) per query), max drawdown and the
+high/low closes from a segment tree (O(log n) per query). Appending bars updates both in O(log n), and
+re-appending the last bars (e.g. an incomplete hourly bar downloaded again) replaces them.
+"""
+
+import math
+from datetime import date
+from bisect import bisect_left, bisect_right
+import pandas as pd
+
+
+def _combine(left, right):
+    """
+    Merges the (max, min, max drawdown) summaries of two consecutive ranges.
+    A drawdown across both ranges runs from the highest close of the left one to the lowest close of the right one.
+    """
+    if left is None:
+        return right
+    if right is None:
+        return left
+    return (max(left[0], right[0]), min(left[1], right[1]), max(left[2], right[2], 1 - right[1] / left[0]))
+
+
+class RangeIndex:
+    """
+    Range analytics over a series of closes (and optionally daily sentiment) indexed by timestamp.
+
+    Attributes:
+        timestamps (list): The timestamps of the bars, in nanoseconds.
+        closes (list): The close of every bar.
+
+    Methods:
+        from_frame: Builds the index from bars and an optional sentiment series.
+        append: Appends (or replaces the last) bars.
+        query: Returns the return, volatility, max drawdown, high and low close and average sentiment of a range.
+    """
+
+    def __init__(self):
+        self.timestamps = []
+        self.closes = []
+        self._log_returns = [0.0]        ### Prefix sums of the log returns (the first bar has none)
+        self._log_returns_sq = [0.0]
+        self._sentiment = [0.0]          ### Prefix sums of the sentiment and of the number of bars with one
+        self._sentiment_count = [0]
+        self._size = 1
+        self._tree = [None] * 2
+
+    @classmethod
+    def from_frame(cls, data, close_column='Close', sentiment=None):
+        """
+        Builds the index from bars.
+
+        Args:
+            data (pandas.DataFrame): Bars indexed by timestamp.
+            close_column (str, optional): The column of the closes. Defaults to 'Close'.
+            sentiment (pandas.Series, optional): Daily sentiment indexed by date, applied to every bar of its day.
+
+        Returns:
+            RangeIndex: The index.
+        """
+        index = cls()
+        index.append(data, close_column, sentiment)
+        return index
+
+    def __len__(self):
+        return len(self.closes)
+
+    def append(self, data, close_column='Close', sentiment=None):
+        """
+        Appends bars to the index. Bars at or before the last indexed timestamp replace the indexed bars from there on.
+
+        Args:
+            data (pandas.DataFrame): Bars indexed by timestamp, in increasing order.
+            close_column (str, optional): The column of the closes. Defaults to 'Close'.
+            sentiment (pandas.Series, optional): Daily sentiment indexed by date, applied to every bar of its day.
+        """
+        if data.empty:
+            return
+        stamps = _to_naive(data.index).as_unit('ns').asi8.tolist()
+        closes = data[close_column].astype(float).tolist()
+        if sentiment is not None:
+            daily = sentiment.set_axis(_to_naive(sentiment.index).as_unit('ns').normalize())
+            scores = daily.reindex(_to_naive(data.index).as_unit('ns').normalize()).astype(float).tolist()
+        else:
+            scores = [math.nan] * len(closes)
+
+        self._truncate(bisect_left(self.timestamps, stamps[0]))
+        rebuild = len(self.closes) + len(closes) > self._size
+        for stamp, close, score in zip(stamps, closes, scores):
+            if self.closes:
+                log_return = math.log(close / self.closes[-1])
+                self._log_returns.append(self._log_returns[-1] + log_return)
+                self._log_returns_sq.append(self._log_returns_sq[-1] + log_return * log_return)
+            has_score = not math.isnan(score)
+            self._sentiment.append(self._sentiment[-1] + (score if has_score else 0.0))
+            self._sentiment_count.append(self._sentiment_count[-1] + has_score)
+            self.timestamps.append(stamp)
+            self.closes.append(close)
+            if not rebuild:
+                self._set_leaf(len(self.closes) - 1)
+        if rebuild:
+            self._build()
+
+    def _truncate(self, position):
+        """
+        Drops the bars from `position` on.
+        """
+        if position >= len(self.closes):
+            return
+        del self.timestamps[position:], self.closes[position:]
+        del self._log_returns[max(position, 1):], self._log_returns_sq[max(position, 1):]
+        del self._sentiment[position + 1:], self._sentiment_count[position + 1:]
+        for leaf in range(position, self._size):
+            if self._tree[self._size + leaf] is None:
+                break
+            self._tree[self._size + leaf] = None
+            self._update_parents(self._size + leaf)
+
+    def _build(self):
+        while self._size < len(self.closes):
+            self._size *= 2
+        self._tree = [None] * (2 * self._size)
+        for i, close in enumerate(self.closes):
+            self._tree[self._size + i] = (close, close, 0.0)
+        for node in range(self._size - 1, 0, -1):
+            self._tree[node] = _combine(self._tree[2 * node], self._tree[2 * node + 1])
+
+    def _set_leaf(self, position):
+        close = self.closes[position]
+        self._tree[self._size + position] = (close, close, 0.0)
+        self._update_parents(self._size + position)
+
+    def _update_parents(self, node):
+        node //= 2
+        while node:
+            self._tree[node] = _combine(self._tree[2 * node], self._tree[2 * node + 1])
+            node //= 2
+
+    def _summary(self, first, last):
+        left, right = None, None
+        first += self._size
+        last += self._size + 1
+        while first < last:
+            if first & 1:
+                left = _combine(left, self._tree[first])
+                first += 1
+            if last & 1:
+                last -= 1
+                right = _combine(self._tree[last], right)
+            first //= 2
+            last //= 2
+        return _combine(left, right)
+
+    def query(self, start, end):
+        """
+        Returns the analytics of the bars between two dates (inclusive).
+
+        Args:
+            start (str or datetime): The start of the range.
+            end (str or datetime): The end of the range; a bare date includes the whole day.
+
+        Returns:
+            dict: 'start' and 'end' (the first and last bars of the range), 'bars', 'return' (first to last close),
+                'volatility' (standard deviation of the log returns per bar), 'max_drawdown', 'high' and 'low'
+                (highest and lowest close) and 'avg_sentiment'. None if the range has no bar.
+        """
+        end_stamp = pd.Timestamp(end)
+        if (isinstance(end, str) and len(end) == 10) or type(end) is date:
+            end_stamp += pd.Timedelta(days=1) - pd.Timedelta(1)
+        first = bisect_left(self.timestamps, pd.Timestamp(start).value)
+        last = bisect_right(self.timestamps, end_stamp.value) - 1
+        if first > last:
+            return None
+
+        returns = last - first ### Log returns of the bars after the first one
+        total = self._log_returns[last] - self._log_returns[first]
+        total_sq = self._log_returns_sq[last] - self._log_returns_sq[first]
+        variance = (total_sq - total * total / returns) / (returns - 1) if returns > 1 else math.nan
+        scored = self._sentiment_count[last + 1] - self._sentiment_count[first]
+        high, low, drawdown = self._summary(first, last)
+
+        return {
+            'start': pd.Timestamp(self.timestamps[first]),
+            'end': pd.Timestamp(self.timestamps[last]),
+            'bars': last - first + 1,
+            'return': self.closes[last] / self.closes[first] - 1,
+            'volatility': math.sqrt(max(variance, 0.0)) if returns > 1 else math.nan,
+            'max_drawdown': drawdown,
+            'high': high,
+            'low': low,
+            'avg_sentiment': (self._sentiment[last + 1] - self._sentiment[first]) / scored if scored else math.nan,
+        }
+
+
+def _to_naive(index):
+    index = pd.DatetimeIndex(index)
+    return index.tz_convert('UTC').tz_localize(None) if index.tz is not None else index
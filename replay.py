@@ -0,0 +1,250 @@
+"""
+Author: Zeeshan Hameed
+
+Record-and-replay layer for every external service used by the pipelines (GDELT, article pages and Yahoo Finance).
+
+All network access goes through the active fetcher (`get_fetcher()`). The default fetcher talks to the live
+services; `RecordingFetcher` does the same while saving every response into a fixture directory, and
+`ReplayFetcher` serves those responses back without touching the network.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from contextlib import contextmanager
+import pandas as pd
+
+
+def _key(*parts):
+    return hashlib.sha1('|'.join(str(p) for p in parts).encode()).hexdigest()
+
+
+class FixtureResponse:
+    """
+    A minimal stand-in for `requests.Response` built from a recorded response.
+
+    Attributes:
+        status_code (int): The HTTP status code.
+        text (str): The response body.
+    """
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self):
+        """
+        Decodes the body as JSON, raising `requests.JSONDecodeError` like a real response.
+        """
+        import requests
+        try:
+            return json.loads(self.text)
+        except json.JSONDecodeError as e:
+            raise requests.JSONDecodeError(e.msg, e.doc, e.pos)
+
+
+class LiveFetcher:
+    """
+    Fetches from the live services.
+
+    Attributes:
+        polite_delay (float): Seconds to wait between requests to the same service.
+    """
+
+    polite_delay = 1
+
+    def get(self, url):
+        """
+        Performs an HTTP GET request.
+
+        Args:
+            url (str): The URL to fetch.
+
+        Returns:
+            requests.Response: The response object.
+        """
+        import requests
+        return requests.get(url)
+
+    def get_article_html(self, url):
+        """
+        Downloads the HTML of a news article.
+
+        Args:
+            url (str): The article URL.
+
+        Returns:
+            str: The raw HTML of the article.
+
+        Raises:
+            newspaper.ArticleException: If the article could not be downloaded.
+        """
+        from newspaper import Article, ArticleException
+        from newspaper.article import ArticleDownloadState
+
+        article = Article(url)
+        article.download()
+        if article.download_state != ArticleDownloadState.SUCCESS:
+            raise ArticleException(article.download_exception_msg)
+        return article.html
+
+    def download_bars(self, tickers, start, end, interval):
+        """
+        Downloads OHLCV bars from Yahoo Finance.
+
+        Args:
+            tickers (str or list): The ticker symbol(s).
+            start (datetime or str): The start of the range.
+            end (datetime or str): The end of the range.
+            interval (str): The bar interval.
+
+        Returns:
+            pandas.DataFrame: The downloaded bars.
+        """
+        import yfinance as yf
+        return yf.download(tickers, start=start, end=end, interval=interval)
+
+
+class RecordingFetcher(LiveFetcher):
+    """
+    Fetches from the live services and saves every response into a fixture directory.
+
+    Attributes:
+        fixtures_dir (str): The directory the responses are written to.
+    """
+
+    def __init__(self, fixtures_dir):
+        self.fixtures_dir = fixtures_dir
+        self._lock = threading.Lock()
+        for sub in ('http', 'articles', 'bars'):
+            os.makedirs(os.path.join(fixtures_dir, sub), exist_ok=True)
+
+    def get(self, url):
+        response = super().get(url)
+        with open(os.path.join(self.fixtures_dir, 'http', f'{_key(url)}.json'), 'w') as f:
+            json.dump({'url': url, 'status_code': response.status_code, 'text': response.text}, f)
+        return response
+
+    def get_article_html(self, url):
+        path = os.path.join(self.fixtures_dir, 'articles', f'{_key(url)}.json')
+        try:
+            html = super().get_article_html(url)
+        except Exception as e:
+            with open(path, 'w') as f:
+                json.dump({'url': url, 'error': str(e)}, f)
+            raise
+        with open(path, 'w') as f:
+            json.dump({'url': url, 'html': html}, f)
+        return html
+
+    def download_bars(self, tickers, start, end, interval):
+        data = super().download_bars(tickers, start, end, interval)
+        path = os.path.join(self.fixtures_dir, 'bars', f'{_key(tickers, interval)}.pkl')
+        with self._lock:
+            ### Merge with earlier recordings of the same series so one fixture covers every requested range
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    recorded = pickle.load(f)
+                data_to_save = pd.concat([recorded, data])
+                data_to_save = data_to_save[~data_to_save.index.duplicated(keep='last')].sort_index()
+            else:
+                data_to_save = data
+            with open(path, 'wb') as f:
+                pickle.dump(data_to_save, f)
+        return data
+
+
+class ReplayFetcher:
+    """
+    Serves recorded responses from a fixture directory without any network access.
+
+    Unknown URLs answer with a 404 response and unknown articles raise, so a replay never silently goes online.
+
+    Attributes:
+        fixtures_dir (str): The directory the responses are read from.
+        latency (float): Simulated network latency in seconds added to every request (0 by default).
+        polite_delay (float): Always 0, replays do not need to be throttled.
+    """
+
+    polite_delay = 0
+
+    def __init__(self, fixtures_dir, latency=0):
+        self.fixtures_dir = fixtures_dir
+        self.latency = latency
+
+    def _load_json(self, sub, url):
+        if self.latency:
+            time.sleep(self.latency)
+        path = os.path.join(self.fixtures_dir, sub, f'{_key(url)}.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def get(self, url):
+        recorded = self._load_json('http', url)
+        if recorded is None:
+            return FixtureResponse(404, f'No fixture recorded for {url}')
+        return FixtureResponse(recorded['status_code'], recorded['text'])
+
+    def get_article_html(self, url):
+        recorded = self._load_json('articles', url)
+        if recorded is None:
+            raise KeyError(f'No fixture recorded for {url}')
+        if 'error' in recorded:
+            raise RuntimeError(recorded['error'])
+        return recorded['html']
+
+    def download_bars(self, tickers, start, end, interval):
+        path = os.path.join(self.fixtures_dir, 'bars', f'{_key(tickers, interval)}.pkl')
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+
+        ### Slice the recorded series the same way Yahoo would ([start, end))
+        tz = getattr(data.index, 'tz', None)
+        start = pd.Timestamp(start) if start is not None else data.index[0]
+        end = pd.Timestamp(end) if end is not None else data.index[-1] + pd.Timedelta(seconds=1)
+        if tz is not None:
+            start = start.tz_localize(tz) if start.tzinfo is None else start
+            end = end.tz_localize(tz) if end.tzinfo is None else end
+        return data[(data.index >= start) & (data.index < end)].copy()
+
+
+_fetcher = LiveFetcher()
+
+
+def get_fetcher():
+    """
+    Returns the fetcher used for all network access.
+    """
+    return _fetcher
+
+
+def set_fetcher(fetcher):
+    """
+    Replaces the fetcher used for all network access.
+
+    Args:
+        fetcher: A LiveFetcher, RecordingFetcher or ReplayFetcher (or any object with the same methods).
+    """
+    global _fetcher
+    _fetcher = fetcher
+
+
+@contextmanager
+def use_fetcher(fetcher):
+    """
+    Temporarily replaces the fetcher used for all network access.
+
+    Args:
+        fetcher: The fetcher to use inside the `with` block.
+    """
+    previous = get_fetcher()
+    set_fetcher(fetcher)
+    try:
+        yield fetcher
+    finally:
+        set_fetcher(previous)
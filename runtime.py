@@ -0,0 +1,131 @@
+"""
+Author: Zeeshan Hameed
+
+Process-wide CPU threading and inference concurrency settings of TensorFlow, PyTorch and the tokenizers.
+
+Each framework otherwise sizes its own thread pools to every core, so a few Streamlit sessions scoring or
+predicting at the same time run many times more threads than cores. `configure_threads` gives every framework
+the same intra- and inter-op budget, `inference_slot` caps how many model calls run at once (the others queue
+instead of competing for the cores), and `get_heavy_executor` is the dedicated pool the prediction tasks run on.
+
+`configure_threads` must run before TensorFlow, PyTorch or the tokenizers are imported, i.e. first in `app.py`.
+PyTorch reads no environment variable for its inter-op pool, so `configure_threads` imports it (when installed)
+and sets both of its pools through its API before any parallel work starts.
+"""
+
+import os
+import sys
+import importlib.util
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from config import INTRA_OP_THREADS, INTER_OP_THREADS, MAX_CONCURRENT_INFERENCE, HEAVY_WORKERS
+from metrics import timer, counter
+
+_configured = None
+_inference_slots = threading.BoundedSemaphore(MAX_CONCURRENT_INFERENCE) if MAX_CONCURRENT_INFERENCE else None
+_heavy_executor = None
+_lock = threading.Lock()
+
+
+def default_intra_op_threads(max_concurrent=MAX_CONCURRENT_INFERENCE):
+    """
+    Returns the intra-op threads of one model call, so that the concurrent calls together use every core once.
+
+    Args:
+        max_concurrent (int, optional): The number of model calls running at once. Defaults to MAX_CONCURRENT_INFERENCE.
+
+    Returns:
+        int: The number of threads.
+    """
+    return max(1, (os.cpu_count() or 1) // max(1, max_concurrent or 1))
+
+
+def configure_threads(intra_op=INTRA_OP_THREADS, inter_op=INTER_OP_THREADS):
+    """
+    Sets the intra- and inter-op threads of TensorFlow, PyTorch, the tokenizers and the BLAS/OpenMP libraries.
+    Only the first call has an effect, later ones return the settings in use.
+
+    Args:
+        intra_op (int, optional): The threads of one operation, or None to split the cores between the concurrent
+            model calls (see `default_intra_op_threads`). Defaults to INTRA_OP_THREADS.
+        inter_op (int, optional): The operations run in parallel within one call. Defaults to INTER_OP_THREADS.
+
+    Returns:
+        dict: The 'intra_op' and 'inter_op' threads in use.
+    """
+    global _configured
+    with _lock:
+        if _configured is not None:
+            return _configured
+        intra_op = intra_op or default_intra_op_threads()
+
+        ### Read by the native libraries when they are loaded
+        for variable in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'RAYON_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS'):
+            os.environ.setdefault(variable, str(intra_op))
+        os.environ.setdefault('TF_NUM_INTEROP_THREADS', str(inter_op))
+
+        ### PyTorch is imported now (after the environment above) so its inter-op pool is sized before it starts;
+        ### frameworks imported already are configured through their API, when their runtime has not started yet
+        if 'torch' in sys.modules or importlib.util.find_spec('torch') is not None:
+            import torch
+            torch.set_num_threads(intra_op)
+            try:
+                torch.set_num_interop_threads(inter_op)
+            except RuntimeError:
+                print("PyTorch inter-op threads already started, keeping their number")
+        if 'tensorflow' in sys.modules:
+            tf = sys.modules['tensorflow']
+            try:
+                tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+                tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+            except RuntimeError:
+                print("TensorFlow runtime already initialized, keeping its threads")
+
+        _configured = {'intra_op': intra_op, 'inter_op': inter_op}
+        return _configured
+
+
+def set_inference_limit(limit):
+    """
+    Changes the number of model calls allowed to run at once.
+
+    Args:
+        limit (int): The number of concurrent model calls, or None for no limit.
+    """
+    global _inference_slots
+    _inference_slots = threading.BoundedSemaphore(limit) if limit else None
+
+
+@contextmanager
+def inference_slot():
+    """
+    Waits for a free inference slot and holds it for the duration of the block. The wait is measured in the
+    `inference_wait` metric.
+    """
+    slots = _inference_slots ## The semaphore acquired is the one released, even if the limit changes meanwhile
+    if slots is None:
+        yield
+        return
+    with timer('inference_wait', 'Time spent waiting for a free inference slot'):
+        if not slots.acquire(blocking=False):
+            counter('inference_queued', 'Model calls that waited for a free inference slot').inc()
+            slots.acquire()
+    try:
+        yield
+    finally:
+        slots.release()
+
+
+def get_heavy_executor():
+    """
+    Returns the dedicated executor of the heavy background work (the prediction tasks), created on first use.
+
+    Returns:
+        concurrent.futures.ThreadPoolExecutor: The executor with HEAVY_WORKERS threads.
+    """
+    global _heavy_executor
+    with _lock:
+        if _heavy_executor is None:
+            _heavy_executor = ThreadPoolExecutor(max_workers=HEAVY_WORKERS, thread_name_prefix='heavy')
+        return _heavy_executor
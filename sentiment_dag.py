@@ -0,0 +1,326 @@
+"""
+Author: Zeeshan Hameed
+
+Dependency-tracked recomputation of the sentiment features, over the stages
+raw articles -> cleaned text -> per-article label -> daily aggregate -> feature table.
+
+Every stage has a version, the hash of the config and of the source code it depends on (`clean_text` and the
+NLTK corpora for the cleaning, `LLM` and the scoring functions for the labels, `IMPACT_WEIGHTS` and
+`aggregate_sentiment` for the daily aggregate). The output of a stage is cached under a key hashing its version
+with the keys of its inputs, the roots being the content hashes of the articles and of the daily bars. When the
+config or the code changes, only the stages downstream of the change get a new key and are recomputed, the
+others are loaded from the cache: changing only `IMPACT_WEIGHTS` re-aggregates without cleaning or scoring
+an article again.
+
+The cleaning and labelling stages also memoize every article by the hash of its input under the stage version,
+so when new articles are added only these are cleaned and scored.
+
+Usage:
+    python sentiment_dag.py --start 2024-01-01 --end 2024-06-30          ### Writes sentiment_scores.csv and final_data.csv
+    python sentiment_dag.py --start 2024-01-01 --end 2024-06-30 --plan   ### Only shows the stages that would be recomputed
+"""
+
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+import nltk
+import pandas as pd
+from config import LLM, IMPACT_WEIGHTS, LONG_DOCUMENT_SCORING, WINDOW_STRIDE, NLTK_PACKAGES, CLEAN_WORKERS
+from config import SENTIMENT_BATCH_SIZE, SENTIMENT_DAG_DIR, STORE_PATH
+from text_utils import clean_text, clean_texts, init_clean_worker, encode_texts, get_sentiments_encoded
+from text_utils import get_sentiments_long, split_into_windows, aggregate_sentiment
+from btc_utils import calculate_indicators
+from metrics import timer, counter
+
+### Stages in topological order, with their inputs ('raw' and 'bars' are the root inputs)
+STAGES = {
+    'cleaned': ['raw'],
+    'labels': ['cleaned'],
+    'daily': ['labels'],
+    'features': ['daily', 'bars'],
+}
+MANIFEST = 'manifest.json'
+
+
+def _hash(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else repr(part).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()[:16]
+
+
+def _source(*functions):
+    return [inspect.getsource(function) for function in functions]
+
+
+def content_hash(data):
+    """
+    Returns the hash of the content of a DataFrame, index and column names included.
+
+    Args:
+        data (pandas.DataFrame): The data.
+
+    Returns:
+        str: The hash.
+    """
+    return _hash(list(data.columns), pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+
+
+def build_feature_table(daily, bars):
+    """
+    Joins the daily bars and their indicators with the aggregated daily sentiment, like `final_data.csv`.
+
+    Args:
+        daily (pandas.DataFrame): 'aggregated_sentiment' indexed by date.
+        bars (pandas.DataFrame): The daily bars, with or without their indicator columns.
+
+    Returns:
+        pandas.DataFrame: The bars, indicators and 'aggregated_sentiment' of the days having both.
+    """
+    if 'OBV' not in bars.columns:
+        bars = calculate_indicators(bars.copy())
+    return bars.join(daily['aggregated_sentiment'], how='inner')
+
+
+def stage_versions(llm=LLM, impact_weights=IMPACT_WEIGHTS, long_documents=LONG_DOCUMENT_SCORING):
+    """
+    Returns the version of every stage, the hash of the config and the code its output depends on.
+
+    Args:
+        llm (str, optional): The sentiment model. Defaults to LLM.
+        impact_weights (dict, optional): The impact weight of every news category. Defaults to IMPACT_WEIGHTS.
+        long_documents (bool, optional): Whether articles are scored with sliding windows. Defaults to LONG_DOCUMENT_SCORING.
+
+    Returns:
+        dict: The version of each stage.
+    """
+    scoring = [get_sentiments_long, split_into_windows] if long_documents else [encode_texts, get_sentiments_encoded]
+    return {
+        'cleaned': _hash('cleaned', _source(clean_text, init_clean_worker), list(NLTK_PACKAGES), nltk.__version__),
+        'labels': _hash('labels', llm, long_documents, WINDOW_STRIDE if long_documents else None, _source(*scoring)),
+        'daily': _hash('daily', sorted(impact_weights.items()), _source(aggregate_sentiment)),
+        'features': _hash('features', _source(build_feature_table)),
+    }
+
+
+class SentimentDAG:
+    """
+    Recomputes the sentiment features stage by stage, reusing every cached stage whose version and inputs did not change.
+
+    Attributes:
+        cache_dir (str): The folder of the cached stage outputs and article memos.
+        llm (str): The sentiment model.
+        impact_weights (dict): The impact weight of every news category.
+        long_documents (bool): Whether articles are scored with sliding windows.
+        versions (dict): The version of every stage.
+        lastReport (dict): How every stage was obtained in the last run ('cached' or 'computed') and the articles
+            cleaned and scored.
+
+    Methods:
+        keys: Returns the cache key of every stage for given inputs.
+        plan: Returns the stages a run would recompute, and why.
+        run: Runs the stages, recomputing only the stale ones.
+    """
+
+    def __init__(self, cache_dir=SENTIMENT_DAG_DIR, llm=LLM, impact_weights=IMPACT_WEIGHTS,
+                 long_documents=LONG_DOCUMENT_SCORING, textDataPipeline=None):
+        """
+        Initializes a SentimentDAG object.
+
+        Args:
+            cache_dir (str, optional): The folder of the cache. Defaults to SENTIMENT_DAG_DIR.
+            llm (str, optional): The sentiment model. Defaults to LLM.
+            impact_weights (dict, optional): The impact weight of every news category. Defaults to IMPACT_WEIGHTS.
+            long_documents (bool, optional): Whether to score articles with sliding windows. Defaults to LONG_DOCUMENT_SCORING.
+            textDataPipeline (TextDataPipeline, optional): The pipeline scoring the articles. Defaults to one
+                created with `llm` the first time an article has to be scored.
+        """
+        self.cache_dir = cache_dir
+        self.llm = llm
+        self.impact_weights = impact_weights
+        self.long_documents = long_documents
+        self.textDataPipeline = textDataPipeline
+        self.versions = stage_versions(llm, impact_weights, long_documents)
+        self.lastReport = None
+
+    def _path(self, *parts):
+        return os.path.join(self.cache_dir, *parts)
+
+    def _load(self, path, default=None):
+        if not os.path.exists(path):
+            return default
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def _save(self, path, value):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path) ## An interrupted run never leaves a truncated output behind
+
+    def _manifest(self):
+        path = self._path(MANIFEST)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def keys(self, articles, bars):
+        """
+        Returns the cache key of every stage for the given inputs.
+
+        Args:
+            articles (pandas.DataFrame): The raw articles ('category', 'url', 'content' indexed by publish date).
+            bars (pandas.DataFrame): The daily bars.
+
+        Returns:
+            dict: The key of each root input and stage.
+        """
+        keys = {'raw': content_hash(articles[['category', 'url', 'content']]), 'bars': content_hash(bars)}
+        for stage, inputs in STAGES.items():
+            keys[stage] = _hash(self.versions[stage], *[keys[name] for name in inputs])
+        return keys
+
+    def plan(self, articles, bars):
+        """
+        Returns the stages a run would recompute and why: 'version' when the config or the code of the stage
+        changed since the last run, 'inputs' when an input changed, 'new' when the stage never ran.
+
+        Args:
+            articles (pandas.DataFrame): The raw articles.
+            bars (pandas.DataFrame): The daily bars.
+
+        Returns:
+            dict: The reason of each stage to recompute, or 'cached'.
+        """
+        keys = self.keys(articles, bars)
+        last = self._manifest()
+        plan = {}
+        for stage in STAGES:
+            if os.path.exists(self._path(stage, f'{keys[stage]}.pkl')):
+                plan[stage] = 'cached'
+            elif stage not in last:
+                plan[stage] = 'new'
+            else:
+                plan[stage] = 'version' if last[stage]['version'] != self.versions[stage] else 'inputs'
+        return plan
+
+    def run(self, articles, bars):
+        """
+        Runs every stage, loading the ones whose key is cached and recomputing the others.
+
+        Args:
+            articles (pandas.DataFrame): The raw articles ('category', 'url', 'content' indexed by publish date,
+                as returned by `TimeSeriesStore.read_articles`).
+            bars (pandas.DataFrame): The daily bars, with or without their indicators (e.g. btc_data.csv).
+
+        Returns:
+            dict: The output of each stage ('cleaned', 'labels', 'daily' and 'features').
+        """
+        keys = self.keys(articles, bars)
+        outputs = {'raw': articles[['category', 'url', 'content']], 'bars': bars}
+        self.lastReport = {'articles_cleaned': 0, 'articles_scored': 0}
+        compute = {'cleaned': self._clean, 'labels': self._label, 'daily': self._aggregate, 'features': build_feature_table}
+
+        for stage, inputs in STAGES.items():
+            path = self._path(stage, f'{keys[stage]}.pkl')
+            output = self._load(path)
+            if output is not None:
+                counter('sentiment_dag_reused', 'Sentiment stages loaded from the cache').inc()
+                self.lastReport[stage] = 'cached'
+            else:
+                with timer(f'sentiment_dag_{stage}', f'Time to recompute the {stage} sentiment stage'):
+                    output = compute[stage](*[outputs[name] for name in inputs])
+                self._save(path, output)
+                self.lastReport[stage] = 'computed'
+            outputs[stage] = output
+
+        manifest = {stage: {'version': self.versions[stage], 'key': keys[stage]} for stage in STAGES}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self._path(MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        print(f"Sentiment DAG: {self.lastReport}")
+        return {stage: outputs[stage] for stage in STAGES}
+
+    def _memoized(self, stage, inputs, compute):
+        ### Computes only the distinct inputs not memoized yet under the stage version
+        path = self._path(stage, f'memo-{self.versions[stage]}.pkl')
+        memo = self._load(path, {})
+        hashes = pd.util.hash_pandas_object(inputs, index=False).to_numpy()
+        missing = dict(zip(hashes, inputs))
+        for known in memo.keys() & missing.keys():
+            del missing[known]
+        if missing:
+            memo.update(zip(missing, compute(list(missing.values()))))
+            self._save(path, memo)
+        return [memo[h] for h in hashes], len(missing)
+
+    def _clean(self, raw, workers=CLEAN_WORKERS, shard_size=500):
+        def clean(texts):
+            if len(texts) <= shard_size:
+                return clean_texts(texts)
+            shards = [texts[i:i + shard_size] for i in range(0, len(texts), shard_size)]
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_clean_worker) as pool:
+                return [text for shard in pool.map(clean_texts, shards) for text in shard]
+
+        cleaned = raw.copy()
+        cleaned['content'], self.lastReport['articles_cleaned'] = self._memoized('cleaned', raw['content'].fillna('').astype(str), clean)
+        return cleaned
+
+    def _label(self, cleaned):
+        def score(texts):
+            if self.textDataPipeline is None:
+                from text_data_pipeline import TextDataPipeline
+                self.textDataPipeline = TextDataPipeline(self.llm, long_documents=self.long_documents)
+            return self.textDataPipeline.scoreTexts(texts, SENTIMENT_BATCH_SIZE)
+
+        labels = cleaned[['category', 'url']].copy()
+        labels['sentiment'], self.lastReport['articles_scored'] = self._memoized('labels', cleaned['content'], score)
+        return labels
+
+    def _aggregate(self, labels):
+        return aggregate_sentiment(labels.copy(), self.impact_weights) ## aggregate_sentiment adds its columns in place
+
+
+def update_csv(path, data):
+    """
+    Replaces the days of a date-indexed CSV file covered by the data, keeping the other days.
+
+    Args:
+        path (str): The path of the CSV file, created if it does not exist.
+        data (pandas.DataFrame): The new rows, indexed by date.
+    """
+    if os.path.exists(path):
+        existing = pd.read_csv(path, index_col=0, parse_dates=[0])
+        data = pd.concat([existing[~existing.index.isin(data.index)], data]).sort_index()
+    data.rename_axis('Date').to_csv(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Recompute the stale stages of the sentiment features.')
+    parser.add_argument('--start', default=None, help='The first day of articles (default: the first article)')
+    parser.add_argument('--end', default=None, help='The last day of articles (default: the last article)')
+    parser.add_argument('--store', default=STORE_PATH, help='The time-series store holding the articles')
+    parser.add_argument('--bars-csv', default='data/btc_data.csv')
+    parser.add_argument('--sentiment-csv', default='data/sentiment_scores.csv')
+    parser.add_argument('--features-csv', default='data/final_data.csv')
+    parser.add_argument('--cache-dir', default=SENTIMENT_DAG_DIR)
+    parser.add_argument('--plan', action='store_true', help='Only print the stages that would be recomputed')
+    args = parser.parse_args()
+
+    from timeseries_store import TimeSeriesStore
+    articles = TimeSeriesStore(args.store).read_articles(args.start, args.end)
+    bars = pd.read_csv(args.bars_csv, index_col='Date', parse_dates=['Date'])
+    dag = SentimentDAG(args.cache_dir)
+
+    if args.plan:
+        print(json.dumps(dag.plan(articles, bars), indent=2))
+    else:
+        outputs = dag.run(articles, bars)
+        update_csv(args.sentiment_csv, outputs['daily'])
+        update_csv(args.features_csv, outputs['features'])
@@ -2,10 +2,15 @@
 Author: Zeeshan Hameed
 """
 
-from transformers import BertTokenizer, BertForSequenceClassification
-from data_scrapper import fetch_24hrs
-from text_utils import clean_text, get_sentiment, aggregate_sentiment
-from config import IMPACT_WEIGHTS
+from transformers import BertTokenizer, BertTokenizerFast, BertForSequenceClassification
+from data_scrapper import fetch_data, iter_articles, get_24hr_window, clean_dates, download_article
+from text_utils import clean_text, encode_texts, get_sentiments_encoded, get_sentiments_long, aggregate_sentiment, release_clean_worker
+from config import IMPACT_WEIGHTS, SENTIMENT_BATCH_SIZE, LONG_DOCUMENT_SCORING, WINDOW_STRIDE
+from config import TITLE_FIRST_SCORING, TITLE_CONFIDENCE_THRESHOLD, MEMORY_BUDGET_MODE, NLTK_PACKAGES, FAST_TOKENIZER
+from metrics import timer, counter
+import threading
+import queue
+import gc
 import nltk
 import pandas as pd
 from datetime import datetime, timedelta
@@ -16,49 +21,327 @@ class TextDataPipeline:
     A class that represents a text data pipeline for sentiment analysis.
 
     Attributes:
-        tokenizer (BertTokenizer): The tokenizer used for tokenizing the text.
+        tokenizer (BertTokenizerFast or BertTokenizer): The tokenizer used for tokenizing the text.
         model (BertForSequenceClassification): The pre-trained BERT model for sentiment classification.
+        long_documents (bool): Whether full articles are scored with sliding windows instead of being truncated.
+        model_path (str): Where the tokenizer and the model are loaded from, `llm` unless given.
+        title_first (bool): Whether articles are scored from their title first, downloading only the uncertain ones.
+        fast_tokenizer (bool): Whether the fast (Rust) tokenizer is used instead of the Python one.
+        lastTieredReport (dict): The download and forward-pass savings of the last title-first run.
+        sentimentScores (pandas.DataFrame): The scores of the last `getSentimentScoreForPast24Hours` run.
+        store (TimeSeriesStore): The store the daily scores and the streamed articles are saved to, or None.
+
+    The tokenizer and model are loaded lazily, so they can be released with `unloadModel` between runs.
 
     Methods:
         getSentimentScoreForPast24Hours: Fetches data, cleans the text, and calculates sentiment scores for the past 24 hours.
+        getCachedSentimentScores: Returns the last computed scores without fetching or scoring anything.
+        streamSentimentScores: Cleans and scores the articles of a day while they are still being downloaded.
+        tieredSentimentScores: Scores titles first and downloads and scores only the articles with an uncertain title.
+        scoreArticles: Cleans, scores and aggregates already fetched articles.
+        scoreTexts: Scores cleaned texts in batches.
+        updateSentimentScores: Scores the days missing from sentiment_scores.csv or from the time-series store.
+        unloadModel: Releases the tokenizer, the model and the NLTK corpora until they are needed again.
         get_label_definitions: Returns the label definitions for sentiment scores.
     """
 
-    def __init__(self, llm):
+    def __init__(self, llm, long_documents=LONG_DOCUMENT_SCORING, title_first=TITLE_FIRST_SCORING, download_nltk=True,
+                 fast_tokenizer=FAST_TOKENIZER, store=None, model_path=None):
         """
         Initializes a TextDataPipeline object.
 
         Args:
             llm (str): The pre-trained language model to be used for tokenization and sentiment classification.
+            long_documents (bool, optional): Whether to score full articles with sliding windows. Defaults to LONG_DOCUMENT_SCORING.
+            title_first (bool, optional): Whether to score titles first and download only uncertain articles. Defaults to TITLE_FIRST_SCORING.
+            download_nltk (bool, optional): Whether to download the NLTK corpora, False when they are already on
+                the NLTK data path (e.g. from a warm snapshot). Defaults to True.
+            fast_tokenizer (bool, optional): Whether to use the fast (Rust) tokenizer. Defaults to FAST_TOKENIZER.
+            store (TimeSeriesStore, optional): The store the daily scores, articles and article sentiment are
+                saved to. Defaults to None.
+            model_path (str, optional): Where the tokenizer and the model are loaded from (e.g. the directory of
+                a warm snapshot). `llm` stays the name the sentiment is stored under. Defaults to `llm`.
+        """
+        if download_nltk:
+            for package in NLTK_PACKAGES:
+                nltk.download(package)
+        self.llm = llm
+        self.model_path = model_path or llm
+        self.fast_tokenizer = fast_tokenizer
+        self._tokenizer = self._tokenizerClass().from_pretrained(self.model_path)
+        self._model = BertForSequenceClassification.from_pretrained(self.model_path)
+        self.long_documents = long_documents
+        self.title_first = title_first
+        self.lastTieredReport = None
+        self.sentimentScores = None
+        self.store = store
+
+    @property
+    def tokenizer(self):
+        """
+        The tokenizer, loaded again on first use after `unloadModel`.
+        """
+        if self._tokenizer is None:
+            self._tokenizer = self._tokenizerClass().from_pretrained(self.model_path)
+        return self._tokenizer
+
+
+    def _tokenizerClass(self):
+        return BertTokenizerFast if self.fast_tokenizer else BertTokenizer
+
+
+    @property
+    def model(self):
+        """
+        The sentiment model, loaded again on first use after `unloadModel`.
+        """
+        if self._model is None:
+            self._model = BertForSequenceClassification.from_pretrained(self.model_path)
+        return self._model
+
+
+    def unloadModel(self):
+        """
+        Releases the tokenizer, the sentiment model and the NLTK corpora until they are needed again,
+        so that they do not stay resident between daily runs.
+        """
+        self._tokenizer = None
+        self._model = None
+        release_clean_worker()
+        gc.collect()
+
+
+    def modelMemoryBytes(self):
         """
-        nltk.download('punkt')
-        nltk.download('punkt_tab')
-        nltk.download('stopwords')
-        nltk.download('wordnet')
-        self.tokenizer = BertTokenizer.from_pretrained(llm)
-        self.model = BertForSequenceClassification.from_pretrained(llm)
+        Returns the memory held by the parameters and buffers of the sentiment model (0 when unloaded).
 
+        Returns:
+            int: The size in bytes.
+        """
+        if self._model is None:
+            return 0
+        tensors = list(self._model.parameters()) + list(self._model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+
+    @timer('text_pipeline_past_24hrs', 'Time to produce the sentiment score for the past 24 hours')
     def getSentimentScoreForPast24Hours(self):
         """
-        Fetches data, cleans the text, and calculates sentiment scores for the past 24 hours.
+        Fetches data, cleans the text, and calculates sentiment scores for the past 24 hours. The scores are
+        saved to the store, if any.
 
         Returns:
             pandas.DataFrame: A DataFrame containing the aggregated sentiment scores for the past 24 hours.
         """
-        data = fetch_24hrs() ## Step 1: Fetch the Data
+        if self.title_first:
+            scores = self.tieredSentimentScores()
+        else:
+            scores = self.streamSentimentScores()
+
+        if MEMORY_BUDGET_MODE:
+            self.unloadModel() ## Not needed again before tomorrow's run
+        if self.store is not None:
+            self.store.upsert_daily_sentiment(scores)
+        self.sentimentScores = scores
+        return scores
+
+
+    def getCachedSentimentScores(self, store=None, days=7):
+        """
+        Returns the scores of the last daily run, or the last days of the store before the first run.
+        Nothing is fetched or scored, so the hourly predictions never wait for the sentiment model.
+
+        Args:
+            store (TimeSeriesStore, optional): The store read before the first run. Defaults to the store of the
+                pipeline, or the default store.
+            days (int, optional): The days read from the store. Defaults to 7.
+
+        Returns:
+            pandas.DataFrame: The aggregated sentiment scores indexed by date.
+        """
+        if self.sentimentScores is not None:
+            return self.sentimentScores
+        from timeseries_store import TimeSeriesStore
+        start = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+        return (store or self.store or TimeSeriesStore()).read_daily_sentiment(start=start)
+
+
+    @timer('text_pipeline_stream', 'Time to stream, clean, score and aggregate the articles of a window')
+    def streamSentimentScores(self, start=None, end=None, batch_size=SENTIMENT_BATCH_SIZE):
+        """
+        Scores the articles of a day while they are still being downloaded.
+
+        A background thread pulls articles from the scraper as they arrive, they are cleaned as they come in and
+        scored in micro-batches, so the network I/O overlaps with cleaning and inference.
+        The aggregated output is the same as fetching everything first with `fetch_24hrs` and calling `scoreArticles`.
+        With a store, the raw articles and their sentiment are saved to it.
+
+        Args:
+            start (datetime, optional): The start of the window. Defaults to the start of the previous day.
+            end (datetime, optional): The end of the window. Defaults to the end of the previous day.
+            batch_size (int, optional): The number of articles scored per forward pass. Defaults to SENTIMENT_BATCH_SIZE.
+
+        Returns:
+            pandas.DataFrame: A DataFrame containing the aggregated sentiment scores per day.
+        """
+        start_date, end_date = get_24hr_window(start, end)
+        arrivals = queue.Queue()
+        failure = [] ## The exception of the producer, re-raised here instead of aggregating a partial day
+
+        def produce():
+            try:
+                for article in iter_articles(start_date, end_date):
+                    arrivals.put(article)
+            except BaseException as e:
+                failure.append(e)
+            finally:
+                arrivals.put(None)
+
+        producer = threading.Thread(target=produce, name='article-producer', daemon=True)
+        producer.start()
+
+        batch, scored = [], []
+
+        def score(batch):
+            sentiments = self.scoreTexts([a['content'] for a in batch], batch_size)
+            for article, sentiment in zip(batch, sentiments):
+                article['sentiment'] = sentiment
+            scored.extend(batch)
+
+        ### Cleaned in this thread while the producer keeps downloading: a day is a few hundred articles, and a
+        ### process pool would fork the whole serving process (models included) on every run
+        while True:
+            article = arrivals.get()
+            if article is None:
+                if failure:
+                    raise failure[0]
+                break
+            article['raw_content'] = article['content'] ## Stored as scraped, the cleaning rules may change
+            article['content'] = clean_text(article['content'])
+            batch.append(article)
+            if len(batch) >= batch_size:
+                score(batch)
+                batch = []
+        if batch:
+            score(batch)
+
+        producer.join()
+        data = pd.DataFrame(scored)
+        if self.store is not None and not data.empty:
+            self.store.upsert_articles(data.drop(columns='content').rename(columns={'raw_content': 'content'}))
+            self.store.upsert_article_sentiment(data, self.llm)
+        data = clean_dates(data.drop(columns='raw_content', errors='ignore'))
+        return aggregate_sentiment(data, IMPACT_WEIGHTS)
+
+
+    @timer('text_pipeline_tiered', 'Time to score the articles of a window title-first')
+    def tieredSentimentScores(self, start=None, end=None, threshold=TITLE_CONFIDENCE_THRESHOLD, batch_size=SENTIMENT_BATCH_SIZE):
+        """
+        Scores the articles of a day from their titles, and downloads and scores the full body only for
+        articles whose title prediction is less confident than the threshold. With a store, the articles and their
+        sentiment are saved to it.
+
+        Args:
+            start (datetime, optional): The start of the window. Defaults to the start of the previous day.
+            end (datetime, optional): The end of the window. Defaults to the end of the previous day.
+            threshold (float, optional): The minimum title confidence to skip the body. Defaults to TITLE_CONFIDENCE_THRESHOLD.
+            batch_size (int, optional): The number of texts per forward pass. Defaults to SENTIMENT_BATCH_SIZE.
+
+        Returns:
+            pandas.DataFrame: A DataFrame containing the aggregated sentiment scores per day.
+        """
+        start_date, end_date = get_24hr_window(start, end)
+        ### Step 1: Fetch the metadata only, with one query per category (merged queries need the body to classify articles)
+        data = fetch_data(start_date=start_date, end_date=end_date, download=False, merged=False)
+
+        ### Step 2: Tokenize every title at once and score them in batches
+        titles = data['title'].fillna('').apply(clean_text).tolist()
+        sentiments, confidences = get_sentiments_encoded(encode_texts(titles, self.tokenizer), self.tokenizer, self.model, batch_size)
+        data['sentiment'] = sentiments
+
+        ### Step 3: Download and score the body of the uncertain articles (once per URL, an article can be in several categories)
+        uncertain = [i for i, confidence in enumerate(confidences) if confidence < threshold]
+        bodies = {}
+        for url in data['url'].iloc[uncertain]:
+            if url in bodies:
+                counter('articles_cached', 'Articles served from an earlier download or score').inc()
+            else:
+                bodies[url] = download_article(url)
+        downloaded = {url: clean_text(body) for url, body in bodies.items() if body}
+        body_sentiments = dict(zip(downloaded, self.scoreTexts(list(downloaded.values()), batch_size)))
+        for i in uncertain:
+            url = data['url'].iloc[i]
+            if url in body_sentiments: ## Articles that failed to download keep their title sentiment
+                data.iloc[i, data.columns.get_loc('sentiment')] = body_sentiments[url]
+
+        unique_urls = data['url'].nunique()
+        self.lastTieredReport = {
+            'articles': len(data),
+            'titles_scored': len(titles),
+            'bodies_downloaded': len(bodies),
+            'downloads_saved': unique_urls - len(bodies),
+            'body_passes_saved': unique_urls - len(body_sentiments),
+        }
+        counter('downloads_saved', 'Article downloads skipped thanks to a confident title').inc(self.lastTieredReport['downloads_saved'])
+        print(f"Title-first scoring: {self.lastTieredReport}")
+
+        if self.store is not None and not data.empty:
+            ### Like `streamSentimentScores`: the raw body when it was downloaded, the title only otherwise
+            self.store.upsert_articles(data.assign(content=data['url'].map(lambda url: bodies.get(url) or None)))
+            self.store.upsert_article_sentiment(data, self.llm)
+        data = clean_dates(data)
+        return aggregate_sentiment(data, IMPACT_WEIGHTS) ## Step 4: Aggregate sentiment scores
+
+
+    def scoreArticles(self, data):
+        """
+        Cleans the text of already fetched articles, scores them and aggregates the scores per day.
+
+        Args:
+            data (pandas.DataFrame): The articles as returned by `fetch_24hrs`, indexed by publish date.
+
+        Returns:
+            pandas.DataFrame: A DataFrame containing the aggregated sentiment scores per day.
+        """
         data['content'] = data['content'].apply(clean_text) ## Step 2: Clean the text (see method documentation for more details)
-        data['sentiment'] = data['content'].apply(lambda x: get_sentiment(x, self.tokenizer, self.model)) ## Step 3: Get sentiment scores
+        data['sentiment'] = self.scoreTexts(data['content'].tolist()) ## Step 3: Get sentiment scores
         data = aggregate_sentiment(data, IMPACT_WEIGHTS) ## Step 4: Aggregate sentiment scores for the past 24hrs
         return data
     
 
-    def updateSentimentScores(self, csv_path='data/sentiment_scores.csv'):
+    def scoreTexts(self, texts, batch_size=SENTIMENT_BATCH_SIZE):
+        """
+        Scores cleaned texts in batches, truncating them at 512 tokens or, in long-document mode,
+        pooling the scores of overlapping 512-token windows. All the texts are tokenized in one batched call.
+
+        Args:
+            texts (list): The cleaned texts.
+            batch_size (int, optional): The number of texts (or windows) per forward pass. Defaults to SENTIMENT_BATCH_SIZE.
+
+        Returns:
+            list: The sentiment label of each text.
+        """
+        if self.long_documents:
+            return get_sentiments_long(texts, self.tokenizer, self.model, stride=WINDOW_STRIDE, batch_size=batch_size)
+
+        sentiments, _ = get_sentiments_encoded(encode_texts(texts, self.tokenizer), self.tokenizer, self.model, batch_size)
+        return sentiments
+
+
+    @timer('text_pipeline_update', 'Time to bring sentiment_scores.csv up to date')
+    def updateSentimentScores(self, csv_path='data/sentiment_scores.csv', store=None, start=None):
         """
         Reads the CSV, fetches and processes new data, and appends it to the CSV.
 
         Args:
             csv_path (str): The path to the CSV file. Defaults to 'data/sentiment_scores.csv'.
+            store (TimeSeriesStore, optional): A store to update instead of the CSV file. Every day is upserted
+                as soon as it is scored, so an interrupted update resumes from the last scored day.
+            start (datetime, optional): The first day scored when the store has no daily sentiment yet.
         """
+        if store is not None:
+            return self.updateStoredSentimentScores(store, start)
+
         ### Step 1: Read the CSV and get the last Date
         df = pd.read_csv(csv_path, parse_dates=['Date'], index_col='Date')
         latest_date = df.index.max()
@@ -71,10 +354,7 @@ class TextDataPipeline:
         new_data = []
         while start_date <= end_date:
             day_end = start_date + timedelta(days=1) - timedelta(seconds=1)
-            data = fetch_24hrs(start=start_date, end=day_end)
-            data['content'] = data['content'].apply(clean_text)
-            data['sentiment'] = data['content'].apply(lambda x: get_sentiment(x, self.tokenizer, self.model))
-            daily_data_aggregated = aggregate_sentiment(data, IMPACT_WEIGHTS)
+            daily_data_aggregated = self.streamSentimentScores(start=start_date, end=day_end)
 
             new_data.append(daily_data_aggregated)
             start_date = start_date + timedelta(days=1)
@@ -87,6 +367,30 @@ class TextDataPipeline:
         ### Step 5: Saving the updated data
         df.to_csv(csv_path)
 
+
+    def updateStoredSentimentScores(self, store, start=None):
+        """
+        Scores every day missing from the daily sentiment of the store, up to yesterday.
+
+        Args:
+            store (TimeSeriesStore): The store to update.
+            start (datetime, optional): The first day scored when the store has no daily sentiment yet.
+                Defaults to yesterday, so an empty store is never backfilled by accident.
+        """
+        latest_date = store.last_timestamp('daily_sentiment')
+        if latest_date is not None:
+            start_date = latest_date + timedelta(days=1)
+        else:
+            start_date = pd.Timestamp(start) if start is not None else datetime.now() - timedelta(days=1)
+            start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+            print(f"The store has no daily sentiment yet, scoring from {start_date:%Y-%m-%d}")
+        end_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(seconds=1)
+
+        while start_date <= end_date:
+            day_end = start_date + timedelta(days=1) - timedelta(seconds=1)
+            store.upsert_daily_sentiment(self.streamSentimentScores(start=start_date, end=day_end))
+            start_date = start_date + timedelta(days=1)
+
     def getLabelDefinitions(self):
         """
         Returns the label definitions for sentiment scores.
@@ -3,14 +3,54 @@ Author: Zeeshan Hameed
 """
 
 import re
+import threading
 import nltk
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
 from nltk.stem  import WordNetLemmatizer 
 import torch
 import pandas as pd
+from metrics import timer, counter
+from runtime import inference_slot
 
 
+_STOP_WORDS = None
+_LEMMATIZER = None
+_CLEAN_LOCK = threading.Lock()
+
+
+def init_clean_worker():
+    """
+    Loads the NLTK resources used by `clean_text` once, so that every later call (and every call in a
+    worker process that runs this as its initializer) reuses them.
+
+    Returns:
+        tuple: The stop words and the lemmatizer, for callers that must not see them released meanwhile.
+    """
+    global _STOP_WORDS, _LEMMATIZER
+    with _CLEAN_LOCK:
+        if _STOP_WORDS is None:
+            lemmatizer = WordNetLemmatizer()
+            lemmatizer.lemmatize('warmup') ### WordNet is loaded lazily on first use
+            _STOP_WORDS, _LEMMATIZER = frozenset(stopwords.words('english')), lemmatizer
+        return _STOP_WORDS, _LEMMATIZER
+
+
+def release_clean_worker():
+    """
+    Releases the NLTK resources loaded by `init_clean_worker`; they are loaded again on the next `clean_text` call.
+    Calls already running keep the resources they bound.
+    """
+    global _STOP_WORDS, _LEMMATIZER
+    with _CLEAN_LOCK:
+        _STOP_WORDS = None
+        _LEMMATIZER = None
+    from nltk.corpus import wordnet
+    if hasattr(wordnet, '_unload'):
+        wordnet._unload()
+
+
+@timer('clean_text', 'Time to clean a single article')
 def clean_text(text):
     """
     Cleans the given text by performing the following steps:
@@ -29,7 +69,7 @@ def clean_text(text):
     Returns:
         str: The cleaned text.
     """
-    lemmatizer = WordNetLemmatizer()
+    stop_words, lemmatizer = init_clean_worker() ### Bound locally, a concurrent `release_clean_worker` cannot clear them
 
     text = text.lower()  # Lowercase
     text = re.sub(r'\[.*?\]', '', text)  # Remove text in square brackets
@@ -38,10 +78,23 @@ def clean_text(text):
     text = re.sub(r'[^a-zA-Z]', ' ', text)  # Remove special characters and numbers
     text = re.sub(r'\s+', ' ', text).strip()  # Remove extra whitespace
     tokens = word_tokenize(text)  # Tokenize
-    tokens = [lemmatizer.lemmatize(word) for word in tokens if word not in stopwords.words('english')] # Lemmatize and remove stop words
+    tokens = [lemmatizer.lemmatize(word) for word in tokens if word not in stop_words] # Lemmatize and remove stop words
     return ' '.join(tokens)
 
 
+def clean_texts(texts):
+    """
+    Cleans a shard of texts, see `clean_text`.
+
+    Args:
+        texts (list): The texts to be cleaned.
+
+    Returns:
+        list: The cleaned texts, in the same order.
+    """
+    return [clean_text(text) for text in texts]
+
+
 def tokenize_text(text, tokenizer, max_length=512):
     """
     Tokenizes the given text using the provided tokenizer.
@@ -69,6 +122,7 @@ def tokenize_text(text, tokenizer, max_length=512):
     return encoding['input_ids'], encoding['attention_mask']
 
 
+@timer('get_sentiment', 'Time to tokenize and score a single article')
 def get_sentiment(text, tokenizer, model, max_length=512):
     """
     Get the sentiment of a given text using a tokenizer and a model.
@@ -84,14 +138,201 @@ def get_sentiment(text, tokenizer, model, max_length=512):
     """
     input_ids, attention_mask = tokenize_text(text, tokenizer, max_length)
 
-    with torch.no_grad():
+    with inference_slot(), torch.no_grad():
         outputs = model(input_ids, attention_mask)
 
     logits = outputs[0]
     sentiment = torch.argmax(logits, dim=1).item()
+    counter('articles_scored', 'Articles scored by the sentiment model').inc()
     return sentiment
 
 
+def get_sentiments(texts, tokenizer, model, max_length=512):
+    """
+    Get the sentiment of a batch of texts in a single forward pass.
+
+    Args:
+        texts (list): The input texts to analyze.
+        tokenizer: The tokenizer object used to tokenize the texts.
+        model: The model used to predict the sentiment.
+        max_length (int, optional): The maximum length of each input text. Defaults to 512.
+
+    Returns:
+        list: The predicted sentiment of each text, in the same order as the input.
+    """
+    sentiments, _ = get_sentiments_with_confidence(texts, tokenizer, model, max_length)
+    return sentiments
+
+
+@timer('get_sentiments', 'Time to tokenize and score a batch of articles')
+def get_sentiments_with_confidence(texts, tokenizer, model, max_length=512):
+    """
+    Get the sentiment of a batch of texts in a single forward pass, with the probability of the predicted label.
+
+    Args:
+        texts (list): The input texts to analyze.
+        tokenizer: The tokenizer object used to tokenize the texts.
+        model: The model used to predict the sentiment.
+        max_length (int, optional): The maximum length of each input text. Defaults to 512.
+
+    Returns:
+        tuple: The predicted sentiment of each text and its softmax probability, both as lists in input order.
+    """
+    encoding = tokenizer(
+        list(texts),
+        add_special_tokens = True,
+        max_length = max_length,
+        return_token_type_ids = False,
+        padding = True, ## Pad to the longest text of the batch, the attention mask hides the padding
+        truncation = True,
+        return_attention_mask = True,
+        return_tensors = 'pt'
+    )
+
+    with inference_slot(), torch.no_grad():
+        outputs = model(encoding['input_ids'], encoding['attention_mask'])
+
+    confidences, sentiments = torch.softmax(outputs[0], dim=1).max(dim=1)
+    counter('articles_scored', 'Articles scored by the sentiment model').inc(len(texts))
+    return sentiments.tolist(), confidences.tolist()
+
+
+@timer('encode_texts', 'Time to tokenize a list of texts in one batched call')
+def encode_texts(texts, tokenizer, max_length=512):
+    """
+    Tokenizes every text in a single call (in parallel with a fast tokenizer), truncated at `max_length` tokens
+    with the special tokens and without padding.
+
+    Args:
+        texts (list): The input texts.
+        tokenizer: The tokenizer object used to tokenize the texts.
+        max_length (int, optional): The maximum length of each encoding. Defaults to 512.
+
+    Returns:
+        list: The token ids of each text, in input order.
+    """
+    encodings = tokenizer(
+        list(texts),
+        add_special_tokens = True,
+        max_length = max_length,
+        truncation = True,
+        return_token_type_ids = False,
+        return_attention_mask = False
+    )['input_ids']
+    counter('tokens_encoded', 'Tokens produced by the sentiment tokenizer').inc(sum(len(ids) for ids in encodings))
+    return encodings
+
+
+@timer('get_sentiments_encoded', 'Time to score a list of tokenized texts')
+def get_sentiments_encoded(encodings, tokenizer, model, batch_size=16):
+    """
+    Scores texts tokenized by `encode_texts` with their softmax probability. The texts are sorted by length so
+    that each forward pass is padded as little as possible.
+
+    Args:
+        encodings (list): The token ids of each text.
+        tokenizer: The tokenizer the texts were encoded with (for padding).
+        model: The model used to predict the sentiment.
+        batch_size (int, optional): The number of texts per forward pass. Defaults to 16.
+
+    Returns:
+        tuple: The predicted sentiment of each text and its softmax probability, both as lists in input order.
+    """
+    order = sorted(range(len(encodings)), key=lambda i: len(encodings[i]))
+    sentiments, confidences = [None] * len(encodings), [None] * len(encodings)
+
+    for start in range(0, len(order), batch_size):
+        rows = order[start:start + batch_size]
+        length = len(encodings[rows[-1]])
+        input_ids = torch.full((len(rows), length), tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(rows), length), dtype=torch.long)
+        for row, i in enumerate(rows):
+            input_ids[row, :len(encodings[i])] = torch.tensor(encodings[i])
+            attention_mask[row, :len(encodings[i])] = 1
+
+        with inference_slot(), torch.no_grad():
+            logits = model(input_ids, attention_mask)[0]
+        batch_confidences, batch_sentiments = torch.softmax(logits, dim=1).max(dim=1)
+        for row, i in enumerate(rows):
+            sentiments[i], confidences[i] = batch_sentiments[row].item(), batch_confidences[row].item()
+
+    counter('articles_scored', 'Articles scored by the sentiment model').inc(len(encodings))
+    return sentiments, confidences
+
+
+def split_into_windows(input_ids, max_length=512, stride=128):
+    """
+    Splits a token sequence into overlapping windows that fit the model once the special tokens are added.
+
+    Args:
+        input_ids (list): The token ids of a document, without special tokens.
+        max_length (int, optional): The maximum length of a window including special tokens. Defaults to 512.
+        stride (int, optional): The number of tokens shared by consecutive windows. Defaults to 128.
+
+    Returns:
+        list: The windows (lists of token ids). An empty document gives a single empty window.
+    """
+    window = max_length - 2 ## Room for [CLS] and [SEP]
+    step = max(window - stride, 1)
+    windows = [input_ids[start:start + window] for start in range(0, max(len(input_ids) - stride, 1), step)]
+    return windows or [[]]
+
+
+@timer('get_sentiments_long', 'Time to score a batch of articles with sliding windows')
+def get_sentiments_long(texts, tokenizer, model, max_length=512, stride=128, batch_size=16):
+    """
+    Get the sentiment of full-length texts by scoring overlapping token windows instead of truncating at `max_length`.
+
+    The windows of every text are packed together, sorted by length so that each batch is padded as little as
+    possible, and the logits of the windows of a text are averaged weighted by their number of tokens.
+    The cost is therefore proportional to the real number of tokens, not to texts x max_length.
+
+    Args:
+        texts (list): The input texts to analyze.
+        tokenizer: The tokenizer object used to tokenize the texts.
+        model: The model used to predict the sentiment.
+        max_length (int, optional): The maximum length of a window including special tokens. Defaults to 512.
+        stride (int, optional): The number of tokens shared by consecutive windows. Defaults to 128.
+        batch_size (int, optional): The number of windows per forward pass. Defaults to 16.
+
+    Returns:
+        list: The predicted sentiment of each text, in the same order as the input.
+    """
+    encodings = tokenizer(list(texts), add_special_tokens=False, truncation=False, return_attention_mask=False)['input_ids']
+
+    windows = [] ## (text index, window token ids)
+    for index, input_ids in enumerate(encodings):
+        windows.extend((index, window) for window in split_into_windows(input_ids, max_length, stride))
+    windows.sort(key=lambda w: len(w[1]))
+
+    pooled = torch.zeros(len(encodings), model.config.num_labels)
+    weights = torch.zeros(len(encodings), 1)
+
+    for start in range(0, len(windows), batch_size):
+        batch = windows[start:start + batch_size]
+        length = len(batch[-1][1]) + 2
+        input_ids = torch.full((len(batch), length), tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), length), dtype=torch.long)
+        for row, (_, window) in enumerate(batch):
+            ids = [tokenizer.cls_token_id] + window + [tokenizer.sep_token_id]
+            input_ids[row, :len(ids)] = torch.tensor(ids)
+            attention_mask[row, :len(ids)] = 1
+
+        with inference_slot(), torch.no_grad():
+            logits = model(input_ids, attention_mask)[0]
+
+        for row, (index, window) in enumerate(batch):
+            weight = max(len(window), 1)
+            pooled[index] += logits[row] * weight
+            weights[index] += weight
+
+    sentiments = torch.argmax(pooled / weights, dim=1).tolist()
+    counter('articles_scored', 'Articles scored by the sentiment model').inc(len(sentiments))
+    counter('sentiment_windows', 'Token windows scored by the sentiment model').inc(len(windows))
+    return sentiments
+
+
+@timer('aggregate_sentiment', 'Time to aggregate article sentiment per day')
 def aggregate_sentiment(df, impact_weights):
     """
     Aggregates sentiment values based on impact weights.
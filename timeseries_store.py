@@ -0,0 +1,333 @@
+"""
+Author: Zeeshan Hameed
+
+Embedded SQLite store of every time series of the app: bars by interval, articles, article sentiment, daily
+sentiment and predictions (see `prediction_log.py`).
+
+Every table is typed and indexed by date, dates are stored in one format ('YYYY-MM-DD' for days and
+'YYYY-MM-DD HH:MM:SS' for bar timestamps), writes are upserts and the database runs in WAL mode so the app
+can read while a pipeline writes.
+
+Usage:
+    python timeseries_store.py migrate --data-dir data --news-dir bitcoin_news_data
+"""
+
+import argparse
+import os
+import sqlite3
+from contextlib import contextmanager
+import pandas as pd
+from config import STORE_PATH
+from prediction_log import get_prediction_log
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bars (
+    symbol TEXT NOT NULL,
+    interval TEXT NOT NULL,
+    ts TEXT NOT NULL,
+    open REAL, high REAL, low REAL, close REAL, adj_close REAL, volume REAL,
+    PRIMARY KEY (symbol, interval, ts)
+);
+CREATE TABLE IF NOT EXISTS articles (
+    url TEXT NOT NULL,
+    category TEXT NOT NULL,
+    publish_date TEXT NOT NULL,
+    title TEXT,
+    content TEXT,
+    PRIMARY KEY (url, category)
+);
+CREATE INDEX IF NOT EXISTS articles_date ON articles (publish_date);
+CREATE TABLE IF NOT EXISTS article_sentiment (
+    url TEXT NOT NULL,
+    model TEXT NOT NULL,
+    sentiment INTEGER NOT NULL,
+    PRIMARY KEY (url, model)
+);
+CREATE TABLE IF NOT EXISTS daily_sentiment (
+    date TEXT PRIMARY KEY,
+    aggregated_sentiment REAL NOT NULL
+);
+"""
+
+### Bar columns as returned by Yahoo Finance, and their column in the store
+BAR_COLUMNS = {'Open': 'open', 'High': 'high', 'Low': 'low', 'Close': 'close', 'Adj Close': 'adj_close', 'Volume': 'volume'}
+
+DATE_FORMAT = '%Y-%m-%d'
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class TimeSeriesStore:
+    """
+    Typed, date-indexed tables of bars, articles, sentiment and predictions in one SQLite database.
+
+    Attributes:
+        path (str): The path of the SQLite database.
+        predictions (PredictionLog): The prediction log, stored in the same database.
+
+    Methods:
+        upsert_bars / read_bars: Writes and reads the bars of an interval.
+        upsert_articles / read_articles: Writes and reads scraped articles.
+        upsert_article_sentiment / read_article_sentiment: Writes and reads the sentiment of each article.
+        upsert_daily_sentiment / read_daily_sentiment: Writes and reads the aggregated daily sentiment.
+        last_timestamp: Returns the last stored date of a series.
+    """
+
+    def __init__(self, path=STORE_PATH):
+        """
+        Opens (and creates if needed) the store.
+
+        Args:
+            path (str, optional): The path of the SQLite database. Defaults to STORE_PATH.
+        """
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+        self.predictions = get_prediction_log(path)
+
+    @contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _upsert(self, table, columns, keys, rows):
+        updates = ', '.join(f'{c} = excluded.{c}' for c in columns if c not in keys) or f'{keys[0]} = excluded.{keys[0]}'
+        query = (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                 f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}")
+        with self._connect() as connection:
+            connection.executemany(query, rows)
+        return len(rows)
+
+    def _read(self, query, params, index, date_format=None):
+        with self._connect() as connection:
+            data = pd.read_sql_query(query, connection, params=params)
+        data[index] = pd.to_datetime(data[index], format=date_format)
+        return data.set_index(index)
+
+    def upsert_bars(self, data, interval, symbol='BTC-USD'):
+        """
+        Inserts or replaces the bars of an interval.
+
+        Args:
+            data (pandas.DataFrame): Bars indexed by timestamp, with the Yahoo Finance columns ('Open', 'High', ...).
+            interval (str): The bar interval (e.g. '1h' or '1d').
+            symbol (str, optional): The ticker. Defaults to 'BTC-USD'.
+
+        Returns:
+            int: The number of bars written.
+        """
+        columns = [c for c in BAR_COLUMNS if c in data.columns]
+        index = pd.DatetimeIndex(data.index)
+        if index.tz is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+        values = data[columns].astype(float).to_numpy()
+        rows = [(symbol, interval, ts, *map(float, row)) for ts, row in zip(index.strftime(TIMESTAMP_FORMAT), values)]
+        return self._upsert('bars', ['symbol', 'interval', 'ts'] + [BAR_COLUMNS[c] for c in columns], ['symbol', 'interval', 'ts'], rows)
+
+    def read_bars(self, interval, start=None, end=None, symbol='BTC-USD'):
+        """
+        Reads the bars of an interval between two dates (inclusive).
+
+        Args:
+            interval (str): The bar interval (e.g. '1h' or '1d').
+            start (str, optional): The first date or timestamp. Defaults to the first bar.
+            end (str, optional): The last date or timestamp. Defaults to the last bar.
+            symbol (str, optional): The ticker. Defaults to 'BTC-USD'.
+
+        Returns:
+            pandas.DataFrame: The bars indexed by timestamp, with the Yahoo Finance column names.
+        """
+        query = (f"SELECT ts, {', '.join(BAR_COLUMNS.values())} FROM bars "
+                 "WHERE symbol = ? AND interval = ? AND ts >= ? AND ts <= ? ORDER BY ts")
+        bars = self._read(query, (symbol, interval, _lower(start), _upper(end)), 'ts', TIMESTAMP_FORMAT)
+        return bars.astype(float).rename(columns={v: k for k, v in BAR_COLUMNS.items()}).rename_axis('Date')
+
+    def upsert_articles(self, data):
+        """
+        Inserts or replaces scraped articles.
+
+        Args:
+            data (pandas.DataFrame): Articles with 'url', 'category', 'title', 'content' and a 'publish_date'
+                column or index (GDELT 'YYYYMMDDTHHMMSSZ' or any format pandas parses).
+
+        Returns:
+            int: The number of articles written.
+        """
+        data = data.reset_index() if 'publish_date' not in data.columns else data
+        dates = _parse_dates(data['publish_date']).strftime(DATE_FORMAT)
+        rows = list(zip(data['url'], data['category'], dates, data['title'].where(data['title'].notna(), None),
+                        data['content'].where(data['content'].notna(), None)))
+        return self._upsert('articles', ['url', 'category', 'publish_date', 'title', 'content'], ['url', 'category'], rows)
+
+    def read_articles(self, start=None, end=None, category=None):
+        """
+        Reads the articles published between two dates (inclusive).
+
+        Args:
+            start (str, optional): The first date. Defaults to the first article.
+            end (str, optional): The last date. Defaults to the last article.
+            category (str, optional): Reads only the articles of this category. Defaults to every category.
+
+        Returns:
+            pandas.DataFrame: The articles indexed by publish date.
+        """
+        query = "SELECT publish_date, category, title, url, content FROM articles WHERE publish_date >= ? AND publish_date <= ?"
+        params = [_lower(start), _upper(end)]
+        if category is not None:
+            query += " AND category = ?"
+            params.append(category)
+        return self._read(query + " ORDER BY publish_date", params, 'publish_date', DATE_FORMAT)
+
+    def upsert_article_sentiment(self, data, model):
+        """
+        Inserts or replaces the sentiment of articles.
+
+        Args:
+            data (pandas.DataFrame): Articles with 'url' and 'sentiment' columns.
+            model (str): The model the sentiment was computed with.
+
+        Returns:
+            int: The number of sentiments written.
+        """
+        rows = [(url, model, int(sentiment)) for url, sentiment in zip(data['url'], data['sentiment'])]
+        return self._upsert('article_sentiment', ['url', 'model', 'sentiment'], ['url', 'model'], rows)
+
+    def read_article_sentiment(self, model, start=None, end=None):
+        """
+        Reads the articles published between two dates (inclusive) with their sentiment, ready for `aggregate_sentiment`.
+
+        Args:
+            model (str): The model the sentiment was computed with.
+            start (str, optional): The first date. Defaults to the first article.
+            end (str, optional): The last date. Defaults to the last article.
+
+        Returns:
+            pandas.DataFrame: 'category', 'url' and 'sentiment' indexed by publish date.
+        """
+        query = """
+            SELECT a.publish_date, a.category, a.url, s.sentiment FROM articles AS a
+            JOIN article_sentiment AS s ON s.url = a.url AND s.model = ?
+            WHERE a.publish_date >= ? AND a.publish_date <= ? ORDER BY a.publish_date
+        """
+        return self._read(query, (model, _lower(start), _upper(end)), 'publish_date', DATE_FORMAT)
+
+    def upsert_daily_sentiment(self, data):
+        """
+        Inserts or replaces aggregated daily sentiment scores.
+
+        Args:
+            data (pandas.DataFrame): 'aggregated_sentiment' indexed by date (as returned by `aggregate_sentiment`).
+
+        Returns:
+            int: The number of days written.
+        """
+        dates = _parse_dates(pd.Series(data.index)).strftime(DATE_FORMAT)
+        rows = [(date, float(score)) for date, score in zip(dates, data['aggregated_sentiment'])]
+        return self._upsert('daily_sentiment', ['date', 'aggregated_sentiment'], ['date'], rows)
+
+    def read_daily_sentiment(self, start=None, end=None):
+        """
+        Reads the aggregated daily sentiment scores between two dates (inclusive).
+
+        Args:
+            start (str, optional): The first date. Defaults to the first day.
+            end (str, optional): The last date. Defaults to the last day.
+
+        Returns:
+            pandas.DataFrame: 'aggregated_sentiment' indexed by 'Date'.
+        """
+        query = "SELECT date, aggregated_sentiment FROM daily_sentiment WHERE date >= ? AND date <= ? ORDER BY date"
+        return self._read(query, (_lower(start), _upper(end)), 'date', DATE_FORMAT).rename_axis('Date')
+
+    def last_timestamp(self, table, **filters):
+        """
+        Returns the last stored date of a series.
+
+        Args:
+            table (str): 'bars', 'articles' or 'daily_sentiment'.
+            **filters: Column values selecting the series (e.g. interval='1h').
+
+        Returns:
+            pandas.Timestamp or None: The last date, or None if the series is empty.
+        """
+        column = {'bars': 'ts', 'articles': 'publish_date', 'daily_sentiment': 'date'}[table]
+        where = ' AND '.join(f'{c} = ?' for c in filters) or '1'
+        with self._connect() as connection:
+            last = connection.execute(f"SELECT MAX({column}) FROM {table} WHERE {where}", tuple(filters.values())).fetchone()[0]
+        return pd.Timestamp(last) if last is not None else None
+
+
+def _lower(date):
+    return '' if date is None else str(date)
+
+
+def _upper(date):
+    ### A bare date includes the whole day
+    if date is None:
+        return '9999'
+    return f'{date} 23:59:59' if len(str(date)) == 10 else str(date)
+
+
+def _parse_dates(dates):
+    dates = dates.astype(str)
+    gdelt = dates.str.match(r'^\d{8}T\d{6}Z$')
+    parsed = pd.to_datetime(dates.where(~gdelt), errors='coerce', format='mixed')
+    parsed[gdelt] = pd.to_datetime(dates[gdelt], format='%Y%m%dT%H%M%SZ')
+    return pd.DatetimeIndex(parsed)
+
+
+def migrate_data_dir(store, data_dir='data', news_dir=None, chunksize=20000):
+    """
+    Imports the legacy CSV files into the store. Importing twice is harmless, rows are upserted.
+
+    Args:
+        store (TimeSeriesStore): The store to import into.
+        data_dir (str, optional): The folder of btc_data.csv, sentiment_scores.csv and predictions.csv. Defaults to 'data'.
+        news_dir (str, optional): A folder of news CSV files (e.g. the partitions of `combine_news_data`). Defaults to None.
+        chunksize (int, optional): The number of news rows imported at a time. Defaults to 20000.
+
+    Returns:
+        dict: The number of rows imported per table.
+    """
+    imported = {}
+
+    btc_csv = os.path.join(data_dir, 'btc_data.csv')
+    if os.path.exists(btc_csv):
+        bars = pd.read_csv(btc_csv, index_col='Date', parse_dates=['Date'])
+        imported['bars'] = store.upsert_bars(bars, '1d') ## Indicators are derived from the bars, they are not stored
+
+    sentiment_csv = os.path.join(data_dir, 'sentiment_scores.csv')
+    if os.path.exists(sentiment_csv):
+        imported['daily_sentiment'] = store.upsert_daily_sentiment(pd.read_csv(sentiment_csv, index_col='Date'))
+
+    predictions_csv = os.path.join(data_dir, 'predictions.csv')
+    if os.path.exists(predictions_csv) and os.path.getsize(predictions_csv) > 0:
+        imported['predictions'] = store.predictions.import_csv(predictions_csv, if_empty=True)
+
+    if news_dir is not None:
+        imported['articles'] = 0
+        for filename in sorted(os.listdir(news_dir)):
+            if filename.endswith('.csv'):
+                for chunk in pd.read_csv(os.path.join(news_dir, filename), dtype=str, chunksize=chunksize):
+                    imported['articles'] += store.upsert_articles(chunk.dropna(subset=['url', 'category', 'publish_date']))
+
+    print(f"Imported into {store.path}: {imported}")
+    return imported
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manage the BitAnalytica time-series store.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subparsers.add_parser('migrate', help='Import the legacy CSV files')
+    migrate_parser.add_argument('--data-dir', default='data')
+    migrate_parser.add_argument('--news-dir', default=None)
+    migrate_parser.add_argument('--store', default=STORE_PATH)
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        migrate_data_dir(TimeSeriesStore(args.store), args.data_dir, args.news_dir)
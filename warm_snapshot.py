@@ -0,0 +1,209 @@
+"""
+Author: Zeeshan Hameed
+
+Warm-start snapshot of everything a serving container loads at boot, built once at image build time.
+
+The snapshot directory holds the NLTK corpora, the FinBERT tokenizer and model saved as safetensors, and the
+precomputed market and sentiment state (raw daily and hourly bars, daily indicators, daily sentiment). A
+container booting from it only reads local files: the NLTK index and the Hugging Face hub are never contacted,
+and Yahoo Finance is only asked for the bars added since the snapshot was built.
+
+The trained models already ship in `models/` and keep being served by the `ModelRegistry`, so a new active
+version is still picked up without rebuilding the snapshot.
+
+Usage:
+    python warm_snapshot.py build --snapshot-dir snapshot
+    python warm_snapshot.py boot --snapshot-dir snapshot   ### Boot-time breakdown from the snapshot
+    python warm_snapshot.py boot --cold                    ### Boot-time breakdown without it
+"""
+
+import argparse
+import json
+import os
+import pickle
+import shutil
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from config import LLM, NLTK_PACKAGES, WARM_SNAPSHOT_DIR
+from metrics import timer
+
+SNAPSHOT_MANIFEST = 'snapshot.json'
+NLTK_DIR = 'nltk_data'
+SENTIMENT_MODEL_DIR = 'sentiment_model'
+MARKET_STATE = 'state/market.pkl'
+SENTIMENT_STATE = 'state/sentiment.pkl'
+
+
+@contextmanager
+def _stage(name, breakdown):
+    """
+    Times a boot stage into the breakdown and the `boot_<name>` metric.
+    """
+    start = time.perf_counter()
+    with timer(f'boot_{name}', f'Boot time spent on {name.replace("_", " ")}'):
+        yield
+    breakdown[name] = time.perf_counter() - start
+
+
+def has_snapshot(snapshot_dir=WARM_SNAPSHOT_DIR):
+    """
+    Returns whether a complete snapshot exists in the directory.
+
+    Args:
+        snapshot_dir (str, optional): The snapshot directory. Defaults to WARM_SNAPSHOT_DIR.
+
+    Returns:
+        bool: True if the snapshot was fully built.
+    """
+    return os.path.exists(os.path.join(snapshot_dir, SNAPSHOT_MANIFEST))
+
+
+def build_snapshot(snapshot_dir=WARM_SNAPSHOT_DIR, llm=LLM, sentiment_days=30):
+    """
+    Pre-fetches every boot resource into the snapshot directory. The snapshot is built next to the directory
+    and swapped in at the end, so an interrupted build never leaves a partial snapshot behind.
+
+    Args:
+        snapshot_dir (str, optional): The snapshot directory. Defaults to WARM_SNAPSHOT_DIR.
+        llm (str, optional): The sentiment model of the hub to snapshot. Defaults to LLM.
+        sentiment_days (int, optional): The days of daily sentiment kept from the store. Defaults to 30.
+
+    Returns:
+        dict: The snapshot manifest.
+    """
+    import nltk
+    from transformers import BertTokenizerFast, BertForSequenceClassification
+    from btc_data_pipeline import BitcoinDataPipeline
+    from timeseries_store import TimeSeriesStore
+
+    staging = snapshot_dir.rstrip('/') + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(os.path.join(staging, 'state'))
+
+    for package in NLTK_PACKAGES:
+        if not nltk.download(package, download_dir=os.path.join(staging, NLTK_DIR), quiet=True):
+            raise RuntimeError(f"Failed to download the NLTK package {package}")
+
+    model_dir = os.path.join(staging, SENTIMENT_MODEL_DIR)
+    BertTokenizerFast.from_pretrained(llm).save_pretrained(model_dir) ## tokenizer.json for the fast tokenizer, vocab.txt for the Python one
+    BertForSequenceClassification.from_pretrained(llm).save_pretrained(model_dir, safe_serialization=True)
+
+    bitcoinDataPipeline = BitcoinDataPipeline()
+    bitcoinDataPipeline.getLatestBitcoinData()
+    bitcoinDataPipeline.updateBaseSeries()
+    with open(os.path.join(staging, MARKET_STATE), 'wb') as f:
+        pickle.dump({
+            'daily_bars': bitcoinDataPipeline.dailyBars,
+            'daily': bitcoinDataPipeline.btc,
+            'hourly_bars': bitcoinDataPipeline.timeframes.base,
+        }, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    start = (datetime.now() - timedelta(days=sentiment_days)).strftime('%Y-%m-%d')
+    with open(os.path.join(staging, SENTIMENT_STATE), 'wb') as f:
+        pickle.dump(TimeSeriesStore().read_daily_sentiment(start=start), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    manifest = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'llm': llm,
+        'nltk_packages': list(NLTK_PACKAGES),
+        'last_daily_bar': str(bitcoinDataPipeline.dailyBars.index[-1]),
+        'last_hourly_bar': str(bitcoinDataPipeline.timeframes.base.index[-1]),
+    }
+    with open(os.path.join(staging, SNAPSHOT_MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    shutil.rmtree(snapshot_dir, ignore_errors=True)
+    os.replace(staging, snapshot_dir)
+    print(f"Built the warm snapshot in {snapshot_dir} ({_size_mb(snapshot_dir):.0f} MB)")
+    return manifest
+
+
+def boot(snapshot_dir=WARM_SNAPSHOT_DIR, store=None):
+    """
+    Creates the pipelines and the model registry, from the snapshot if one is given, and measures every stage.
+
+    Without a snapshot this is the cold path: the NLTK corpora are downloaded, FinBERT is loaded through the hub
+    cache and every bar is downloaded from Yahoo Finance.
+
+    Args:
+        snapshot_dir (str, optional): The snapshot directory, or None for a cold boot. Defaults to WARM_SNAPSHOT_DIR.
+        store (TimeSeriesStore, optional): The store the pipelines read from and write to. Defaults to None.
+
+    Returns:
+        textDataPipeline (TextDataPipeline): The pipeline for text data processing.
+        bitcoinDataPipeline (BitcoinDataPipeline): The pipeline for Bitcoin data processing.
+        modelRegistry (ModelRegistry): The registry serving the active version of the models, already loaded.
+        breakdown (dict): The seconds spent on each stage ('nltk', 'sentiment_model', 'models', 'market_state',
+            'sentiment_state').
+    """
+    breakdown = {}
+
+    with _stage('nltk', breakdown):
+        import nltk
+        if snapshot_dir is not None:
+            nltk_dir = os.path.abspath(os.path.join(snapshot_dir, NLTK_DIR))
+            os.environ['NLTK_DATA'] = nltk_dir ## Inherited by the cleaning worker processes
+            nltk.data.path.insert(0, nltk_dir)
+        else:
+            for package in NLTK_PACKAGES:
+                nltk.download(package, quiet=True)
+
+    with _stage('sentiment_model', breakdown):
+        from text_data_pipeline import TextDataPipeline
+        ### The weights are read from the snapshot, the sentiment is still stored and cached under LLM
+        model_path = os.path.join(snapshot_dir, SENTIMENT_MODEL_DIR) if snapshot_dir is not None else None
+        textDataPipeline = TextDataPipeline(LLM, download_nltk=False, store=store, model_path=model_path)
+
+    with _stage('models', breakdown):
+        from model_registry import ModelRegistry
+        modelRegistry = ModelRegistry()
+        modelRegistry.current()
+
+    with _stage('market_state', breakdown):
+        from btc_data_pipeline import BitcoinDataPipeline, TimeframeCache
+        bitcoinDataPipeline = BitcoinDataPipeline(store)
+        if snapshot_dir is not None:
+            with open(os.path.join(snapshot_dir, MARKET_STATE), 'rb') as f:
+                state = pickle.load(f)
+            bitcoinDataPipeline.dailyBars = state['daily_bars']
+            bitcoinDataPipeline.btc = state['daily']
+            bitcoinDataPipeline.timeframes = TimeframeCache(state['hourly_bars'])
+        else:
+            bitcoinDataPipeline.getLatestBitcoinData()
+            bitcoinDataPipeline.updateBaseSeries()
+
+    with _stage('sentiment_state', breakdown):
+        if snapshot_dir is not None:
+            with open(os.path.join(snapshot_dir, SENTIMENT_STATE), 'rb') as f:
+                sentiment = pickle.load(f)
+            if not sentiment.empty:
+                textDataPipeline.sentimentScores = sentiment
+        else:
+            textDataPipeline.getCachedSentimentScores()
+
+    print(f"{'Warm' if snapshot_dir is not None else 'Cold'} boot in {sum(breakdown.values()):.1f}s: "
+          + ', '.join(f"{name} {seconds:.2f}s" for name, seconds in breakdown.items()))
+    return textDataPipeline, bitcoinDataPipeline, modelRegistry, breakdown
+
+
+def _size_mb(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names) / 2**20
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or measure the warm-start snapshot.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='Pre-fetch every boot resource into the snapshot directory')
+    build_parser.add_argument('--snapshot-dir', default=WARM_SNAPSHOT_DIR)
+    build_parser.add_argument('--llm', default=LLM)
+    boot_parser = subparsers.add_parser('boot', help='Boot the pipelines and print the boot-time breakdown')
+    boot_parser.add_argument('--snapshot-dir', default=WARM_SNAPSHOT_DIR)
+    boot_parser.add_argument('--cold', action='store_true', help='Boot without the snapshot')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_snapshot(args.snapshot_dir, args.llm)
+    else:
+        _, _, _, breakdown = boot(None if args.cold else args.snapshot_dir)
+        print(json.dumps(breakdown, indent=2))